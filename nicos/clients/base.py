@@ -31,12 +31,14 @@ import errno
 import hashlib
 import socket
 import threading
+from collections import deque
 from time import time as currenttime
 
 from nicos.clients.proto.classic import ClientTransport
 from nicos.protocols.daemon import ACTIVE_COMMANDS, ProtocolError
 from nicos.protocols.daemon.classic import COMPATIBLE_PROTO_VERSIONS, \
     PROTO_VERSION
+from nicos.protocols.daemon.livedata import LiveFrameDecoder
 from nicos.pycompat import PY2, b64decode, b64encode, to_utf8
 from nicos.utils import createThread
 
@@ -54,6 +56,22 @@ class ErrorResponse(Exception):
     pass
 
 
+class ChunkedReply(object):
+    """State of a response that is sent as several replies (see
+    `NicosClient.ask_chunks`).
+    """
+
+    def __init__(self):
+        # replies received, but not yet yielded
+        self.chunks = deque()
+        # set when the final reply has been received
+        self.done = False
+        # error reply of the daemon, if any
+        self.error = None
+        # set when the caller stopped iterating: discard further replies
+        self.discard = False
+
+
 class ConnectionData(object):
     def __init__(self, host, port, user, password, viewonly=False):
         self.host = host
@@ -76,6 +94,15 @@ class NicosClient(object):
     RECONNECT_INTERVAL_SHORT = 500  # in ms
     RECONNECT_INTERVAL_LONG = 2000
 
+    # encodings of live data frames requested from the daemon
+    live_encodings = ('zlib', 'delta')
+    # events of which only the latest data should be sent ("livedata" and/or
+    # "cache"), and the maximum number of live data sets per second
+    conflate_events = ()
+    live_maxrate = None
+    # if set, cache events are received in batches collected for this time
+    cache_batch_window = None
+
     def __init__(self, log_func):
         self.host = ''
         self.port = 0
@@ -93,8 +120,13 @@ class NicosClient(object):
         self.viewonly = True
         self.user_level = None
         self.last_action_at = 0
+        self.live_decoder = None
+        # cache keys to get events for (None: all keys)
+        self.cache_keys = None
 
         self.transport = ClientTransport()
+        # chunked response that is still being received
+        self._chunked = None
 
     def signal(self, name, *args):
         # must be overwritten
@@ -130,6 +162,7 @@ class NicosClient(object):
             if 'daemon_version' not in banner:
                 raise ProtocolError('daemon version missing from response')
             daemon_proto = banner.get('protocol_version', 0)
+            self.compat_proto = 0
             if daemon_proto != PROTO_VERSION:
                 if daemon_proto in COMPATIBLE_PROTO_VERSIONS:
                     self.compat_proto = daemon_proto
@@ -180,6 +213,18 @@ class NicosClient(object):
         if eventmask:
             self.tell('eventmask', eventmask)
 
+        self.live_decoder = None
+        if self.live_encodings and self.daemon_supports(22):
+            if self.ask('liveencoding', list(self.live_encodings)):
+                self.live_decoder = LiveFrameDecoder()
+        if self.conflate_events and self.daemon_supports(23):
+            self.ask('eventconflate', list(self.conflate_events),
+                     self.live_maxrate)
+        if self.cache_keys is not None and self.daemon_supports(24):
+            self.ask('cachesubscribe', sorted(self.cache_keys))
+        if self.cache_batch_window and self.daemon_supports(25):
+            self.ask('eventbatch', self.cache_batch_window)
+
         self.transport.connect_events(conndata)
 
         # start event handler
@@ -192,6 +237,10 @@ class NicosClient(object):
         self.daemon_info = banner
         self.signal('connected')
 
+    def daemon_supports(self, proto):
+        """Return true if the daemon implements protocol version *proto*."""
+        return not self.compat_proto or self.compat_proto >= proto
+
     def event_handler(self):
         while 1:
             try:
@@ -204,7 +253,17 @@ class NicosClient(object):
                     self.signal('broken', 'Server connection broken.')
                     self._close()
                 return
+            if event == 'cachebatch':
+                # pass on the single cache events
+                for item in data:
+                    try:
+                        self.signal('cache', item)
+                    except Exception as err:
+                        self.log_func('Error in event handler: %s' % err)
+                continue
             try:
+                if event == 'livedata' and self.live_decoder:
+                    data = self.live_decoder.decode(data)
                 self.signal(event, data)
             except Exception as err:
                 self.log_func('Error in event handler: %s' % err)
@@ -220,6 +279,7 @@ class NicosClient(object):
 
     def _close(self):
         self.transport.disconnect()
+        self._chunked = None
         self.gzip = False
         if self.isconnected:
             self.isconnected = False
@@ -259,6 +319,7 @@ class NicosClient(object):
             return
         try:
             with self.lock:
+                self._drain_chunks()
                 self.transport.send_command(command, args)
                 success, data = self.transport.recv_reply()
                 if not success:
@@ -290,6 +351,7 @@ class NicosClient(object):
             return kwds.get('default')
         try:
             with self.lock:
+                self._drain_chunks()
                 self.transport.send_command(command, args)
                 success, data = self.transport.recv_reply()
                 if not success:
@@ -302,6 +364,68 @@ class NicosClient(object):
             self.handle_error(err)
             return kwds.get('default')
 
+    def ask_chunks(self, command, *args):
+        """Execute a command whose response is sent as several replies, and
+        yield the replies.  An empty reply ends the response.
+
+        Every reply is yielded as soon as it has been received, and the
+        connection is not locked while the caller processes it.  If other
+        commands are sent meanwhile, the replies still to come are received
+        and kept until they are yielded.  Errors are handled like in `ask`,
+        and end the iteration.
+        """
+        if not self.isconnected:
+            self.signal('error', 'You are not connected to a server.')
+            return
+        reply = ChunkedReply()
+        try:
+            with self.lock:
+                self._drain_chunks()
+                self.transport.send_command(command, args)
+                self._chunked = reply
+            while True:
+                with self.lock:
+                    if not reply.chunks and not reply.done:
+                        self._recv_chunk()
+                    if reply.chunks:
+                        data = reply.chunks.popleft()
+                    elif reply.error:
+                        raise reply.error
+                    else:
+                        return
+                yield data
+        except (Exception, KeyboardInterrupt) as err:
+            self.handle_error(err)
+        finally:
+            # the rest of the response is skipped by the next command
+            reply.discard = True
+            reply.chunks.clear()
+
+    def _recv_chunk(self):
+        # must be called with the lock held: receive the next reply of the
+        # chunked response
+        reply = self._chunked
+        try:
+            success, data = self.transport.recv_reply()
+        except Exception:
+            self._chunked = None
+            reply.done = True
+            raise
+        if not success or not data:
+            self._chunked = None
+            reply.done = True
+            if not success:
+                reply.error = ErrorResponse(data)
+        elif not reply.discard:
+            reply.chunks.append(data)
+
+    def _drain_chunks(self):
+        # must be called with the lock held, before sending a command: receive
+        # the rest of a chunked response, whose replies would be mixed up with
+        # the reply to the command otherwise
+        while self._chunked is not None:
+            self._recv_chunk()
+
     def run(self, code, filename=None, noqueue=False):
         """Run a piece of code."""
         self.last_action_at = currenttime()
@@ -413,6 +537,29 @@ class NicosClient(object):
                 return item
         return None
 
+    def subscribeCacheKeys(self, keys):
+        """Receive "cache" events only for keys containing one of *keys*.
+
+        The subscriptions are kept when reconnecting.  With daemons that do
+        not support this, events for all keys are still received.
+        """
+        if self.cache_keys is None:
+            self.cache_keys = set()
+        self.cache_keys.update(key.lower() for key in keys)
+        if self.isconnected and self.daemon_supports(24):
+            self.ask('cachesubscribe', list(keys))
+
+    def unsubscribeCacheKeys(self, keys=None):
+        """Remove subscriptions for the given keys, or all subscriptions
+        (and receive events for all keys again) if *keys* is None.
+        """
+        if keys is None:
+            self.cache_keys = None
+        elif self.cache_keys is not None:
+            self.cache_keys.difference_update(key.lower() for key in keys)
+        if self.isconnected and self.daemon_supports(24):
+            self.ask('cacheunsubscribe', list(keys or []))
+
     def getDeviceParam(self, devname, param):
         """Return value of a specific device parameter from cache."""
         ret = self.getCacheKey(devname.lower() + '/' + param)
@@ -47,6 +47,11 @@ class NicosGuiClient(NicosClient, QObject):
     for evt in DAEMON_EVENTS:
         locals()[evt] = pyqtSignal(object)
 
+    # only the latest live data is displayed anyway
+    conflate_events = ('livedata',)
+    # collect cache updates for 50 ms, which is not noticeable on displays
+    cache_batch_window = 0.05
+
     def __init__(self, parent, parent_logger):
         QObject.__init__(self, parent)
         logger = NicosLogger('client')
@@ -29,13 +29,22 @@ from __future__ import absolute_import, division, print_function
 import copy
 import uuid
 from itertools import chain
+from os import path
 
 import numpy as np
 
+from nicos.core.data import ScanData
 from nicos.guisupport.qt import QApplication, QObject, QProgressDialog, \
     pyqtSignal
+from nicos.pycompat import cPickle as pickle, iteritems
+from nicos.utils import ensureDirectory, safeWriteFile
 from nicos.utils.fitting import FitResult
 
+# attributes of the datasets kept in the local cache
+CACHED_ATTRS = ['uid', 'started', 'scaninfo', 'counter', 'filepaths',
+                'xindex', 'envvalues', 'continuation', 'xvalueinfo',
+                'yvalueinfo', 'headerinfo', 'xresults', 'yresults']
+
 
 class DataError(Exception):
     pass
@@ -106,6 +115,9 @@ class DataHandler(QObject):
     pointsAdded = pyqtSignal(object)
     fitAdded = pyqtSignal(object, object)
 
+    # directory for the local cache of datasets, None to disable it
+    cachedir = path.join(path.expanduser('~'), '.config', 'nicos', 'datasets')
+
     def __init__(self, client):
         QObject.__init__(self)
         self.client = client
@@ -114,8 +126,11 @@ class DataHandler(QObject):
         self.dependent = []
         self.currentset = None
         self.bulk_adding = False
+        # uids of datasets not received from the daemon
+        self.local_uids = set()
 
         self.client.connected.connect(self.on_client_connected)
+        self.client.disconnected.connect(self.on_client_disconnected)
         self.client.dataset.connect(self.on_client_dataset)
         self.client.datapoint.connect(self.on_client_datapoint)
         self.client.datacurve.connect(self.on_client_datacurve)
@@ -128,17 +143,102 @@ class DataHandler(QObject):
         pd.setCancelButton(None)
         pd.show()
         QApplication.processEvents()
-        datasets = self.client.ask('getdataset', '*', default=[])
+        if self.client.daemon_supports(26):
+            self._sync_datasets()
+        else:
+            datasets = self.client.ask('getdataset', '*', default=[])
+            self.bulk_adding = True
+            for dataset in datasets:
+                try:
+                    self.on_client_dataset(dataset)
+                except Exception:
+                    from nicos.clients.gui.main import log
+                    log.error('Error adding dataset', exc=1)
+            self.bulk_adding = False
+        pd.setValue(1)
+        pd.close()
+
+    def on_client_disconnected(self):
+        self._save_cache()
+
+    def _sync_datasets(self):
+        """Get only the datasets and points that are not yet known from the
+        daemon.
+
+        The known datasets are the ones already shown, or after a restart of
+        the GUI, the ones from the local cache.
+        """
+        cached = {} if self.sets else self._load_cache()
+        known = dict((uid, len(dataset.yresults)) for (uid, dataset) in
+                     chain(iteritems(cached), iteritems(self.uid2set)))
+        entries = self.client.ask('syncdatasets', known, default=[])
         self.bulk_adding = True
-        for dataset in datasets:
+        for entry in entries:
             try:
-                self.on_client_dataset(dataset)
+                if isinstance(entry, ScanData):
+                    self.on_client_dataset(entry)
+                    continue
+                uid, npoints, xresults, yresults = entry
+                dataset = self.uid2set.get(uid)
+                if dataset is None:
+                    dataset = cached[uid]
+                    # the last point may have been unfinished
+                    del dataset.xresults[npoints:]
+                    dataset.xresults.extend(xresults)
+                    dataset.yresults.extend(yresults)
+                    self.on_client_dataset(dataset)
+                elif xresults:
+                    del dataset.xresults[npoints:]
+                    for xvalues, yvalues in zip(xresults, yresults):
+                        dataset.xresults.append(xvalues)
+                        dataset.yresults.append(yvalues)
+                        self._update_curves(dataset, xvalues, yvalues)
+                    self.pointsAdded.emit(dataset)
             except Exception:
                 from nicos.clients.gui.main import log
                 log.error('Error adding dataset', exc=1)
         self.bulk_adding = False
-        pd.setValue(1)
-        pd.close()
+        self._save_cache()
+
+    def _cachefile(self):
+        if not self.cachedir or not self.client.host:
+            return None
+        return path.join(self.cachedir, 'datasets-%s-%s' % (self.client.host,
+                                                            self.client.port))
+
+    def _load_cache(self):
+        """Return the cached datasets for the current daemon, by uid."""
+        filename = self._cachefile()
+        if not filename or not path.isfile(filename):
+            return {}
+        try:
+            with open(filename, 'rb') as fp:
+                states = pickle.load(fp)
+        except Exception:
+            from nicos.clients.gui.main import log
+            log.warning('could not read cached datasets', exc=1)
+            return {}
+        datasets = {}
+        for state in states:
+            dataset = ScanData()
+            dataset.__dict__.update(state)
+            datasets[dataset.uid] = dataset
+        return datasets
+
+    def _save_cache(self):
+        filename = self._cachefile()
+        if not filename:
+            return
+        states = [dict((key, getattr(dataset, key)) for key in CACHED_ATTRS)
+                  for dataset in self.sets
+                  if dataset.uid not in self.local_uids]
+        try:
+            ensureDirectory(self.cachedir)
+            safeWriteFile(filename, pickle.dumps(states, 2), 'wb',
+                          maxbackups=0)
+        except Exception:
+            from nicos.clients.gui.main import log
+            log.warning('could not write cached datasets', exc=1)
 
     def on_client_dataset(self, dataset):
         self.sets.append(dataset)
@@ -161,6 +261,7 @@ class DataHandler(QObject):
 
     def add_existing_dataset(self, dataset, origins=()):
         dataset.uid = str(uuid.uuid1())
+        self.local_uids.add(dataset.uid)
         self.sets.append(dataset)
         self.uid2set[dataset.uid] = dataset
         self.datasetAdded.emit(dataset)
@@ -32,7 +32,8 @@ import json
 import operator
 import os
 import sys
-from collections import OrderedDict
+from collections import Counter, OrderedDict
+from itertools import chain
 from time import localtime, mktime, time as currenttime
 
 from nicos.clients.gui.panels import Panel
@@ -107,6 +108,11 @@ class View(QObject):
         # + 60 seconds: get all values, also those added while querying
         hist_totime = self.totime or currenttime() + 60
         hist_cache = {}
+        # values closer than the interval are not plotted anyway, so let the
+        # cache reduce the history accordingly
+        if fromtime is not None:
+            maxpoints = int(min((hist_totime - fromtime) / max(interval, 0.1),
+                                TimeSeries.maxsize))
 
         iterator = enumerate(keys_indices)
         if fromtime is not None:
@@ -114,6 +120,9 @@ class View(QObject):
                                              'Querying history...',
                                              force_display=True)
 
+        # the history of keys that are shown several times must be kept
+        keycount = Counter(key for (key, _, _, _) in keys_indices)
+
         for _, (key, index, scale, offset) in iterator:
             real_indices = [index]
             history = None
@@ -121,8 +130,12 @@ class View(QObject):
 
             if fromtime is not None:
                 if key not in hist_cache:
-                    history = query_func(key, self.fromtime, hist_totime)
-                    if not history:
+                    # the history can be an iterator that receives the values
+                    # while they are added to the time series
+                    history = iter(query_func(key, self.fromtime, hist_totime,
+                                              maxpoints))
+                    first = next(history, None)
+                    if first is None:
                         from nicos.clients.gui.main import log
                         if log is None:
                             from __main__ import log  # pylint: disable=no-name-in-module
@@ -132,16 +145,21 @@ class View(QObject):
                                             'there are no values to show.\n'
                                             'Is it spelled correctly?' % key)
                         history = []
-                    hist_cache[key] = history
+                    else:
+                        history = chain([first], history)
+                        if keycount[key] > 1:
+                            history = list(history)
+                    hist_cache[key] = first, history
                 else:
-                    history = hist_cache[key]
+                    first, history = hist_cache[key]
                 # if the value is a list/tuple and we don't have an index
                 # specified, add a plot for each item
-                if history:
-                    first_value = history[0][1]
+                if first is not None:
+                    first_value = first[1]
                     if not index and isinstance(first_value, (list, tuple)):
                         real_indices = tuple((i,) for i in
                                              range(len(first_value)))
+                        history = list(history)
             for index in real_indices:
                 name = '%s[%s]' % (key, ','.join(map(str, index))) if index else key
                 series = TimeSeries(name, interval, scale, offset, window,
@@ -1143,9 +1161,21 @@ class HistoryPanel(BaseHistoryWindow, Panel):
         self.client.cache.disconnect(self.newvalue_callback)
         return True
 
-    def gethistory_callback(self, key, fromtime, totime):
-        return self.client.ask('gethistory', key, str(fromtime), str(totime),
-                               default=[])
+    def gethistory_callback(self, key, fromtime, totime, maxpoints=None):
+        args = [key, str(fromtime), str(totime)]
+        compat_proto = self.client.compat_proto
+        # daemons with an older protocol do not accept maxpoints and chunksize
+        if compat_proto and compat_proto < 20:
+            return self.client.ask('gethistory', *args, default=[])
+        args.append(maxpoints and str(maxpoints) or None)
+        if compat_proto == 20:
+            return self.client.ask('gethistory', *args, default=[])
+        # let the daemon pass on the history in chunks, instead of collecting
+        # and sending it all at once; the values of each chunk are added to
+        # the time series before the next chunk is received
+        return (entry for chunk in
+                self.client.ask_chunks('gethistory', *(args + ['1000']))
+                for entry in chunk)
 
     def on_client_disconnected(self):
         self._disconnected_since = currenttime()
@@ -1216,8 +1246,8 @@ class StandaloneHistoryWindow(DlgUtils, BaseHistoryWindow, QMainWindow):
         self.statusBar = QStatusBar(self)
         self.setStatusBar(self.statusBar)
 
-    def gethistory_callback(self, key, fromtime, totime):
-        return self.app.history(None, key, fromtime, totime)
+    def gethistory_callback(self, key, fromtime, totime, maxpoints=None):
+        return self.app.history(None, key, fromtime, totime, maxpoints)
 
     def closeEvent(self, event):
         self.saveSettings(self.settings)
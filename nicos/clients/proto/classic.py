@@ -28,13 +28,11 @@ from __future__ import absolute_import, division, print_function
 import socket
 import uuid
 
-import numpy as np
-
 from nicos.protocols.daemon import DAEMON_EVENTS, \
     ClientTransport as BaseClientTransport, ProtocolError
 from nicos.protocols.daemon.classic import ACK, ENQ, LENGTH, NAK, \
-    READ_BUFSIZE, SERIALIZERS, STX, code2event, command2code
-from nicos.pycompat import memory_buffer
+    SERIALIZERS, STX, code2event, command2code
+from nicos.pycompat import PY2, memory_buffer
 from nicos.utils import closeSocket, tcpSocket
 
 
@@ -90,12 +88,7 @@ class ClientTransport(BaseClientTransport):
             raise ProtocolError('invalid response %r' % start)
         # it has a length...
         length, = LENGTH.unpack(start[1:])
-        buf = b''
-        while len(buf) < length:
-            read = self.sock.recv(READ_BUFSIZE)
-            if not read:
-                raise ProtocolError('connection broken')
-            buf += read
+        buf = self._recv_payload(self.sock, length, 'connection broken')
 
         if not self.serializer:  # determine serializer class automatically
             for serializercls in SERIALIZERS.values():
@@ -122,20 +115,29 @@ class ClientTransport(BaseClientTransport):
         if start[0:1] != STX:
             raise ProtocolError('wrong event header')
         length, = LENGTH.unpack(start[3:])
-        got = 0
-        # read into a pre-allocated buffer to avoid copying lots of data
-        # around several times
-        buf = np.zeros(length, 'c')  # Py3: replace with bytearray+memoryview
-        while got < length:
-            read = self.event_sock.recv_into(buf[got:], length - got)
-            if not read:
-                raise ProtocolError('read: event connection broken')
-            got += read
+        buf = self._recv_payload(self.event_sock, length,
+                                 'read: event connection broken')
         # XXX: error handling
         event = code2event[start[1:3]]
         # serialized or raw event data?
         if DAEMON_EVENTS[event][0]:
-            data = self.serializer.deserialize_event(buf.tostring(), event)
+            data = self.serializer.deserialize_event(buf, event)
         else:
             data = event, memory_buffer(buf)
         return data
+
+    def _recv_payload(self, sock, length, errmsg):
+        # read into a pre-allocated buffer to avoid copying lots of data
+        # around several times; the serializer can use the buffer directly
+        buf = bytearray(length)
+        view = memoryview(buf)
+        got = 0
+        while got < length:
+            read = sock.recv_into(view[got:], length - got)
+            if not read:
+                raise ProtocolError(errmsg)
+            got += read
+        if PY2:
+            # the unpicklers need a string
+            return bytes(buf)
+        return buf
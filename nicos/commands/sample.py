@@ -36,7 +36,6 @@ from nicos import session
 from nicos.commands import helparglist, parallel_safe, usercommand
 from nicos.commands.analyze import CommandLineFitResult
 from nicos.core import ConfigurationError, UsageError
-from nicos.devices.tas.spacegroups import can_reflect, get_spacegroup
 # pylint: disable=redefined-builtin
 from nicos.pycompat import iteritems, urllib
 from nicos.utils import printTable
@@ -398,6 +397,8 @@ def powderfit(powder, scans=None, peaks=None, ki=None, dmono=3.355,
                              'lattice constant')
         a = powder
 
+    # importing the TAS package takes some time, do it only when needed
+    from nicos.devices.tas.spacegroups import can_reflect, get_spacegroup
     sg = get_spacegroup(spacegroup)
     # calculate (possible) d-values
     # loop through some hkl-sets, also consider higher harmonics...
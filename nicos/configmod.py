@@ -54,13 +54,17 @@ class config(object):
     setup_subdirs = None  # setup groups to be used like 'panda,frm2'
     pid_path = 'pid'
     logging_path = 'log'
+    setup_cache_path = ''  # cache of the setup info, disabled by default
     systemd_props = ''  # additional systemd Service properties
     systemd_network_timeout = 10  # timeout for finding a hostname in systemd
 
     simple_mode = False
     sandbox_simulation = False
     sandbox_simulation_debug = False
+    simulation_pool_size = 0
     services = 'cache,poller'
+    cache_coalesce_window = 0.0
+    device_creation_threads = 1
     keystorepaths = ['/etc/nicos/keystore', '~/.config/nicos/keystore']
 
     @classmethod
@@ -80,9 +84,12 @@ class config(object):
                 return val.lower() in ('yes', 'true', 'on')
             return val
 
-        # Type-coerce booleans.
+        # Type-coerce booleans and numbers.
         cls.simple_mode = to_bool(cls.simple_mode)
         cls.sandbox_simulation = to_bool(cls.sandbox_simulation)
+        cls.cache_coalesce_window = float(cls.cache_coalesce_window)
+        cls.device_creation_threads = int(cls.device_creation_threads)
+        cls.simulation_pool_size = int(cls.simulation_pool_size)
 
         # Apply environment variables.
         for key, value in environment.items():
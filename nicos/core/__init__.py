@@ -47,5 +47,6 @@ from nicos.core.params import INFO_CATEGORIES, ArrayDesc, Attach, Override, \
     setof, subdir, tacodev, tangodev, tupleof, vec3
 from nicos.core.scan import Scan
 from nicos.core.utils import ACCESS_LEVELS, ADMIN, GUEST, USER, User, \
-    formatStatus, multiReset, multiStatus, multiStop, multiWait, system_user, \
-    usermethod, waitForCompletion, watchdog_user
+    formatStatus, multiReset, multiStatus, multiStop, multiWait, \
+    notifyStatusChange, system_user, usermethod, waitForCompletion, \
+    watchdog_user
@@ -34,7 +34,7 @@ from nicos import session
 from nicos.core.constants import FINAL, INTERRUPTED, SIMULATION
 from nicos.core.errors import NicosError
 from nicos.core.params import Value
-from nicos.core.utils import waitForCompletion
+from nicos.core.utils import StatusWaiter, waitForCompletion
 from nicos.pycompat import reraise
 
 
@@ -80,7 +80,8 @@ def acquire(point, preset, iscompletefunc=None):
     """Low-level acquisition function.
 
     The loop delay is configurable in the instrument object, and defaults to
-    0.025 seconds.
+    0.025 seconds.  The detectors are checked right away if a status change of
+    one of them is notified (see `nicos.core.utils.notifyStatusChange`).
 
     The result is stored in the given argument, which must be an empty list.
     This is so that a result can be returned even when a stop exception is
@@ -122,6 +123,7 @@ def acquire(point, preset, iscompletefunc=None):
         session.endActionScope()
         raise
     session.delay(delay)
+    waiter = StatusWaiter(point.detectors)
     try:
         quality = None
         while True:
@@ -159,7 +161,7 @@ def acquire(point, preset, iscompletefunc=None):
             if iscompletefunc():  # stop via callback function
                 for det in detset:
                     det.stop()
-            session.delay(delay)
+            waiter.delay(delay)
     except BaseException as e:
         exc_info = sys.exc_info()
         point.finished = currenttime()
@@ -184,6 +186,7 @@ def acquire(point, preset, iscompletefunc=None):
                 det.log.exception('error saving measurement data')
         reraise(*exc_info)
     finally:
+        waiter.close()
         point.finished = currenttime()
         session.endActionScope()
 
@@ -29,6 +29,7 @@ from __future__ import absolute_import, division, print_function
 import inspect
 import re
 import sys
+from contextlib import contextmanager
 from time import time as currenttime
 
 import numpy
@@ -328,6 +329,10 @@ class Device(object):
     # at runtime.
     _sim_intercept = True
 
+    # Data read from the hardware for the next poll, together with the other
+    # devices of the poll group (see Readable.prefetchGroup).
+    _prefetched = None
+
     # Autogenerated inventory of the class' user methods.
     methods = {}
 
@@ -502,12 +507,15 @@ class Device(object):
 
         self._cache = self._getCache()
         lastconfig = None
+        # values of the device in the cache, and values to write back
+        cached = {}
+        corrected = {}
         if self._cache:
             lastconfig = self._cache.get('_lastconfig_', self._name, None)
-            old_classes = self._cache.get(self, 'classes')
+            cached = self._cache.get_device_values(self)
             new_classes = self.doReadClasses()
-            if old_classes != new_classes and self._mode == MASTER:
-                self._cache.put(self, 'classes', new_classes)
+            if cached.get('classes') != new_classes and self._mode == MASTER:
+                corrected['classes'] = new_classes
 
         def _init_param(param, paraminfo):
             param = param.lower()
@@ -520,9 +528,10 @@ class Device(object):
             value = Ellipsis
             # try to get from cache
             if self._cache:
-                value = self._cache.get(self, param, Ellipsis)
+                value = cached.get(param, Ellipsis)
                 if param == 'name':  # clean up legacy, wrong values
-                    self._cache.put(self, 'name', self._name)
+                    if value != self._name:
+                        corrected['name'] = self._name
                     value = self._name
                 if value is not Ellipsis:
                     try:
@@ -551,7 +560,7 @@ class Device(object):
                                 'since it was changed in the setup file',
                                 param, valuestr, cfgvstr)
                             value = cfgvalue
-                            self._cache.put(self, param, value)
+                            corrected[param] = value
                         elif prefercache:
                             self.log.warning(
                                 "value of '%s' from cache (%s) differs from "
@@ -563,7 +572,7 @@ class Device(object):
                                 'configured value (%s), using configured',
                                 param, valuestr, cfgvstr)
                             value = cfgvalue
-                            self._cache.put(self, param, value)
+                            corrected[param] = value
                 elif not paraminfo.settable and paraminfo.prefercache is False:
                     # parameter is in cache, but not in config: if it is not
                     # settable and has a default, use that (since most probably
@@ -580,7 +589,7 @@ class Device(object):
                             'default value (%s), using default',
                             param, valuestr, defvstr)
                         value = paraminfo.default
-                        self._cache.put(self, param, value)
+                        corrected[param] = value
                 umethod = getattr(self, 'doUpdate' + param.title(), None)
                 if umethod:
                     umethod(value)
@@ -614,12 +623,23 @@ class Device(object):
             else:
                 later.append((param, paraminfo))
 
+        if self._cache and corrected:
+            self._cache.put_many(self, corrected)
+            corrected.clear()
+
         if hasattr(self, 'doPreinit'):
             self.doPreinit(self._mode)
 
+        if self._cache:
+            # doPreinit may have changed values in the cache
+            cached = self._cache.get_device_values(self)
+
         for param, paraminfo in later:
             _init_param(param, paraminfo)
 
+        if self._cache and corrected:
+            self._cache.put_many(self, corrected)
+
         # warn about parameters that weren't present in cache
         if self._cache and notfromcache:
             self.log.info('these parameters were not present in cache: %s',
@@ -634,10 +654,10 @@ class Device(object):
                 if umethod:
                     def updateparam(key, value, time, umethod=umethod):
                         umethod(value)
-                    self._cache.addCallback(self, param, updateparam)
                     self._subscriptions.append((param, updateparam))
+            self._cache.addCallbacks(self, self._subscriptions)
 
-        if self._cache:
+        if self._cache and lastconfig != self._config:
             self._cache.put('_lastconfig_', self._name, self._config)
 
         # call custom initialization
@@ -759,7 +779,8 @@ class Device(object):
             # and rely on saved _params and values
             self._cache = None
 
-    def history(self, name='value', fromtime=None, totime=None):
+    def history(self, name='value', fromtime=None, totime=None,
+                maxpoints=None):
         """Return a history of the parameter *name* (can also be ``'value'`` or
         ``'status'``).
 
@@ -772,6 +793,10 @@ class Device(object):
           'YYYY-MM-DD', 'YYYY-MM-DD HH:MM' or 'YYYY-MM-DD HH:MM:SS'
 
         Default is to query the values of the last hour.
+
+        If *maxpoints* is given, the cache reduces the history to about that
+        many values, keeping the minimum and maximum values of each part of
+        the time window.
         """
         if not self._cache:
             # no cache is configured for this setup
@@ -789,7 +814,8 @@ class Device(object):
                 totime = parseDateString(totime, enddate=True)
             elif totime < 0:
                 totime = currenttime() + totime * 3600
-            return self._cache.history(self, name, fromtime, totime)
+            return self._cache.history(self, name, fromtime, totime,
+                                       maxpoints)
 
     def info(self):
         """Return "device information" as an iterable of tuples ``(name,
@@ -841,8 +867,7 @@ class Device(object):
 
             # remove subscriptions to parameter value updates
             if self._cache:
-                for param, func in self._subscriptions:
-                    self._cache.removeCallback(self, param, func)
+                self._cache.removeCallbacks(self, self._subscriptions)
 
             # execute custom shutdown actions
             if hasattr(self, 'doShutdown'):
@@ -968,6 +993,7 @@ class Readable(Device):
 
     * doReset()
     * doPoll(n, maxage)
+    * doPrefetchGroup(devices)
 
     Subclasses *can* override:
 
@@ -994,6 +1020,10 @@ class Readable(Device):
                               'when it is outside', settable=True, chatty=True,
                               unit='main', fmtstr='main',
                               type=none_or(tupleof(anytype, anytype))),
+        'pollgroup':    Param('Name of a group of devices that are polled '
+                              'together, with one request to the hardware if '
+                              'the device class supports it',
+                              type=none_or(str), userparam=False),
     }
 
     def init(self):
@@ -1205,6 +1235,40 @@ class Readable(Device):
         # self._cache.invalidate(self, 'status')
         return self.status(maxage), self.read(maxage)
 
+    @contextmanager
+    def prefetchGroup(self, devices):
+        """Context manager to poll the *devices* of the poll group of this
+        device with as few requests to the hardware as possible.
+
+        Within the context, the :meth:`poll` calls of the devices use the data
+        read by ``doPrefetchGroup`` instead of requesting it separately.  If
+        the data cannot be prefetched, the devices are polled as usual.
+
+        .. method:: doPrefetchGroup(devices)
+
+           If present, this method is called with the list of devices in the
+           poll group, which includes this device.  It should read the data
+           needed by ``doRead`` and ``doStatus`` of the devices in one
+           request, and return a dictionary mapping devices to their data.
+           The data is set as the ``_prefetched`` attribute of the devices,
+           where the device class can use it instead of accessing the
+           hardware.
+        """
+        if hasattr(self, 'doPrefetchGroup') and not self._sim_intercept:
+            try:
+                data = self.doPrefetchGroup(devices)
+            except Exception:
+                self.log.warning('error reading poll group %s, polling devices '
+                                 'separately', self.pollgroup, exc=1)
+            else:
+                for dev in devices:
+                    dev._prefetched = data.get(dev)
+        try:
+            yield
+        finally:
+            for dev in devices:
+                dev._prefetched = None
+
     @usermethod
     def reset(self):
         """Reset the device hardware.  Returns the new status afterwards.
@@ -2380,8 +2444,7 @@ class DeviceAlias(Device):
         if self._mode != SIMULATION:
             # remove subscriptions to parameter value updates
             if self._cache:
-                for param, func in self._subscriptions:
-                    self._cache.removeCallback(self, param, func)
+                self._cache.removeCallbacks(self, self._subscriptions)
         session.devices.pop(self._name, None)
         session.device_case_map.pop(self._name.lower(), None)
         session.explicit_devices.discard(self._name)
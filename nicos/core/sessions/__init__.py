@@ -38,6 +38,7 @@ import logging
 import os
 import stat
 import sys
+import threading
 from os import path
 from time import sleep, time as currenttime
 
@@ -50,7 +51,7 @@ from nicos.core.data import DataSink
 from nicos.core.device import Device, DeviceAlias, DeviceMeta
 from nicos.core.errors import AccessError, CacheError, ConfigurationError, \
     ModeError, NicosError, UsageError
-from nicos.core.sessions.setups import readSetups
+from nicos.core.sessions.setups import SetupCache, readSetups
 from nicos.core.sessions.utils import EXECUTIONMODES, MAINTENANCE, MASTER, \
     SIMULATION, SLAVE, AttributeRaiser, NicosNamespace, SimClock, \
     guessCorrectCommand, makeSessionId, sessionInfo
@@ -62,9 +63,9 @@ from nicos.devices.instrument import Instrument
 from nicos.devices.notifiers import Notifier
 from nicos.protocols.cache import FLAG_NO_STORE
 from nicos.pycompat import builtins, exec_, iteritems, itervalues, \
-    listvalues, string_types
-from nicos.utils import fixupScript, formatArgs, formatDocstring, \
-    formatScriptError, which
+    listvalues, queue, string_types
+from nicos.utils import createThread, fixupScript, formatArgs, \
+    formatDocstring, formatScriptError, which
 from nicos.utils.loggers import ColoredConsoleHandler, NicosLogfileHandler, \
     NicosLogger, get_facility_log_handlers, initLoggers
 
@@ -131,8 +132,22 @@ class Session(object):
         self._failed_devices = None
         self._success_devices = None
         self._multi_level = 0
+        # serializes the registration of devices created in parallel (see
+        # _createDevicesParallel); devices in creation, mapped to the thread
+        # creating them, and the devices threads wait for
+        self._creation_lock = threading.Condition(threading.RLock())
+        self._creating = {}
+        self._creation_waits = {}
+        # threads creating devices for loadSetup
+        self._creation_threads = set()
         # info about all loadable setups
         self._setup_info = {}
+        # persistent cache of the info read from the setup files
+        self._setup_cache = None
+        if config.setup_cache_path:
+            self._setup_cache = SetupCache(path.join(
+                config.nicos_root, config.setup_cache_path,
+                'setupinfo-py%d.pickle' % sys.version_info[0]))
         # namespace to place user-accessible items in
         self.namespace = NicosNamespace()
         # contains all NICOS-exported names
@@ -159,6 +174,8 @@ class Session(object):
         self._script_text = ''
         # will be filled with the path to the sandbox helper if necessary
         self._sandbox_helper = None
+        # simulation processes waiting for code (see runSimulation)
+        self._simulation_pool = None
 
         # cache connection
         self.cache = None
@@ -456,7 +473,7 @@ class Session(object):
         Setup modules are looked for in subdirectories of the configured
         "setup_package".
         """
-        return readSetups(self._setup_paths, self.log)
+        return readSetups(self._setup_paths, self.log, self._setup_cache)
 
     def getSetupInfo(self):
         """Return information about all existing setups.
@@ -686,9 +703,10 @@ class Session(object):
                 else:
                     self.cache.shutdown()
             if not reuse_cache:
-                self.cache = self.cache_class('Cache',
-                                              cache=normalized_cache,
-                                              prefix='nicos/', lowlevel=True)
+                self.cache = self.cache_class(
+                    'Cache', cache=normalized_cache, prefix='nicos/',
+                    lowlevel=True,
+                    coalescewindow=config.cache_coalesce_window)
                 # be notified about plug-and-play sample environment devices
                 self.cache.addPrefixCallback('se/', self._pnpHandler)
                 # be notified about watchdog events
@@ -707,15 +725,19 @@ class Session(object):
             autocreate_devices = self.autocreate_devices
         if autocreate_devices:
             self.log.debug('autocreating devices...')
-            for devname, (_, devconfig) in sorted(iteritems(devlist)):
-                try:
-                    lowlevel = devconfig.get('lowlevel', False)
-                    self.createDevice(devname, explicit=not lowlevel)
-                except Exception:
-                    if raise_failed:
-                        raise
-                    self.log.exception("device '%s' failed to create", devname)
-                    failed_devs.append(devname)
+            if config.device_creation_threads > 1 and len(devlist) > 1:
+                self._createDevicesParallel(devlist, raise_failed, failed_devs)
+            else:
+                for devname, (_, devconfig) in sorted(iteritems(devlist)):
+                    try:
+                        lowlevel = devconfig.get('lowlevel', False)
+                        self.createDevice(devname, explicit=not lowlevel)
+                    except Exception:
+                        if raise_failed:
+                            raise
+                        self.log.exception("device '%s' failed to create",
+                                           devname)
+                        failed_devs.append(devname)
 
         # validate and try to attach sysconfig devices
         self.log.debug('creating sysconfig devices...')
@@ -840,6 +862,8 @@ class Session(object):
 
     def shutdown(self):
         """Shut down the session: unload the setup and give up master mode."""
+        if self._simulation_pool:
+            self._simulation_pool.stop()
         if self._mode == MASTER and self.cache:
             self.cache._ismaster = False
             try:
@@ -1048,6 +1072,140 @@ class Session(object):
             self.deviceCallback('create', self._success_devices)
             self._success_devices = None
 
+    def _attachedDeviceNames(self, devname):
+        """Return the names of the devices configured as attached devices
+        of the device *devname*.
+        """
+        devcls, devconfig = self.importDevice(devname)
+        devconfig = {key.lower(): value for (key, value) in
+                     iteritems(devconfig)}
+        names = set()
+        for aname in devcls.attached_devices:
+            value = devconfig.get(aname.lower())
+            if isinstance(value, string_types):
+                names.add(value)
+            elif isinstance(value, (list, tuple)):
+                names.update(name for name in value
+                             if isinstance(name, string_types))
+        return names
+
+    def _createDevicesParallel(self, devlist, raise_failed, failed_devs):
+        """Create the devices of *devlist* with a pool of threads.
+
+        A device is created when the devices attached to it have been
+        created, so that independent devices (and their connections to the
+        hardware) are initialized concurrently.  The number of threads is
+        given by the ``device_creation_threads`` configuration value.
+        """
+        waiting = {}
+        dependents = {}
+        for devname in devlist:
+            try:
+                deps = self._attachedDeviceNames(devname)
+            except Exception:
+                # the error is raised again when creating the device
+                deps = set()
+            deps = set(dep for dep in deps if dep in devlist and
+                       dep != devname and dep not in self.devices)
+            waiting[devname] = deps
+            for dep in deps:
+                dependents.setdefault(dep, set()).add(devname)
+
+        todo = queue.Queue()
+        done = queue.Queue()
+
+        def worker():
+            while True:
+                devname = todo.get()
+                if devname is None:
+                    return
+                lowlevel = devlist[devname][1].get('lowlevel', False)
+                started = currenttime()
+                error = None
+                try:
+                    self.createDevice(devname, explicit=not lowlevel)
+                except Exception as err:
+                    error = err
+                    if not raise_failed:
+                        self.log.exception("device '%s' failed to create",
+                                           devname)
+                done.put((devname, currenttime() - started, error))
+
+        nthreads = min(config.device_creation_threads, len(devlist))
+        threads = [createThread('device creation %d' % i, worker, start=False)
+                   for i in range(nthreads)]
+        self._creation_threads.update(threads)
+        for thread in threads:
+            thread.start()
+
+        started = currenttime()
+        times = {}
+        first_error = None
+        running = 0
+        try:
+            while waiting or running:
+                ready = sorted(devname for (devname, deps) in
+                               iteritems(waiting) if not deps)
+                if not ready and not running:
+                    # cyclic dependencies: create one of the devices, it
+                    # creates the others when attaching them
+                    ready = [min(waiting)]
+                if first_error is None:
+                    for devname in ready:
+                        del waiting[devname]
+                        todo.put(devname)
+                        running += 1
+                elif not running:
+                    break
+                devname, duration, error = done.get()
+                running -= 1
+                times[devname] = duration
+                if error is not None:
+                    failed_devs.append(devname)
+                    if raise_failed and first_error is None:
+                        first_error = error
+                for dependent in dependents.get(devname, ()):
+                    if dependent in waiting:
+                        waiting[dependent].discard(devname)
+        finally:
+            for thread in threads:
+                todo.put(None)
+            for thread in threads:
+                thread.join()
+            self._creation_threads.difference_update(threads)
+
+        if first_error is not None:
+            raise first_error
+        slowest = sorted(iteritems(times), key=lambda item: -item[1])
+        self.log.info('created %d devices in %.2f s with %d threads, '
+                      'slowest: %s', len(times), currenttime() - started,
+                      nthreads, ', '.join('%s (%.2f s)' % item
+                                          for item in slowest[:5]))
+        for devname, duration in slowest:
+            self.log.debug('creation of %s took %.3f s', devname, duration)
+
+    def _waitForCreation(self, devname):
+        """Wait until the device *devname* is created, if it is being
+        created by another thread.  Must be called with the creation lock
+        held.
+        """
+        me = threading.current_thread()
+        while devname in self._creating:
+            # follow the chain of threads waiting for each other; on a cycle,
+            # the device still in creation is used, as without threads
+            thread = self._creating[devname]
+            for _ in range(len(self._creating)):
+                if thread is None or thread is me:
+                    break
+                thread = self._creating.get(self._creation_waits.get(thread))
+            if thread is me:
+                return
+            self._creation_waits[me] = devname
+            try:
+                self._creation_lock.wait()
+            finally:
+                del self._creation_waits[me]
+
     def getDevice(self, dev, cls=None, source=None, replace_classes=None):
         """Return a device *dev* from the current setup.
 
@@ -1061,10 +1219,14 @@ class Session(object):
         If given, it is a tuple of ``(old_class, new_class, new_devconfig)``.
         """
         if isinstance(dev, string_types):
+            if dev in self._creating:
+                with self._creation_lock:
+                    self._waitForCreation(dev)
             if dev in self.devices:
                 dev = self.devices[dev]
             elif dev in self.configured_devices:
-                if self.checkParallel():
+                if self.checkParallel() and \
+                   threading.current_thread() not in self._creation_threads:
                     raise NicosError('cannot create devices in parallel '
                                      'threads')
                 dev = self.createDevice(dev, replace_classes=replace_classes)
@@ -1123,8 +1285,6 @@ class Session(object):
         If *explicit* is true, the device is added to the list of "explicitly
         created devices".
         """
-        if self._failed_devices and devname in self._failed_devices:
-            raise self._failed_devices[devname]
         if devname not in self.configured_devices:
             found_in = []
             for sname, info in iteritems(self._setup_info):
@@ -1139,35 +1299,47 @@ class Session(object):
                     (devname, ', '.join(map(repr, found_in))))
             raise ConfigurationError("device '%s' not found in configuration"
                                      % devname)
-        if devname in self.devices:
-            if not recreate:
-                if explicit:
-                    self.explicit_devices.add(devname)
-                    self.export(devname, self.devices[devname])
-                return self.devices[devname]
-            self.destroyDevice(devname)
-
-        devcls, devconfig = self.importDevice(devname, replace_classes)
-        if 'description' in devconfig:
-            self.log.info("creating device '%s' (%s)... ",
-                          devname, devconfig['description'])
-        else:
-            self.log.info("creating device '%s'... ", devname)
+        with self._creation_lock:
+            self._waitForCreation(devname)
+            if self._failed_devices and devname in self._failed_devices:
+                raise self._failed_devices[devname]
+            if devname in self.devices:
+                if not recreate:
+                    if explicit:
+                        self.explicit_devices.add(devname)
+                        self.export(devname, self.devices[devname])
+                    return self.devices[devname]
+                self.destroyDevice(devname)
+            self._creating[devname] = threading.current_thread()
 
         try:
-            dev = devcls(devname, **devconfig)
-            self.log.debug("device '%s' created", devname)
-        except Exception as err:
-            if self._failed_devices is not None:
-                self._failed_devices[devname] = err
-            raise
-        if self._success_devices is not None:
-            self._success_devices.append(devname)
-        else:
-            self.deviceCallback('create', [devname])
-        if explicit:
-            self.explicit_devices.add(devname)
-            self.export(devname, dev)
+            devcls, devconfig = self.importDevice(devname, replace_classes)
+            if 'description' in devconfig:
+                self.log.info("creating device '%s' (%s)... ",
+                              devname, devconfig['description'])
+            else:
+                self.log.info("creating device '%s'... ", devname)
+
+            try:
+                dev = devcls(devname, **devconfig)
+                self.log.debug("device '%s' created", devname)
+            except Exception as err:
+                if self._failed_devices is not None:
+                    self._failed_devices[devname] = err
+                raise
+        finally:
+            with self._creation_lock:
+                del self._creating[devname]
+                self._creation_lock.notify_all()
+
+        with self._creation_lock:
+            if self._success_devices is not None:
+                self._success_devices.append(devname)
+            else:
+                self.deviceCallback('create', [devname])
+            if explicit:
+                self.explicit_devices.add(devname)
+                self.export(devname, dev)
         return dev
 
     def destroyDevice(self, devname):
@@ -1440,14 +1612,18 @@ class Session(object):
 
         # create a thread that that start the simulation and forwards its
         # messages to the client(s)
-        from nicos.core.sessions.simulation import SimulationSupervisor
+        from nicos.core.sessions.simulation import SimulationPool, \
+            SimulationSupervisor
+        if config.simulation_pool_size > 0 and self._simulation_pool is None:
+            self._simulation_pool = SimulationPool(config.simulation_pool_size)
         emitter = getattr(self, 'daemon_device', None)
         setups = [setup for setup in self.loaded_setups if
                   setup in self.explicit_setups or
                   self._setup_info[setup]['extended'].get('dynamic_loaded')]
         user = self.getExecutingUser()
         supervisor = SimulationSupervisor(self._sandbox_helper, uuid, code,
-                                          setups, user, emitter, quiet=quiet)
+                                          setups, user, emitter, quiet=quiet,
+                                          pool=self._simulation_pool)
         supervisor.start()
         if wait:
             supervisor.join()
@@ -1510,10 +1686,16 @@ class Session(object):
     def pause(self, prompt):
         """Pause the script, prompting the user to continue with a message."""
 
-    def delay(self, secs):
-        """Sleep for a small time, allow immediate stop before and after."""
+    def delay(self, secs, event=None):
+        """Sleep for a small time, allow immediate stop before and after.
+
+        If an *event* is given, return early when it is set.
+        """
         self.breakpoint(5)
-        sleep(secs)
+        if event is None:
+            sleep(secs)
+        else:
+            event.wait(secs)
         self.breakpoint(5)
 
     def checkAccess(self, required):
@@ -26,8 +26,12 @@
 
 from __future__ import absolute_import, division, print_function
 
+import os
+import sys
+from os import path
+
 from nicos.core.params import nicosdev_re
-from nicos.pycompat import exec_, iteritems, listitems
+from nicos.pycompat import cPickle as pickle, exec_, iteritems, listitems
 from nicos.utils import Device
 from nicos.utils.files import iterSetups
 
@@ -35,6 +39,10 @@ SETUP_GROUPS = {
     'basic', 'optional', 'plugplay', 'lowlevel', 'special', 'configdata'
 }
 
+# version of the setup cache file; files of other versions (and written by
+# other Python major versions) are ignored
+SETUP_CACHE_VERSION = (1, sys.version_info[0])
+
 
 class MonitorElement(object):
     pass
@@ -129,12 +137,20 @@ class SetupBlock(MonitorElement):
         return 'SetupBlock<%s:%s>' % (self._setupname, self._blockname)
 
 
-def readSetups(paths, logger):
-    """Read all setups on the given paths."""
+def readSetups(paths, logger, cache=None):
+    """Read all setups on the given paths.
+
+    If a `SetupCache` is given, setups whose files are unchanged since they
+    were cached are not executed again.
+    """
     infodict = {}
     all_setups = dict(iterSetups(paths))
+    if cache is not None:
+        cache.load()
     for (setupname, filename) in all_setups.items():
-        readSetup(infodict, setupname, filename, all_setups, logger)
+        readSetup(infodict, setupname, filename, all_setups, logger, cache)
+    if cache is not None:
+        cache.save(logger)
     # check if all includes exist
     for name, info in iteritems(infodict):
         if info is None:
@@ -147,6 +163,108 @@ def readSetups(paths, logger):
     return infodict
 
 
+def _filestamp(filename):
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+
+class SetupCache(object):
+    """Persistent cache of the information read from setup files.
+
+    Entries are keyed by the setup file path, and stay valid as long as the
+    modification time and size of the setup file and of all files read with
+    ``configdata()`` are unchanged, and ``configdata()`` would still find the
+    same files.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        # setup file path -> ([(file, stamp), ...], pickled info)
+        self._entries = {}
+        self._filestamp = None
+        self._dirty = False
+
+    def load(self):
+        """Read the cache file, if it changed since it was last read."""
+        stamp = _filestamp(self.filename)
+        if stamp is None or stamp == self._filestamp:
+            return
+        try:
+            with open(self.filename, 'rb') as fp:
+                version, entries = pickle.load(fp)
+        except Exception:
+            return
+        self._filestamp = stamp
+        if version == SETUP_CACHE_VERSION:
+            # entries of other processes are validated on lookup as well
+            self._entries.update(entries)
+
+    def save(self, logger):
+        """Write the cache file, if entries were added."""
+        if not self._dirty:
+            return
+        for filepath in list(self._entries):
+            if not path.isfile(filepath):
+                del self._entries[filepath]
+        # write to a temporary file first, several processes could write
+        tmpfile = '%s.%d.tmp' % (self.filename, os.getpid())
+        try:
+            if not path.isdir(path.dirname(self.filename)):
+                os.makedirs(path.dirname(self.filename))
+            with open(tmpfile, 'wb') as fp:
+                pickle.dump((SETUP_CACHE_VERSION, self._entries), fp,
+                            pickle.HIGHEST_PROTOCOL)
+            os.rename(tmpfile, self.filename)
+        except (IOError, OSError) as err:
+            # e.g. no write access in a sandboxed simulation
+            logger.debug('could not write setup cache %r: %s',
+                         self.filename, err)
+            if path.isfile(tmpfile):
+                os.unlink(tmpfile)
+            return
+        self._dirty = False
+        self._filestamp = _filestamp(self.filename)
+
+    def get(self, filepath, all_setups):
+        """Return the cached info for the setup file, or None if there is no
+        valid entry.
+        """
+        entry = self._entries.get(filepath)
+        if entry is None:
+            return None
+        stamps, data = entry
+        for filename, stamp in stamps:
+            if _filestamp(filename) != stamp:
+                return None
+            if filename != filepath:
+                depname = path.splitext(path.basename(filename))[0]
+                if all_setups.get(depname) != filename:
+                    return None
+        try:
+            return pickle.loads(data)
+        except Exception:
+            return None
+
+    def put(self, filepath, stamp, info):
+        """Store the info read from the setup file, which had the given
+        stamp before it was read.
+        """
+        try:
+            data = pickle.dumps(info, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            # setups containing objects that cannot be pickled are always
+            # executed
+            self._entries.pop(filepath, None)
+            return
+        stamps = [(filepath, stamp)] + [(filename, _filestamp(filename))
+                                        for filename in info['filenames'][1:]]
+        self._entries[filepath] = (stamps, data)
+        self._dirty = True
+
+
 def prepareNamespace(setupname, filepath, all_setups):
     """Return a namespace prepared for reading setup "setupname"."""
     # set of all files consulted via configdata()
@@ -231,7 +349,13 @@ def fixup_stacked_devices(logger, devdict):
     return devdict
 
 
-def readSetup(infodict, modname, filepath, all_setups, logger):
+def readSetup(infodict, modname, filepath, all_setups, logger, cache=None):
+    if cache is not None and modname not in infodict:
+        info = cache.get(filepath, all_setups)
+        if info is not None:
+            infodict[modname] = info
+            return
+        stamp = _filestamp(filepath)
     try:
         with open(filepath, 'rb') as modfile:
             code = modfile.read()
@@ -273,6 +397,9 @@ def readSetup(infodict, modname, filepath, all_setups, logger):
         logger.warning('Setup %s has an invalid group (valid groups '
                        'are: %s)', modname, ', '.join(SETUP_GROUPS))
         info['group'] = 'optional'
+    elif cache is not None and modname not in infodict:
+        # setups with warnings are not cached, to warn again next time
+        cache.put(filepath, stamp, info)
     if modname in infodict:
         # setup already exists; override/extend with new values
         oldinfo = infodict[modname] or {}
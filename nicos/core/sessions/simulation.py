@@ -28,11 +28,12 @@ from __future__ import absolute_import, division, print_function
 
 import logging
 import os
+import signal
 import sys
 import tempfile
 import time
 from os import path
-from threading import Thread
+from threading import Lock, Thread
 from time import sleep
 
 import zmq
@@ -55,6 +56,8 @@ SIM_MESSAGE = 0x01
 SIM_BLOCK_RES = 0x02
 # the duration for the whole code
 SIM_END_RES = 0x03
+# a pooled process has loaded the setups and waits for the code
+SIM_READY = 0x04
 
 
 def serialize(data):
@@ -143,18 +146,58 @@ class SimulationSession(Session):
 
     @classmethod
     def run(cls, sock, uuid, setups, user, code, quiet=False, debug=False):
+        socket = cls._connect(sock, debug)
+
+        # we either get an empty message (retrieve cache data ourselves)
+        # or a pickled key-value database
+        data = socket.recv()
+        db = pickle.loads(data) if data else None
+
+        if not cls._prepare(socket, uuid, setups, user, quiet):
+            return 1
+        return cls._execute(db, code)
+
+    @classmethod
+    def run_pooled(cls, sock, setups, user, debug=False):
+        """Run a simulation process of a `SimulationPool`.
+
+        The setups are loaded before the code to simulate is known.  Then
+        the process reports that it is ready and waits for the job: the uuid,
+        user and code, and the cache values to synchronize with.
+        """
+        socket = cls._connect(sock, debug)
+        if not cls._prepare(socket, '', setups, user, True):
+            return 1
+        socket.send(serialize((SIM_READY, None)))
+
+        ppid = os.getppid()
+        while not socket.poll(1000):
+            if os.getppid() != ppid:
+                # the process that started us is gone
+                session.shutdown()
+                return 1
+        uuid, user, code, quiet, db = unserialize(socket.recv())
+        # kill forcibly after 10 minutes, like unpooled simulations
+        if hasattr(signal, 'alarm'):
+            signal.alarm(600)
+        username, level = user.rsplit(',', 1)
+        session._user = User(username, int(level))
+        session.log_sender.simuuid = uuid
+        session.log_sender.quiet = quiet
+        return cls._execute(db, code)
+
+    @classmethod
+    def _connect(cls, sock, debug):
         session.__class__ = cls
         session._is_sandboxed = sock.startswith('ipc://')
         session._debug_log = debug
 
         socket = nicos_zmq_ctx.socket(zmq.DEALER)
         socket.connect(sock)
+        return socket
 
-        # we either get an empty message (retrieve cache data ourselves)
-        # or a pickled key-value database
-        data = socket.recv()
-        db = pickle.loads(data) if data else None
-
+    @classmethod
+    def _prepare(cls, socket, uuid, setups, user, quiet):
         # send log messages back to daemon if requested
         session.log_sender = SimLogSender(socket, session, uuid, quiet)
 
@@ -168,7 +211,7 @@ class SimulationSession(Session):
                 session.log.exception('Fatal error while initializing')
             finally:
                 print('Fatal error while initializing:', err, file=sys.stderr)
-            return 1
+            return False
 
         # Give a sign of life and then tell the log handler to only log
         # errors during setup.
@@ -186,7 +229,16 @@ class SimulationSession(Session):
             session.log.info('loading simulation mode setups: %s',
                              ', '.join(setups))
             session.loadSetup(setups, allow_startupcode=False)
+        except:  # really *all* exceptions -- pylint: disable=W0702
+            session.log.exception('Exception in dry run setup')
+            session.log_sender.finish()
+            session.shutdown()
+            return False
+        return True
 
+    @classmethod
+    def _execute(cls, db, code):
+        try:
             # Synchronize setups and cache values.
             session.log.info('synchronizing to master session')
             session.simulationSync(db)
@@ -234,7 +286,7 @@ class SimulationSession(Session):
     def getExecutingUser(self):
         return self._user
 
-    def delay(self, _secs):
+    def delay(self, _secs, _event=None):
         # TODO: this sleep shouldn't be necessary
         sleep(0.0001)
 
@@ -242,54 +294,191 @@ class SimulationSession(Session):
         raise Abort
 
 
+def startSimulation(sandbox, args):
+    """Start a simulation process with the given arguments for the
+    nicos-simulate script, following the socket address.
+
+    Return the socket to communicate with the process, the process, and the
+    temporary directory for the sandbox (or None).
+    """
+    socket = nicos_zmq_ctx.socket(zmq.DEALER)
+    tempdir = None
+    if sandbox:
+        # create a new temporary directory for the sandbox helper to
+        # mount the filesystem
+        tempdir = tempfile.mkdtemp()
+        rootdir = path.join(tempdir, 'root')
+        os.mkdir(rootdir)
+        # since the sandbox does not have TCP connection, use a Unix socket
+        sockname = 'ipc://' + path.join(tempdir, 'sock')
+        socket.bind(sockname)
+        prefixargs = [sandbox, rootdir, str(os.getuid()), str(os.getgid())]
+    else:
+        port = socket.bind_to_random_port('tcp://127.0.0.1')
+        sockname = 'tcp://127.0.0.1:%s' % port
+        prefixargs = []
+    scriptname = path.join(config.nicos_root, 'bin', 'nicos-simulate')
+    proc = createSubprocess(prefixargs +
+                            [sys.executable, scriptname, sockname] + args)
+    return socket, proc, tempdir
+
+
+class SimulationPool(object):
+    """Pool of simulation processes that have already loaded the setups, and
+    wait for the code to simulate.
+
+    Every process runs a single simulation, and is replaced by a new one
+    when it is taken from the pool.  Only processes that have reported that
+    their setups are loaded are taken.  When the setups (or their files)
+    change, the waiting processes are stopped and new ones are started.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._lock = Lock()
+        self._key = None
+        self._workers = []
+        self._ready = set()
+
+    def _setupKey(self, sandbox, setups):
+        stamps = []
+        for setup in sorted(session.loaded_setups):
+            info = session._setup_info.get(setup) or {}
+            for filename in info.get('filenames', ()):
+                try:
+                    stamps.append((filename, os.stat(filename).st_mtime))
+                except OSError:
+                    stamps.append((filename, None))
+        return sandbox, tuple(sorted(setups)), tuple(stamps)
+
+    def get(self, sandbox, setups, user):
+        """Return a simulation process for the setups, as returned by
+        `startSimulation`, or None if no process in the pool is ready.
+
+        The pool is filled up again with processes for these setups.
+        """
+        key = self._setupKey(sandbox, setups)
+        args = ['', ','.join(setups), '%s,%d' % (user.name, user.level), '',
+                '--pool']
+        if config.sandbox_simulation_debug:
+            args.append('--debug')
+        with self._lock:
+            if key != self._key:
+                self._stopWorkers()
+                self._key = key
+            self._checkWorkers()
+            worker = None
+            for candidate in self._workers:
+                if candidate in self._ready:
+                    worker = candidate
+                    self._workers.remove(worker)
+                    self._ready.discard(worker)
+                    break
+            while len(self._workers) < self.size:
+                self._workers.append(startSimulation(sandbox, args))
+        return worker
+
+    def readyCount(self):
+        """Return the number of processes that are ready to simulate."""
+        with self._lock:
+            self._checkWorkers()
+            return len(self._ready)
+
+    def stop(self):
+        """Stop all waiting processes."""
+        with self._lock:
+            self._stopWorkers()
+            self._key = None
+
+    def _checkWorkers(self):
+        # must be called with the lock held: receive the "ready" messages,
+        # and remove the processes that failed to load the setups
+        for worker in self._workers[:]:
+            socket, proc, _ = worker
+            failed = False
+            while worker not in self._ready and socket.poll(0):
+                msgtype, _ = unserialize(socket.recv())
+                if msgtype == SIM_READY:
+                    self._ready.add(worker)
+                elif msgtype == SIM_END_RES:
+                    failed = True
+                    break
+            if failed or proc.poll() is not None:
+                self._workers.remove(worker)
+                self._stopWorker(worker)
+
+    def _stopWorkers(self):
+        for worker in self._workers:
+            self._stopWorker(worker)
+        self._workers = []
+
+    def _stopWorker(self, worker):
+        self._ready.discard(worker)
+        if worker[1].poll() is None:
+            worker[1].terminate()
+            worker[1].wait()
+        self._cleanupWorker(worker)
+
+    def _cleanupWorker(self, worker):
+        socket, _, tempdir = worker
+        socket.close()
+        if tempdir:
+            try:
+                os.unlink(path.join(tempdir, 'sock'))
+            except OSError:
+                pass
+            try:
+                os.rmdir(path.join(tempdir, 'root'))
+                os.rmdir(tempdir)
+            except OSError:
+                pass
+
+
 class SimulationSupervisor(Thread):
     """Thread for starting a simulation process, receiving messages from a zmq
     socket and displaying/sending them to the client.
+
+    If a `SimulationPool` is given, a process from the pool is used if
+    possible.
     """
 
     def __init__(self, sandbox, uuid, code, setups, user, emitter,
-                 more_args=None, quiet=False):
+                 more_args=None, quiet=False, pool=None):
         Thread.__init__(self, target=self._target,
                         name='SimulationSupervisor',
                         args=(sandbox, uuid, code, setups, user, emitter,
-                              more_args or [], quiet))
+                              more_args or [], quiet, pool))
         # "daemonize this thread" attribute, not referring to the NICOS daemon.
         self.daemon = True
 
-    def _target(self, sandbox, uuid, code, setups, user, emitter, args, quiet):
-        socket = nicos_zmq_ctx.socket(zmq.DEALER)
-        poller = zmq.Poller()
-        poller.register(socket, zmq.POLLIN)
-        if sandbox:
-            # create a new temporary directory for the sandbox helper to
-            # mount the filesystem
-            tempdir = tempfile.mkdtemp()
-            rootdir = path.join(tempdir, 'root')
-            os.mkdir(rootdir)
-            # since the sandbox does not have TCP connection, use a Unix socket
-            sockname = 'ipc://' + path.join(tempdir, 'sock')
-            socket.bind(sockname)
-            prefixargs = [sandbox, rootdir, str(os.getuid()), str(os.getgid())]
-        else:
-            port = socket.bind_to_random_port('tcp://127.0.0.1')
-            sockname = 'tcp://127.0.0.1:%s' % port
-            prefixargs = []
-        scriptname = path.join(config.nicos_root, 'bin', 'nicos-simulate')
+    def _target(self, sandbox, uuid, code, setups, user, emitter, args, quiet,
+                pool):
         userstr = '%s,%d' % (user.name, user.level)
-        if quiet:
-            args.append('--quiet')
-        if config.sandbox_simulation_debug:
-            args.append('--debug')
-        proc = createSubprocess(prefixargs +
-                                [sys.executable, scriptname, sockname, uuid,
-                                 ','.join(setups), userstr, code] + args)
-        if sandbox:
-            if not session.current_sysconfig.get('cache'):
-                raise NicosError('no cache is configured')
-            socket.send(pickle.dumps(session.cache.get_values()))
+        worker = None
+        if pool and session.current_sysconfig.get('cache'):
+            # pooled processes get the values from our cache
+            worker = pool.get(sandbox, setups, user)
+        if worker:
+            socket, proc, tempdir = worker
+            # the process only needs the job and the current cache values
+            socket.send(serialize((uuid, userstr, code, quiet,
+                                   session.cache.get_values())))
         else:
-            # let the subprocess connect to the cache
-            socket.send(b'')
+            if quiet:
+                args.append('--quiet')
+            if config.sandbox_simulation_debug:
+                args.append('--debug')
+            socket, proc, tempdir = startSimulation(
+                sandbox, [uuid, ','.join(setups), userstr, code] + args)
+            if sandbox:
+                if not session.current_sysconfig.get('cache'):
+                    raise NicosError('no cache is configured')
+                socket.send(pickle.dumps(session.cache.get_values()))
+            else:
+                # let the subprocess connect to the cache
+                socket.send(b'')
+        poller = zmq.Poller()
+        poller.register(socket, zmq.POLLIN)
         while True:
             res = poller.poll(500)
             if not res:
@@ -343,9 +532,9 @@ class SimulationSupervisor(Thread):
                 raise Exception('did not terminate within 5 seconds')
         except Exception:
             session.log.exception('Error waiting for dry run process')
-        if sandbox:
+        if tempdir:
             try:
-                os.rmdir(rootdir)
+                os.rmdir(path.join(tempdir, 'root'))
                 os.rmdir(tempdir)
             except Exception:
                 pass
@@ -29,6 +29,7 @@
 from __future__ import absolute_import, division, print_function
 
 import sys
+import threading
 from collections import namedtuple
 from functools import wraps
 from time import localtime, time as currenttime
@@ -185,13 +186,88 @@ def multiStatus(devices, maxage=None):
                                'implemented?)'
 
 
+# the StatusWaiters of waiting loops, see notifyStatusChange
+_status_waiters = set()
+_status_waiters_lock = threading.Lock()
+
+
+def notifyStatusChange(devname):
+    """Notify waiting loops that the status of the device *devname* may have
+    changed.
+
+    This is called when a status update arrives via the cache, or from
+    hardware events (e.g. EPICS monitors), and wakes up `multiWait` and the
+    acquisition loop if they wait for the device, so that they check the
+    device status right away instead of after their loop delay.
+    """
+    devname = devname.lower()
+    with _status_waiters_lock:
+        waiters = list(_status_waiters)
+    for waiter in waiters:
+        if devname in waiter.devnames:
+            waiter.event.set()
+
+
+class StatusWaiter(object):
+    """Delay for loops that wait for *devices*.
+
+    Its `delay` returns early when `notifyStatusChange` is called for one of
+    the devices, or for one of their attached devices.  The waiter must be
+    closed when the loop is finished; it can also be used as a context
+    manager.
+    """
+
+    def __init__(self, devices):
+        self.event = threading.Event()
+        self.devnames = set()
+        self.wakeups = 0
+        self.update(devices)
+        with _status_waiters_lock:
+            _status_waiters.add(self)
+
+    def update(self, devices):
+        """Set the devices that are waited for."""
+        devnames = set()
+        pending = list(devices)
+        while pending:
+            dev = pending.pop()
+            if dev is None or dev.name.lower() in devnames:
+                continue
+            devnames.add(dev.name.lower())
+            for adev in dev._adevs.values():
+                if isinstance(adev, list):
+                    pending.extend(adev)
+                else:
+                    pending.append(adev)
+        self.devnames = devnames
+
+    def close(self):
+        with _status_waiters_lock:
+            _status_waiters.discard(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def delay(self, secs):
+        """Wait for *secs* seconds, or until a status change is notified."""
+        session.delay(secs, self.event)
+        if self.event.is_set():
+            self.wakeups += 1
+            self.event.clear()
+
+
 def multiWait(devices):
     """Wait for the *devices*.
 
     Returns a dictionary mapping devices to current values after waiting.
 
     This is the main waiting loop to be used when waiting for multiple devices.
-    It checks the device status until all devices are OK or errored.
+    It checks the device status until all devices are OK or errored.  The
+    status is checked every 0.3 seconds, and right away if a status change of
+    one of the devices is notified (see `notifyStatusChange`).
 
     Errors raised are handled like in the following way:
     The error is logged, and the first exception with the highest serverity
@@ -220,6 +296,7 @@ def multiWait(devices):
     eta_str = ''
     target_str = get_target_str()
     session.action(target_str)
+    waiter = StatusWaiter(devlist)
     try:
         while devlist:
             session.log.debug('multiWait: iteration %d, devices left %s',
@@ -255,6 +332,7 @@ def multiWait(devices):
                     values[dev] = dev.read()
                 # this device is done: don't wait for it anymore
                 devlist.remove(dev)
+                waiter.update(devlist)
                 target_str = get_target_str()
                 session.action(eta_str + target_str)
             if devlist:
@@ -267,11 +345,13 @@ def multiWait(devices):
                     eta_str = ('estimated %s left / ' % formatDuration(max(eta))
                                if eta else '')
                     session.action(eta_str + target_str)
-                session.delay(delay)
-                eta_update += delay
+                started = currenttime()
+                waiter.delay(delay)
+                eta_update += currenttime() - started
         if final_exc:
             reraise(*final_exc)
     finally:
+        waiter.close()
         session.endActionScope()
         session.log.debug('multiWait: finished')
     return values
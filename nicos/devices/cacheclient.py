@@ -28,26 +28,42 @@
 from __future__ import absolute_import, division, print_function
 
 import errno
+import re
 import select
 import socket
 import threading
 from time import sleep, time as currenttime
 
 from nicos import session
-from nicos.core import CacheError, CacheLockError, Device, Param, host
-from nicos.protocols.cache import BUFSIZE, CYCLETIME, DEFAULT_CACHE_PORT, \
-    END_MARKER, OP_ASK, OP_LOCK, OP_LOCK_LOCK, OP_LOCK_UNLOCK, OP_REWRITE, \
-    OP_SUBSCRIBE, OP_TELL, OP_TELLOLD, OP_UNSUBSCRIBE, OP_WILDCARD, \
-    SYNC_MARKER, cache_dump, cache_load, line_pattern, msg_pattern
+from nicos.core import CacheError, CacheLockError, Device, Param, \
+    floatrange, host, notifyStatusChange
+from nicos.protocols.cache import BUFSIZE, CODEC_BINARY, CODEC_MARKER, \
+    CYCLETIME, DEFAULT_CACHE_PORT, END_MARKER, OP_ASK, OP_LOCK, OP_LOCK_LOCK, \
+    OP_LOCK_UNLOCK, OP_REWRITE, OP_SUBSCRIBE, OP_TELL, OP_TELLOLD, \
+    OP_UNSUBSCRIBE, OP_WILDCARD, SYNC_MARKER, cache_dump, cache_dump_binary, \
+    cache_load, line_pattern, msg_pattern, opkeys
 #pylint: disable=redefined-builtin
 from nicos.pycompat import from_utf8, iteritems, queue, string_types, \
     to_utf8, xrange
 from nicos.utils import closeSocket, createThread, getSysInfo, tcpSocket
 
+# matches a single queued line that sets a key, as formatted by put()
+tell_line_pattern = re.compile(r'[^@\n]*@([^%s\n]*)%s[^\n]*\n\Z' %
+                               (re.escape(opkeys), re.escape(OP_TELL)))
+
 
 class BaseCacheClient(Device):
     """
     An extensible read/write client for the NICOS cache.
+
+    If *coalescewindow* is nonzero, lines queued for sending are collected
+    for at most this time and then written with a single call.  Within such
+    a batch, only the latest value of each key is sent.
+
+    If *binaryvalues* is true, values are exchanged in the binary encoding
+    (see `nicos.protocols.cache`) if the cache server supports it, which is
+    much faster to decode for large values.  Values are then also passed on
+    in this encoding, e.g. to the clients of a daemon.
     """
 
     parameters = {
@@ -55,8 +71,17 @@ class BaseCacheClient(Device):
                         type=host(defaultport=DEFAULT_CACHE_PORT),
                         mandatory=True),
         'prefix': Param('Cache key prefix', type=str, mandatory=True),
+        'coalescewindow': Param('Time window for collecting queued lines '
+                                'into one write (0 to disable)',
+                                type=floatrange(0, 0.1), default=0, unit='s'),
+        'binaryvalues': Param('Use the binary encoding for values if the '
+                              'cache server supports it', type=bool,
+                              default=False),
     }
 
+    # maximum number of lines written at once when coalescing
+    _coalesce_max = 1000
+
     remote_callbacks = True
     _worker = None
     _startup_done = None
@@ -74,6 +99,8 @@ class BaseCacheClient(Device):
         self._socket = None
         self._secsocket = None
         self._sec_lock = threading.RLock()
+        # whether the binary value encoding was agreed on with the server
+        self._binary = False
         self._prefix = self.prefix.strip('/')
         if self._prefix:
             self._prefix += '/'
@@ -89,6 +116,8 @@ class BaseCacheClient(Device):
         self._stoprequest = False
         self._queue = queue.Queue()
         self._synced = True
+        self._counters = {'lines_sent': 0, 'lines_coalesced': 0,
+                          'syscalls_saved': 0}
 
         # create worker thread, but do not start yet, leave that to subclasses
         self._worker = createThread('CacheClient worker', self._worker_thread,
@@ -126,6 +155,7 @@ class BaseCacheClient(Device):
 
     def _disconnect(self, why=''):
         self._connected = False
+        self._binary = False
         self._startup_done.clear()
         if why:
             if self._disconnect_warnings % 10 == 0:
@@ -147,7 +177,30 @@ class BaseCacheClient(Device):
     def _wait_data(self):
         pass
 
+    def _negotiate_codec(self):
+        if not self.binaryvalues:
+            return
+        msg = '%s%s%s\n' % (CODEC_MARKER, OP_ASK, CODEC_BINARY)
+        self._socket.sendall(to_utf8(msg))
+        data = b''
+        while not data.endswith(b'\n'):
+            newdata = self._socket.recv(BUFSIZE)
+            if not newdata:
+                raise CacheError('cache closed connection')
+            data += newdata
+        # older servers reply that the key does not exist
+        self._binary = data == to_utf8('%s%s%s\n' % (CODEC_MARKER, OP_TELL,
+                                                      CODEC_BINARY))
+        self.log.debug('binary value encoding: %s', self._binary)
+
+    def _dump(self, value):
+        """Serialize a value in the encoding agreed on with the server."""
+        if self._binary:
+            return cache_dump_binary(value)
+        return cache_dump(value)
+
     def _connect_action(self):
+        self._negotiate_codec()
         # send request for all keys and updates....
         # (send a single request for a nonexisting key afterwards to
         # determine the end of data)
@@ -266,15 +319,19 @@ class BaseCacheClient(Device):
 
                 if res[1]:
                     # determine if something needs to be sent
-                    tosend = ''
-                    itemcount = 0
-                    try:
-                        # bunch a few messages together, but not unlimited
-                        for _ in xrange(10):
-                            tosend += self._queue.get(False)
-                            itemcount += 1
-                    except queue.Empty:
-                        pass
+                    if self.coalescewindow:
+                        tosend, itemcount = self._get_coalesced()
+                    else:
+                        tosend = ''
+                        itemcount = 0
+                        try:
+                            # bunch a few messages together, but not unlimited
+                            for _ in xrange(10):
+                                tosend += self._queue.get(False)
+                                itemcount += 1
+                        except queue.Empty:
+                            pass
+                        self._count_sent(itemcount, itemcount)
                     # write data
                     try:
                         self._socket.sendall(to_utf8(tosend))
@@ -312,6 +369,7 @@ class BaseCacheClient(Device):
                     itemcount += 1
             except queue.Empty:
                 pass
+            self._count_sent(itemcount, itemcount)
             try:
                 self._socket.sendall(to_utf8(tosend))
             except Exception:
@@ -324,8 +382,65 @@ class BaseCacheClient(Device):
         # end of while loop
         self._disconnect()
 
+    def _get_coalesced(self):
+        """Get queued lines for at most `coalescewindow` seconds, and drop
+        lines that are superseded by a later value for the same key.
+
+        Return the data to send and the number of queue items taken.
+        """
+        items = []
+        deadline = currenttime() + self.coalescewindow
+        try:
+            while len(items) < self._coalesce_max:
+                try:
+                    items.append(self._queue.get(False))
+                except queue.Empty:
+                    remaining = deadline - currenttime()
+                    if remaining <= 0:
+                        break
+                    items.append(self._queue.get(True, remaining))
+        except queue.Empty:
+            pass
+        lines = []
+        seen = set()
+        tell_match = tell_line_pattern.match
+        for item in reversed(items):
+            match = tell_match(item)
+            if match is None:
+                # not a simple update (subscription, sync marker, ...);
+                # values must not be dropped across it
+                seen = set()
+            elif match.group(1) in seen:
+                continue
+            else:
+                seen.add(match.group(1))
+            lines.append(item)
+        lines.reverse()
+        self._count_sent(len(items), len(lines))
+        return ''.join(lines), len(items)
+
+    def _count_sent(self, nitems, nlines):
+        if nlines:
+            counters = self._counters
+            counters['lines_sent'] += nlines
+            counters['lines_coalesced'] += nitems - nlines
+            # compared to one write per queued line
+            counters['syscalls_saved'] += nitems - 1
+
+    def getCounters(self):
+        """Return a dictionary with the number of lines sent, the number of
+        lines dropped because a later value for the same key was sent
+        together with them, and the number of write calls saved by sending
+        several lines at once.
+        """
+        return dict(self._counters)
+
     def _single_request(self, tosend, sentinel=b'\n', retry=2, sync=False):
-        """Communicate over the secondary socket."""
+        """Communicate over the secondary socket.
+
+        The whole reply is read while the secondary socket is reserved, and
+        the reply lines are yielded after it has been released again.
+        """
         if not self._socket:
             self._disconnect('single request: no socket')
             if not self._socket:
@@ -333,59 +448,102 @@ class BaseCacheClient(Device):
         if sync:
             # sync has to be false for lock requests, as these occur during startup
             self._queue.join()
-        with self._sec_lock:
-            if not self._secsocket:
-                try:
-                    self._secsocket = tcpSocket(self.cache, DEFAULT_CACHE_PORT)
-                except Exception as err:
-                    self.log.warning('unable to connect secondary socket '
-                                     'to %s: %s', self.cache, err)
-                    self._secsocket = None
-                    self._disconnect('secondary socket: could not connect')
-                    raise CacheError('secondary socket could not be created')
+        try:
+            with self._sec_lock:
+                data = self._secondary_request(tosend, sentinel)
+        except socket.error:
+            if retry:
+                for m in self._single_request(tosend, sentinel, retry - 1):
+                    yield m
+                return
+            raise
 
+        lmatch = line_pattern.match
+        mmatch = msg_pattern.match
+        match = lmatch(data)
+        while match:
+            msgmatch = mmatch(from_utf8(match.group(1)))
+            # ignore invalid lines
+            if msgmatch:
+                yield msgmatch
+            match = lmatch(data, match.end())
+
+    def _secondary_request(self, tosend, sentinel):
+        # must be called with the secondary socket lock held
+        if not self._secsocket:
             try:
-                # write request
-                # self.log.debug("get_explicit: sending %r", tosend)
-                self._secsocket.sendall(to_utf8(tosend))
-
-                # give 10 seconds time to get the whole reply
-                timeout = currenttime() + 10
-                # read response
-                data = b''
-                while not data.endswith(sentinel):
-                    newdata = self._secsocket.recv(BUFSIZE)  # blocking read
-                    if not newdata:
-                        raise socket.error('cache closed connection')
-                    if currenttime() > timeout:
-                        # do not just break, we need to reopen the socket
-                        raise socket.error('getting response took too long')
-                    data += newdata
-            except socket.error:
-                self.log.warning('error during cache query', exc=1)
-                closeSocket(self._secsocket)
+                self._secsocket = tcpSocket(self.cache, DEFAULT_CACHE_PORT)
+            except Exception as err:
+                self.log.warning('unable to connect secondary socket '
+                                 'to %s: %s', self.cache, err)
                 self._secsocket = None
-                if retry:
-                    for m in self._single_request(tosend, sentinel, retry - 1):
-                        yield m
-                    return
-                raise
-
+                self._disconnect('secondary socket: could not connect')
+                raise CacheError('secondary socket could not be created')
+        try:
+            # write request
+            # self.log.debug("get_explicit: sending %r", tosend)
+            self._secsocket.sendall(to_utf8(tosend))
+
+            # read response
+            data = b''
+            while not data.endswith(sentinel):
+                # give 10 seconds time to get the next part of the reply
+                timeout = currenttime() + 10
+                newdata = self._secsocket.recv(BUFSIZE)  # blocking read
+                if not newdata:
+                    raise socket.error('cache closed connection')
+                if currenttime() > timeout:
+                    # do not just break, we need to reopen the socket
+                    raise socket.error('getting response took too long')
+                data += newdata
+            return data
+        except socket.error:
+            self.log.warning('error during cache query', exc=1)
+            closeSocket(self._secsocket)
+            self._secsocket = None
+            raise
+
+    def _stream_request(self, tosend, sentinel):
+        """Communicate over a new connection, which is closed afterwards.
+
+        The reply lines are yielded as they arrive, so that long replies (such
+        as history queries) are never kept in memory as a whole.  Unlike with
+        `_single_request`, other requests are not blocked meanwhile.
+        """
+        if not self._socket:
+            raise CacheError('cache not connected')
+        try:
+            sock = tcpSocket(self.cache, DEFAULT_CACHE_PORT)
+        except Exception as err:
+            raise CacheError('could not connect to cache: %s' % err)
         lmatch = line_pattern.match
         mmatch = msg_pattern.match
-        i = 0
-        # self.log.debug("get_explicit: data =%r", data)
-        match = lmatch(data, i)
-        while match:
-            line = match.group(1)
-            i = match.end()
-            msgmatch = mmatch(from_utf8(line))
-            if not msgmatch:
-                # ignore invalid lines
-                continue
-            # self.log.debug('line processed: %r', line)
-            yield msgmatch
-            match = lmatch(data, i)
+        try:
+            sock.sendall(to_utf8(tosend))
+            data = b''
+            done = False
+            while not done:
+                # give 10 seconds time to get the next part of the reply
+                timeout = currenttime() + 10
+                newdata = sock.recv(BUFSIZE)  # blocking read
+                if not newdata:
+                    raise socket.error('cache closed connection')
+                if currenttime() > timeout:
+                    raise socket.error('getting response took too long')
+                data += newdata
+                done = data.endswith(sentinel)
+                i = 0
+                match = lmatch(data)
+                while match:
+                    i = match.end()
+                    msgmatch = mmatch(from_utf8(match.group(1)))
+                    # ignore invalid lines
+                    if msgmatch:
+                        yield msgmatch
+                    match = lmatch(data, i)
+                data = data[i:]
+        finally:
+            closeSocket(sock)
 
     def waitForStartup(self, timeout):
         self._startup_done.wait(timeout)
@@ -462,7 +620,7 @@ class BaseCacheClient(Device):
         try:
             key, res = getSysInfo(service)
             msg = '%s@%s%s%s\n' % (currenttime(), key, OP_TELL,
-                                   cache_dump(res))
+                                   self._dump(res))
             self._socket.sendall(to_utf8(msg))
         except Exception:
             self.log.exception('storing sysinfo failed')
@@ -476,6 +634,8 @@ class CacheClient(BaseCacheClient):
     def doInit(self, mode):
         BaseCacheClient.doInit(self, mode)
         self._db = {}
+        # subkeys in the local database, by device (key prefix)
+        self._devkeys = {}
         self._dblock = threading.Lock()
         self._callbacks = {}
 
@@ -492,6 +652,7 @@ class CacheClient(BaseCacheClient):
         if self._dblock:
             with self._dblock:
                 self._db.clear()
+                self._devkeys.clear()
         if self._startup_done:
             self._startup_done.set()
 
@@ -502,6 +663,7 @@ class CacheClient(BaseCacheClient):
         # clear the local database of possibly outdated values
         with self._dblock:
             self._db.clear()
+            self._devkeys.clear()
         # get all current values from the cache
         BaseCacheClient._connect_action(self)
         # tell the server all our rewrites
@@ -524,6 +686,23 @@ class CacheClient(BaseCacheClient):
                     self.put('session', 'master', session.sessionid,
                              ttl=self._mastertimeout)
 
+    def _db_set(self, key, value, time):
+        # must be called with the database lock held
+        if key not in self._db:
+            dev, _, subkey = key.rpartition('/')
+            self._devkeys.setdefault(dev, set()).add(subkey)
+        self._db[key] = (value, time)
+
+    def _db_pop(self, key):
+        # must be called with the database lock held
+        if self._db.pop(key, None) is not None:
+            dev, _, subkey = key.rpartition('/')
+            subkeys = self._devkeys.get(dev)
+            if subkeys:
+                subkeys.discard(subkey)
+                if not subkeys:
+                    del self._devkeys[dev]
+
     def _unlock_master(self):
         self.unlock('master')
         self.put('session', 'master', '')
@@ -557,16 +736,19 @@ class CacheClient(BaseCacheClient):
         # self.log.debug('got %s=%s', key, value)
         if not value or op == OP_TELLOLD:
             with self._dblock:
-                self._db.pop(key, None)
+                self._db_pop(key)
         else:
             value = cache_load(value)
             with self._dblock:
-                self._db[key] = (value, time)
+                self._db_set(key, value, time)
             if self._do_callbacks:
                 if key in self._callbacks:
                     self._call_callbacks(key, value, time)
                 if key.endswith('/value') and session.experiment:
                     session.experiment.data.cacheCallback(key, value, time)
+                elif key.endswith('/status'):
+                    # e.g. from the poller: wake up waiting for the device
+                    notifyStatusChange(key[:-7])
 
     def _call_callbacks(self, key, value, time):
         with self._dblock:
@@ -591,6 +773,16 @@ class CacheClient(BaseCacheClient):
             cbs = self._callbacks.setdefault(('%s/%s' % (dev, key)).lower(), [])
             cbs.append(function)  # this is supposed to be safe, but why bother?
 
+    def addCallbacks(self, dev, callbacks):
+        """Add callbacks for several subkeys of the given device at once,
+        given as a list of (subkey, function) tuples.
+        """
+        prefix = str(dev).lower() + '/'
+        with self._dblock:
+            for key, function in callbacks:
+                self._callbacks.setdefault(prefix + key.lower(),
+                                           []).append(function)
+
     def removeCallback(self, dev, key, function):
         """Remove the given callback for the given device/subkey, if present."""
         with self._dblock:
@@ -601,6 +793,18 @@ class CacheClient(BaseCacheClient):
                     # emty list: remove!
                     self._callbacks.pop(('%s/%s' % (dev, key)).lower(), None)
 
+    def removeCallbacks(self, dev, callbacks):
+        """Remove the callbacks added with `addCallbacks`, if present."""
+        prefix = str(dev).lower() + '/'
+        with self._dblock:
+            for key, function in callbacks:
+                dbkey = prefix + key.lower()
+                cbs = self._callbacks.get(dbkey, None)
+                if cbs and function in cbs:
+                    cbs.remove(function)
+                    if not cbs:
+                        self._callbacks.pop(dbkey, None)
+
     def get(self, dev, key, default=None, mintime=None):
         """Get a value from the local cache for the given device and subkey.
 
@@ -641,6 +845,29 @@ class CacheClient(BaseCacheClient):
         with self._dblock:
             return {key: value for (key, (value, _)) in iteritems(self._db)}
 
+    def get_device_values(self, dev):
+        """Get the values of all subkeys of the given device from the local
+        cache, as a dictionary mapping subkeys to values.
+
+        This gives the same values as `get` for every subkey, without the
+        overhead of single lookups, e.g. to initialize all parameters of a
+        device.
+        """
+        if not self._stoprequest and not self._startup_done.wait(15):
+            self.log.warning('Cache _startup_done took more than 15s!')
+            raise CacheError(self, 'Cache _startup_done took more than 15s!')
+        devkey = str(dev).lower()
+        prefix = devkey + '/'
+        db = self._db
+        with self._dblock:
+            values = {subkey: db[prefix + subkey][0]
+                      for subkey in self._devkeys.get(devkey, ())}
+        if devkey in self._inv_rewrites and self.is_connected():
+            for subkey, value in iteritems(
+                    self.get_device_values(self._inv_rewrites[devkey])):
+                values.setdefault(subkey, value)
+        return values
+
     def get_explicit(self, dev, key, default=None):
         """Get a value from the cache server, bypassing the local cache.  This
         is needed if the current update time and ttl is required.
@@ -673,7 +900,8 @@ class CacheClient(BaseCacheClient):
     def put(self, dev, key, value, time=None, ttl=None, flag=''):
         """Put a value for a given device and subkey.
 
-        The value is serialized by this method using `cache_dump()`.
+        The value is serialized by this method using `cache_dump()`, or
+        `cache_dump_binary()` if the binary encoding is used.
         """
         if ttl == 0:
             # no need to process immediately-expired values
@@ -683,8 +911,8 @@ class CacheClient(BaseCacheClient):
         ttlstr = ttl and '+%s' % ttl or ''
         dbkey = ('%s/%s' % (dev, key)).lower()
         with self._dblock:
-            self._db[dbkey] = (value, time)
-        dvalue = cache_dump(value)
+            self._db_set(dbkey, value, time)
+        dvalue = self._dump(value)
         msg = '%r%s@%s%s%s%s%s\n' % (time, ttlstr, self._prefix, dbkey,
                                      flag, OP_TELL, dvalue)
         # self.log.debug('putting %s=%s', dbkey, value)
@@ -698,11 +926,37 @@ class CacheClient(BaseCacheClient):
             for newprefix in self._rewrites[str(dev).lower()]:
                 rdbkey = ('%s/%s' % (newprefix, key)).lower()
                 with self._dblock:
-                    self._db[rdbkey] = (value, time)
+                    self._db_set(rdbkey, value, time)
                 self._propagate((time, rdbkey, OP_TELL, dvalue))
                 if key == 'value' and session.experiment:
                     session.experiment.data.cacheCallback(rdbkey, value, time)
 
+    def put_many(self, dev, values, time=None):
+        """Put values for several subkeys of the given device at once, given
+        as a dictionary mapping subkeys to values.
+        """
+        if not values:
+            return
+        if time is None:
+            time = currenttime()
+        devkey = str(dev).lower()
+        prefixes = [devkey] + sorted(self._rewrites.get(devkey, ()))
+        with self._dblock:
+            for prefix in prefixes:
+                for key, value in iteritems(values):
+                    self._db_set(('%s/%s' % (prefix, key)).lower(), value,
+                                 time)
+        for key, value in iteritems(values):
+            dvalue = self._dump(value)
+            for prefix in prefixes:
+                dbkey = ('%s/%s' % (prefix, key)).lower()
+                if prefix == devkey:
+                    self._queue.put('%r@%s%s%s%s\n' % (time, self._prefix,
+                                                       dbkey, OP_TELL, dvalue))
+                self._propagate((time, dbkey, OP_TELL, dvalue))
+                if key == 'value' and session.experiment:
+                    session.experiment.data.cacheCallback(dbkey, value, time)
+
     def put_raw(self, key, value, time=None, ttl=None, flag=''):
         """Put a key given by full name.
 
@@ -716,7 +970,7 @@ class CacheClient(BaseCacheClient):
         if time is None:
             time = currenttime()
         ttlstr = ttl and '+%s' % ttl or ''
-        value = cache_dump(value)
+        value = self._dump(value)
         msg = '%r%s@%s%s%s%s\n' % (time, ttlstr, key, flag, OP_TELL, value)
         # self.log.debug('putting %s=%s', key, value)
         self._queue.put(msg)
@@ -755,7 +1009,7 @@ class CacheClient(BaseCacheClient):
                     if exclude and dbkey.rsplit('/', 1)[-1] in exclude:
                         continue
                     msg = '%r@%s%s%s\n' % (time, self._prefix, dbkey, OP_TELL)
-                    self._db.pop(dbkey, None)
+                    self._db_pop(dbkey)
                     self._queue.put(msg)
                     self._propagate((time, dbkey, OP_TELL, ''))
 
@@ -765,7 +1019,7 @@ class CacheClient(BaseCacheClient):
         with self._dblock:
             for dbkey in list(self._db):
                 msg = '%r@%s%s%s\n' % (time, self._prefix, dbkey, OP_TELL)
-                self._db.pop(dbkey, None)
+                self._db_pop(dbkey)
                 self._queue.put(msg)
                 self._propagate((time, dbkey, OP_TELL, ''))
 
@@ -777,26 +1031,37 @@ class CacheClient(BaseCacheClient):
         dbkey = ('%s/%s' % (dev, key)).lower()
         self.log.debug('invalidating %s', dbkey)
         with self._dblock:
-            self._db.pop(dbkey, None)
+            self._db_pop(dbkey)
 
     # pylint: disable=W0221
-    def history(self, dev, key, fromtime, totime):
+    def history(self, dev, key, fromtime, totime, maxpoints=None):
         """History query: opens a separate connection since it is otherwise not
         possible to determine which response lines belong to it.
+
+        If *maxpoints* is given, the cache server reduces the number of
+        returned values to at most this number (cache servers of older NICOS
+        versions return all values).
+        """
+        return list(self.history_iter(dev, key, fromtime, totime, maxpoints))
+
+    def history_iter(self, dev, key, fromtime, totime, maxpoints=None):
+        """Like `history`, but yield the ``(time, value)`` pairs while they
+        are received from the cache.
+
+        The query uses its own connection, so that other requests are not
+        blocked while the values are consumed.
         """
         if dev:
             key = ('%s/%s' % (dev, key)).lower()
-        tosend = '%r-%r@%s%s%s\n###?\n' % (fromtime, totime,
-                                           self._prefix, key, OP_ASK)
-        ret = []
-        for msgmatch in self._single_request(tosend, b'###!\n', sync=False):
+        tosend = '%r-%r@%s%s%s%s\n###?\n' % (fromtime, totime, self._prefix,
+                                             key, OP_ASK, maxpoints or '')
+        for msgmatch in self._stream_request(tosend, b'###!\n'):
             # process data
             time, value = msgmatch.group('time'), msgmatch.group('value')
             if time is None:
                 break  # it's the '###' value
             if value:
-                ret.append((float(time), cache_load(value)))
-        return ret
+                yield (float(time), cache_load(value))
 
     def query_db(self, query, tries=3):
         with self._dblock:
@@ -93,6 +93,20 @@ class LiveViewSinkHandler(DataSinkHandler):
         ``(readvalue, arrays)``."""
         return result[1]
 
+    def liveDtype(self, arrays):
+        """Return the data type in which the arrays are sent.
+
+        The type of the arrays is kept (in little endian) if all have the same
+        16 or 32-bit integer type, which all live data displays support;
+        otherwise, they are converted to 32-bit unsigned integers.
+        """
+        dtypes = set(data.dtype.newbyteorder('<') for data in arrays)
+        if len(dtypes) == 1:
+            dtype = dtypes.pop()
+            if dtype.kind in 'ui' and dtype.itemsize in (2, 4):
+                return dtype.str
+        return '<u4'
+
     def putResults(self, quality, results):
         if self.detector.name not in results:
             return
@@ -103,6 +117,7 @@ class LiveViewSinkHandler(DataSinkHandler):
         filenames = []
         nx, ny, nz = [], [], []
         arrays = self.processArrays(result)
+        dtype = self.liveDtype([data for data in arrays if data is not None])
         for i, data in enumerate(arrays):
             if data is None:
                 continue
@@ -122,7 +137,7 @@ class LiveViewSinkHandler(DataSinkHandler):
             else:
                 filename = self.sink.filenametemplate[0] % self.dataset.counter
 
-            buf = memory_buffer(np.ascontiguousarray(data.astype('<u4')))
+            buf = memory_buffer(np.ascontiguousarray(data.astype(dtype)))
             nx.append(resX)
             ny.append(resY)
             nz.append(resZ)
@@ -131,7 +146,7 @@ class LiveViewSinkHandler(DataSinkHandler):
         if buffers:
             session.updateLiveData('Live', self.dataset.uid,
                                    self.detector.name, filenames,
-                                   '<u4', nx, ny, nz,
+                                   dtype, nx, ny, nz,
                                    currenttime() - self.dataset.started,
                                    buffers)
 
@@ -36,7 +36,7 @@ from nicos import session
 from nicos.commands import helparglist, hiddenusercommand
 from nicos.core import SIMULATION, CommunicationError, ConfigurationError, \
     DeviceMixinBase, HasLimits, Moveable, Override, Param, Readable, anytype, \
-    floatrange, none_or, pvname, status
+    floatrange, none_or, notifyStatusChange, pvname, status
 from nicos.core.mixins import HasWindowTimeout
 from nicos.devices.epics import SEVERITY_TO_STATUS, STAT_TO_STATUS
 from nicos.utils import HardwareStub
@@ -162,6 +162,7 @@ class EpicsDevice(DeviceMixinBase):
                 if not pv.wait_for_connection(timeout=self.epicstimeout):
                     raise CommunicationError(self, 'could not connect to PV %r'
                                              % pvname)
+                pv.add_callback(self._pv_changed)
 
                 self._pvctrls[pvparam] = pv.get_ctrlvars() or {}
         else:
@@ -169,6 +170,10 @@ class EpicsDevice(DeviceMixinBase):
                 self._pvs[pvparam] = HardwareStub(self)
                 self._pvctrls[pvparam] = {}
 
+    def _pv_changed(self, **kwds):
+        # Called on monitor updates of the PVs: wake up waiting for the device
+        notifyStatusChange(self.name)
+
     def _get_pv_parameters(self):
         # The default implementation of this method simply returns the
         # pv_parameters set
@@ -211,6 +216,31 @@ class EpicsDevice(DeviceMixinBase):
 
         return max(status_map.items())
 
+    def doPrefetchGroup(self, devices):
+        # Get the values of all PVs of the devices, and the alarm status and
+        # severity of their records, with one request to the IOCs.
+        devices = [dev for dev in devices if isinstance(dev, EpicsDevice)]
+        requests = []
+        for dev in devices:
+            for pvparam in dev._pvs:
+                pvname = dev._get_pv_name(pvparam)
+                record = pvname.split('.')[0]
+                requests.append((dev, pvparam, pvname))
+                requests.append((dev, ('status', pvparam), record + '.STAT'))
+                requests.append((dev, ('severity', pvparam), record + '.SEVR'))
+
+        if epics.ca.current_context() is None:
+            epics.ca.use_initial_context()
+        values = epics.caget_many([pvname for (_, _, pvname) in requests],
+                                  timeout=self.epicstimeout)
+
+        data = {dev: {} for dev in devices}
+        for (dev, key, _), value in zip(requests, values):
+            # PVs that timed out are read again by the device
+            if value is not None:
+                data[dev][key] = value
+        return data
+
     def _setMode(self, mode):
         super(EpicsDevice, self)._setMode(mode)
         # remove the PVs on entering simulation mode, to prevent
@@ -222,6 +252,8 @@ class EpicsDevice(DeviceMixinBase):
     def _get_pv(self, pvparam, as_string=False):
         # since NICOS devices can be accessed from any thread, we have to
         # ensure that the same context is set on every thread
+        if not as_string and self._prefetched and pvparam in self._prefetched:
+            return self._prefetched[pvparam]
         if epics.ca.current_context() is None:
             epics.ca.use_initial_context()
         result = self._pvs[pvparam].get(timeout=self.epicstimeout,
@@ -232,7 +264,15 @@ class EpicsDevice(DeviceMixinBase):
         return result
 
     def _get_pvctrl(self, pvparam, ctrl, default=None, update=False):
-        if update:
+        if update and self._prefetched and \
+           ('status', pvparam) in self._prefetched and \
+           ('severity', pvparam) in self._prefetched:
+            # alarm status and severity were read for the poll group
+            ctrlvars = dict(self._pvctrls[pvparam] or {})
+            ctrlvars['status'] = self._prefetched['status', pvparam]
+            ctrlvars['severity'] = self._prefetched['severity', pvparam]
+            self._pvctrls[pvparam] = ctrlvars
+        elif update:
             if epics.ca.current_context() is None:
                 epics.ca.use_initial_context()
 
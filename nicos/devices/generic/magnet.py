@@ -30,8 +30,6 @@ from __future__ import absolute_import, division, print_function
 
 import math
 
-from scipy.optimize import fsolve
-
 from nicos import session
 from nicos.core import Attach, HasLimits, LimitError, Moveable, NicosError, \
     status, usermethod
@@ -104,6 +102,9 @@ class CalibratedMagnet(HasLimits, Moveable):
                              'requested field %g %s out of range %g..%g %s' %
                              (field, self.unit, minfield, maxfield, self.unit))
 
+        # scipy is imported here since importing it takes some time, and
+        # this module is imported with every generic device class
+        from scipy.optimize import fsolve
         res = fsolve(lambda cur: self._current2field(cur) - field, 0)[0]
         self.log.debug('current for %g %s is %g', field, self.unit, res)
         return res
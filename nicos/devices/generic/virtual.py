@@ -39,8 +39,8 @@ from nicos import session
 from nicos.core import MASTER, POLLER, SIMULATION, ArrayDesc, Attach, \
     CanDisable, HasLimits, HasOffset, HasWindowTimeout, InvalidValueError, \
     Measurable, Moveable, MoveError, Override, Param, Readable, \
-    SubscanMeasurable, Value, floatrange, intrange, listof, none_or, oneof, \
-    status, tupleof
+    SubscanMeasurable, Value, floatrange, intrange, listof, none_or, \
+    notifyStatusChange, oneof, status, tupleof
 from nicos.core.scan import Scan
 from nicos.devices.abstract import CanReference, Coder, Motor
 from nicos.devices.generic.detector import ActiveChannel, ImageChannelMixin, \
@@ -137,6 +137,7 @@ class VirtualMotor(HasOffset, CanDisable, Motor):
         finally:
             self._stop = False
             self._setROParam('curstatus', (status.OK, 'idle'))
+            notifyStatusChange(self.name)
 
     def doReadRamp(self):
         return self.speed * 60.
@@ -299,6 +300,7 @@ class VirtualTimer(VirtualChannel):
                 self.curvalue += self._base_loop_delay
         finally:
             self.curstatus = (status.OK, 'idle')
+            notifyStatusChange(self.name)
 
     def doSimulate(self, preset):
         if self.ismaster:
@@ -358,6 +360,7 @@ class VirtualCounter(VirtualChannel):
                 self.curvalue = int(self._fcurrent)
         finally:
             self.curstatus = (status.OK, 'idle')
+            notifyStatusChange(self.name)
 
     def doSimulate(self, preset):
         if self.ismaster:
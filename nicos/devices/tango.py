@@ -43,7 +43,8 @@ from nicos.core import SIMULATION, ArrayDesc, CanDisable, CommunicationError, \
     ConfigurationError, Device, HardwareError, HasCommunication, HasLimits, \
     HasPrecision, HasTimeout, InvalidValueError, Moveable, NicosError, \
     Override, Param, ProgrammingError, Readable, Value, dictof, floatrange, \
-    intrange, listof, nonemptylistof, oneof, oneofdict, status, tangodev
+    intrange, listof, nonemptylistof, notifyStatusChange, oneof, oneofdict, \
+    status, tangodev
 from nicos.core.constants import FINAL, SLAVE
 from nicos.core.mixins import HasOffset, HasWindowTimeout
 from nicos.devices.abstract import CanReference, Coder, Motor as NicosMotor
@@ -188,6 +189,10 @@ class PyTangoDevice(HasCommunication):
         'tangotimeout': Param('TANGO network timeout for this process',
                               unit='s', type=floatrange(0.0, 1200), default=3,
                               settable=True, preinit=True),
+        'stateevents':  Param('Subscribe to change events of the Tango state, '
+                              'to notice the end of movements right away if '
+                              'the server sends them', type=bool,
+                              default=False, preinit=True),
     }
     parameter_overrides = {
         'unit': Override(mandatory=False),
@@ -206,6 +211,13 @@ class PyTangoDevice(HasCommunication):
     # It is also not required since they reconnect automatically.
     proxy_cache = {}
 
+    # Subscriptions to state change events, like the proxies kept for the
+    # lifetime of the process.
+    event_cache = {}
+
+    # Groups of the devices in a poll group, keyed by the Tango device names.
+    group_cache = {}
+
     def doPreinit(self, mode):
         # Wrap PyTango client creation (so even for the ctor, logging and
         # exception mapping is enabled).
@@ -226,6 +238,43 @@ class PyTangoDevice(HasCommunication):
                                                    status.UNKNOWN)
         return (nicosState, self._dev.Status())
 
+    def doPrefetchGroup(self, devices):
+        # Read the value attribute and the state of all devices with a Tango
+        # group.  The guarded proxy functions return these results instead
+        # of sending a request for the devices during the poll.
+        devices = [dev for dev in devices if isinstance(dev, PyTangoDevice)]
+        names = tuple(dev.tangodevice for dev in devices)
+        group = PyTangoDevice.group_cache.get(names)
+        if group is None:
+            group = PyTango.Group(self.pollgroup)
+            for name in names:
+                group.add(name)
+            PyTangoDevice.group_cache[names] = group
+        timeout = int(self.tangotimeout * 1000)
+        group.set_timeout_millis(timeout)
+        # send all requests before waiting for the replies
+        requests = [
+            ('attr_read value', group.read_attribute_reply,
+             group.read_attribute_asynch('value')),
+            ('cmd State', group.command_inout_reply,
+             group.command_inout_asynch('State')),
+            ('cmd Status', group.command_inout_reply,
+             group.command_inout_asynch('Status')),
+        ]
+        data = {dev: {} for dev in devices}
+        for info, get_reply, request in requests:
+            replies = get_reply(request, timeout)
+            if len(replies) != len(devices):
+                raise CommunicationError(self, 'got %d replies for %d devices '
+                                         'of the poll group' %
+                                         (len(replies), len(devices)))
+            for dev, reply in zip(devices, replies):
+                # failed requests are repeated by the device, to get the
+                # proper error
+                if not reply.has_failed():
+                    data[dev][info] = reply.get_data()
+        return data
+
     def _hw_wait(self):
         """Wait until hardware status is not BUSY."""
         while PyTangoDevice.doStatus(self, 0)[0] == status.BUSY:
@@ -284,8 +333,26 @@ class PyTangoDevice(HasCommunication):
         except AttributeError:
             raise NicosError(self, 'connection to Tango server failed, '
                              'is the server running?')
+        if self.stateevents and proxy_key not in PyTangoDevice.event_cache:
+            self._subscribeStateEvents(device, proxy_key)
         return self._applyGuardsToPyTangoDevice(device)
 
+    def _subscribeStateEvents(self, device, proxy_key):
+        name = self._name
+
+        def callback(event):
+            # wake up waiting for the device
+            if not event.err:
+                notifyStatusChange(name)
+
+        try:
+            PyTangoDevice.event_cache[proxy_key] = device.subscribe_event(
+                'State', PyTango.EventType.CHANGE_EVENT, callback,
+                stateless=True)
+        except PyTango.DevFailed as err:
+            self.log.warning('could not subscribe to state change events: %s',
+                             self._tango_exc_desc(err))
+
     def _applyGuardsToPyTangoDevice(self, dev):
         """
         Wraps command execution and attribute operations of the given
@@ -307,6 +374,11 @@ class PyTangoDevice(HasCommunication):
         def wrap(*args, **kwds):
             info = category + ' ' + args[0] if args else category
 
+            # use the result read for the poll group of the device
+            if self._prefetched and info in self._prefetched:
+                self.log.debug('[Tango] prefetched: %s', info)
+                return self._prefetched[info]
+
             # handle different types for better debug output
             if category == 'cmd':
                 self.log.debug('[Tango] command: %s%r', args[0], args[1:])
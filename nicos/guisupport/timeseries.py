@@ -158,15 +158,24 @@ class TimeSeries(object):
         self.data = np.zeros((self.minsize, 2))
 
     def init_from_history(self, history, starttime, endtime, valueindex=()):
+        """Initialize from the (time, value) pairs of *history*, which can be
+        an iterator.
+        """
         ltime = 0
         lvalue = None
         maxdelta = max(2 * self.interval, 11)
-        data = np.zeros((max(self.minsize, 3*len(history) + 2), 2))
+        if isinstance(history, list):
+            data = np.zeros((max(self.minsize, 3*len(history) + 2), 2))
+        else:
+            data = np.zeros((self.minsize, 2))
         i = 0
         vtime = value = None  # stops pylint from complaining
         for vtime, value in history:
             if value is None:
                 continue
+            if i + 4 > data.shape[0]:
+                # up to three points per value, and one at the end
+                data = np.concatenate((data, np.zeros(data.shape)))
             if valueindex:
                 try:
                     value = functools.reduce(operator.getitem, valueindex, value)
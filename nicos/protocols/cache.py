@@ -75,13 +75,17 @@ Operation: ``OP_ASK`` or ``'?'``
 - When an ``@`` is present, the timestamp is returned with the reply.
 - With ``time1-time2@`` or ``time1+timeinterval@``, a history query is made and
   several values can be returned.
-- The value, if present, is ignored.
+- For history queries, the value can be a maximum number of values to return.
+  The server then divides the time range into intervals and only returns the
+  first, last, minimum and maximum value within each interval.
+- Otherwise, the value, if present, is ignored.
 
 Examples::
 
   nicos/temp/value?                         # request only the value
   @nicos/temp/value?                        # request value with timestamp
   1327504780-1327504790@nicos/temp/value?   # request all values in time range
+  1327504780-1327590000@nicos/temp/value?1000   # request at most 1000 values
 
 Response: except for history queries, a single line in the form ``key=value``
 or ``time@key=value``, see below.  If the key is nonexistent or expired, the
@@ -194,17 +198,34 @@ FLAG_NO_STORE (``'#'``)
 
 Works only with the "set a key" operator.  This flag makes no sense otherwise.
 
+Value encodings
+---------------
+
+Values are normally Python literals (see `cache_dump` and `cache_load`).
+Parsing them is slow for large values, therefore a client can ask for the
+binary encoding (see `cache_dump_binary`), in which values start with ``%``
+followed by base64 encoded data::
+
+  #codec#?binary
+
+The server replies ``#codec#=binary`` if it supports the encoding (servers of
+older versions reply ``#codec#!``).  Afterwards, the client can send values in
+the binary encoding.  The encoding is only used on the wire: the server
+converts the values to the normal encoding before they are stored, so that
+all clients and readers of the stored data get the normal encoding.
+
 """
 
 from __future__ import absolute_import, division, print_function
 
 import re
+import struct
 from ast import Add, BinOp, Call, Dict, List, Name, Num, Set, Str, Sub, \
     Tuple, UnaryOp, USub, parse
 from base64 import b64decode, b64encode
 
 from nicos.pycompat import binary_type, cPickle as pickle, from_utf8, \
-    iteritems, number_types, text_type
+    integer_types, iteritems, number_types, text_type
 from nicos.utils import readonlydict, readonlylist
 
 try:
@@ -241,6 +262,13 @@ FLAG_NO_STORE = '#'
 END_MARKER = '###'
 SYNC_MARKER = '#sync#'
 
+# special key for negotiating the value encoding
+CODEC_MARKER = '#codec#'
+CODEC_BINARY = 'binary'
+
+# start of values in the binary encoding
+BINARY_PREFIX = '%'
+
 # Time constant
 CYCLETIME = 0.1
 
@@ -369,8 +397,206 @@ def ast_eval(node):
 
 def cache_load(entry):
     try:
+        if entry.startswith(BINARY_PREFIX):
+            return cache_load_binary(entry)
         # parsing with 'eval' always gives an ast.Expression node
         expr = parse(entry, mode='eval').body
         return ast_eval(expr)
     except Exception as err:
         raise ValueError('corrupt cache entry: %r (%s)' % (entry, err))
+
+
+# Binary encoding -- a tagged format, base64 encoded to keep the protocol
+# line-based; homogeneous lists of numbers are packed as arrays
+
+_byte = struct.Struct('<B')
+_int32 = struct.Struct('<i')
+_int64 = struct.Struct('<q')
+_float64 = struct.Struct('<d')
+_uint32 = struct.Struct('<I')
+
+# array item types, by size
+_int_codes = [('b', -2**7), ('h', -2**15), ('i', -2**31), ('q', -2**63)]
+
+
+def _length(n):
+    # lengths below 255 take a single byte
+    if n < 255:
+        return _byte.pack(n)
+    return b'\xff' + _uint32.pack(n)
+
+
+def _dump_binary(obj, out):
+    if obj is None:
+        out.append(b'N')
+    elif obj is True:
+        out.append(b'T')
+    elif obj is False:
+        out.append(b'F')
+    elif isinstance(obj, float):
+        out.append(b'd' + _float64.pack(obj))
+    elif isinstance(obj, integer_types) and not isinstance(obj, bool):
+        if -2**31 <= obj < 2**31:
+            out.append(b'i' + _int32.pack(obj))
+        elif -2**63 <= obj < 2**63:
+            out.append(b'j' + _int64.pack(obj))
+        else:
+            data = str(obj).encode()
+            out.append(b'I' + _length(len(data)) + data)
+    elif isinstance(obj, text_type):
+        data = obj.encode('utf-8')
+        out.append(b's' + _length(len(data)) + data)
+    elif isinstance(obj, binary_type):
+        out.append(b'b' + _length(len(obj)) + obj)
+    elif isinstance(obj, (list, tuple)):
+        seqtype = isinstance(obj, list) and b'l' or b't'
+        if len(obj) > 1:
+            itemtype = type(obj[0])
+            if itemtype in (float, int) and \
+               all(type(item) is itemtype for item in obj):
+                code = 'd'
+                if itemtype is int:
+                    lo, hi = min(obj), max(obj)
+                    for code, limit in _int_codes:
+                        if limit <= lo and hi < -limit:
+                            break
+                    else:
+                        code = None  # integers too large
+                if code:
+                    out.append(b'a' + seqtype + code.encode() +
+                               _length(len(obj)) +
+                               struct.pack('<%d%s' % (len(obj), code), *obj))
+                    return
+        out.append(seqtype + _length(len(obj)))
+        for item in obj:
+            _dump_binary(item, out)
+    elif isinstance(obj, dict):
+        out.append(b'D' + _length(len(obj)))
+        for key, value in iteritems(obj):
+            _dump_binary(key, out)
+            _dump_binary(value, out)
+    elif isinstance(obj, frozenset):
+        out.append(b'S' + _length(len(obj)))
+        for item in obj:
+            _dump_binary(item, out)
+    else:
+        try:
+            data = pickle.dumps(obj, protocol=2)
+        except Exception as err:
+            raise ValueError('unserializable object: %r (%s)' % (obj, err))
+        out.append(b'p' + _length(len(data)) + data)
+
+
+def cache_dump_binary(obj):
+    """Like `cache_dump`, but use the binary encoding."""
+    out = []
+    _dump_binary(obj, out)
+    return BINARY_PREFIX + from_utf8(b64encode(b''.join(out)))
+
+
+def _load_length(data, pos):
+    n = _byte.unpack_from(data, pos)[0]
+    if n < 255:
+        return n, pos + 1
+    return _uint32.unpack_from(data, pos + 1)[0], pos + 5
+
+
+def _load_binary(data, pos):
+    tag = data[pos:pos + 1]
+    pos += 1
+    if tag == b'd':
+        return _float64.unpack_from(data, pos)[0], pos + 8
+    elif tag == b'i':
+        return _int32.unpack_from(data, pos)[0], pos + 4
+    elif tag == b's':
+        length, pos = _load_length(data, pos)
+        return data[pos:pos + length].decode('utf-8'), pos + length
+    elif tag in (b'l', b't'):
+        items = []
+        append = items.append
+        length, pos = _load_length(data, pos)
+        for _ in range(length):
+            item, pos = _load_binary(data, pos)
+            append(item)
+        if tag == b'l':
+            return readonlylist(items), pos
+        return tuple(items), pos
+    elif tag == b'a':
+        seqtype, code = data[pos:pos + 1], data[pos + 1:pos + 2].decode()
+        length, pos = _load_length(data, pos + 2)
+        fmt = '<%d%s' % (length, code)
+        items = struct.unpack_from(fmt, data, pos)
+        pos += struct.calcsize(fmt)
+        if seqtype == b'l':
+            return readonlylist(items), pos
+        return items, pos
+    elif tag == b'N':
+        return None, pos
+    elif tag == b'T':
+        return True, pos
+    elif tag == b'F':
+        return False, pos
+    elif tag == b'D':
+        items = []
+        length, pos = _load_length(data, pos)
+        for _ in range(length):
+            key, pos = _load_binary(data, pos)
+            value, pos = _load_binary(data, pos)
+            items.append((key, value))
+        return readonlydict(items), pos
+    elif tag == b'S':
+        items = []
+        length, pos = _load_length(data, pos)
+        for _ in range(length):
+            item, pos = _load_binary(data, pos)
+            items.append(item)
+        return frozenset(items), pos
+    elif tag == b'j':
+        return _int64.unpack_from(data, pos)[0], pos + 8
+    elif tag in (b'b', b'I', b'p'):
+        length, pos = _load_length(data, pos)
+        raw = data[pos:pos + length]
+        pos += length
+        if tag == b'I':
+            return int(raw), pos
+        elif tag == b'p':
+            return pickle.loads(raw), pos
+        return raw, pos
+    raise ValueError('invalid tag %r at position %d' % (tag, pos - 1))
+
+
+def cache_load_binary(entry):
+    """Decode a value in the binary encoding, including the prefix."""
+    data = b64decode(entry[len(BINARY_PREFIX):])
+    value, pos = _load_binary(data, 0)
+    if pos != len(data):
+        raise ValueError('trailing data after value')
+    return value
+
+
+# binary values within lines of the protocol
+binary_value_pattern = re.compile(
+    r'(?<=[%s%s])%s[A-Za-z0-9+/]*=*(?=\r?\n)' % (OP_TELL, OP_TELLOLD,
+                                                BINARY_PREFIX))
+
+
+def cache_value_to_text(value):
+    """Convert a value in the binary encoding to the text encoding.
+
+    Other values (including invalid binary values, which the cache server
+    might have received from some client) are returned unchanged.
+    """
+    if not value.startswith(BINARY_PREFIX):
+        return value
+    try:
+        return cache_dump(cache_load_binary(value))
+    except Exception:
+        return value
+
+
+def cache_to_text(data):
+    """Convert all binary values in protocol lines to the text encoding."""
+    if BINARY_PREFIX not in data:
+        return data
+    return binary_value_pattern.sub(
+        lambda m: cache_value_to_text(m.group()), data)
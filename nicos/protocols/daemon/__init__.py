@@ -74,6 +74,7 @@ DAEMON_COMMANDS = {
     'getcachekeys':   0x46,
     'gettrace':       0x47,
     'getdataset':     0x48,
+    'syncdatasets':   0x49,
     # miscellaneous commands
     'complete':       0x51,
     'transfer':       0x52,
@@ -86,6 +87,12 @@ DAEMON_COMMANDS = {
     'authenticate':   0x64,  # only used during handshake
     'eventunmask':    0x65,
     'rearrange':      0x66,
+    'liveencoding':   0x67,
+    'eventconflate':  0x68,
+    'geteventstats':  0x69,
+    'cachesubscribe': 0x6A,
+    'cacheunsubscribe': 0x6B,
+    'eventbatch':     0x6C,
 }
 
 ACTIVE_COMMANDS = {
@@ -156,6 +163,8 @@ DAEMON_EVENTS = {
     'eta':         (True, 0x101A),
     # message sent out while simulating
     'simmessage':  (True, 0x101B),
+    # several new cache values, if requested with "eventbatch"
+    'cachebatch':  (True, 0x101C),
 }
 
 # possible states of ETA simulation
@@ -31,7 +31,7 @@ import json
 import struct
 
 from nicos.protocols.daemon import DAEMON_COMMANDS, DAEMON_EVENTS, \
-    Serializer as BaseSerializer
+    ProtocolError, Serializer as BaseSerializer
 from nicos.pycompat import PY2, cPickle as pickle
 
 # default port for the daemon
@@ -41,11 +41,11 @@ DEFAULT_PORT = 1301
 # protocol version, increment this whenever making changes to command
 # arguments or adding new commands
 
-PROTO_VERSION = 19
+PROTO_VERSION = 26
 
 # old versions with which the client is still compatible
 
-COMPATIBLE_PROTO_VERSIONS = [18]
+COMPATIBLE_PROTO_VERSIONS = [18, 19, 20, 21, 22, 23, 24, 25]
 
 # to encode payload lengths as network-order 32-bit unsigned int
 LENGTH = struct.Struct('>I')
@@ -180,7 +180,134 @@ class JsonSerializer(BaseSerializer):
         return evtname, self.decoder.decode(data.decode())
 
 
+# frame of the "buffers" serializer: magic, number of out-of-band buffers,
+# length of the pickle; followed by the buffer lengths, the pickle and the
+# buffers, each aligned to BUFFER_ALIGN bytes
+BUFFERS_MAGIC = b'\xffNB1'
+BUFFERS_HEADER = struct.Struct('<4sIQ')
+BUFFER_LENGTH = struct.Struct('<Q')
+BUFFER_ALIGN = 16
+
+
+class BufferList(object):
+    """Serialized data consisting of several buffers.
+
+    The transports send the buffers one after another, instead of joining
+    them first.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.nbytes = sum(memoryview(chunk).nbytes for chunk in chunks)
+
+    def __len__(self):
+        return self.nbytes
+
+    def tobytes(self):
+        return b''.join(self.chunks)
+
+
+class BufferSerializer(BaseSerializer):
+    """Serializer that keeps large buffers out of the pickle.
+
+    The data is pickled with protocol 5, and the data of contiguous NumPy
+    arrays and other `pickle.PickleBuffer` objects larger than *threshold*
+    bytes is sent "out-of-band" after the pickle.  These buffers are neither
+    copied into the pickle on the daemon side, nor copied out of the received
+    frame on the client side.
+
+    Requires Python 3.8 or newer on both sides.
+    """
+
+    name = 'buffers'
+
+    # buffers smaller than this are kept in the pickle
+    threshold = 4096
+
+    def __init__(self):
+        if pickle.HIGHEST_PROTOCOL < 5:
+            raise ProtocolError('the buffers serializer needs pickle '
+                                'protocol 5')
+
+    def _dumps(self, obj):
+        buffers = []
+
+        def buffer_callback(buf):
+            raw = buf.raw()
+            if raw.nbytes < self.threshold:
+                # pickle it in-band
+                return True
+            buffers.append(raw)
+            return False
+
+        data = pickle.dumps(obj, 5, buffer_callback=buffer_callback)
+        head = BUFFERS_HEADER.pack(BUFFERS_MAGIC, len(buffers), len(data)) + \
+            b''.join(BUFFER_LENGTH.pack(buf.nbytes) for buf in buffers)
+        if not buffers:
+            return head + data
+        chunks = [head + data]
+        offset = len(chunks[0])
+        for buf in buffers:
+            padding = _padding(offset)
+            if padding:
+                chunks.append(padding)
+            chunks.append(buf)
+            offset += len(padding) + buf.nbytes
+        return BufferList(chunks)
+
+    def _loads(self, data):
+        view = memoryview(data)
+        magic, nbuffers, length = BUFFERS_HEADER.unpack_from(view)
+        if magic != BUFFERS_MAGIC:
+            raise ProtocolError('invalid data for the buffers serializer')
+        offset = BUFFERS_HEADER.size
+        lengths = struct.unpack_from('<%dQ' % nbuffers, view, offset)
+        offset += nbuffers * BUFFER_LENGTH.size
+        pickled = view[offset:offset + length]
+        offset += length
+        buffers = []
+        for buflen in lengths:
+            offset += len(_padding(offset))
+            buffers.append(view[offset:offset + buflen])
+            offset += buflen
+        return pickle.loads(pickled, buffers=buffers)
+
+    # serializing
+
+    def serialize_cmd(self, cmdname, args):
+        # commands are sent in one piece by the client transports
+        data = self._dumps(args)
+        return data.tobytes() if isinstance(data, BufferList) else data
+
+    def serialize_ok_reply(self, payload):
+        return self._dumps(payload)
+
+    def serialize_error_reply(self, reason):
+        return self._dumps(reason)
+
+    def serialize_event(self, evtname, payload):
+        return self._dumps(payload)
+
+    # deserializing
+
+    def deserialize_cmd(self, data, cmdname=None):
+        return cmdname, self._loads(data)
+
+    def deserialize_reply(self, data, success=None):
+        assert success is not None
+        data = self._loads(data) if data else None
+        return success, data
+
+    def deserialize_event(self, data, evtname=None):
+        return evtname, self._loads(data)
+
+
+def _padding(offset):
+    return b'\0' * (-offset % BUFFER_ALIGN)
+
+
 SERIALIZERS = {
     ClassicSerializer.name: ClassicSerializer,
     JsonSerializer.name: JsonSerializer,
+    BufferSerializer.name: BufferSerializer,
 }
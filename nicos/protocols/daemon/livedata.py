@@ -0,0 +1,153 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2020 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+
+"""Encoding of the frames sent with the "livedata" daemon event.
+
+Without negotiation, the frames are sent as the raw array data.  Clients can
+select encodings with the ``liveencoding`` command; then every frame is sent
+with a header (see `FRAME_HEADER`) and compressed with zlib.
+
+With the "delta" encoding, frames of integer type are sent as the difference
+to the previous frame of the same detector and array index that was sent to
+the client.  Since detector counts mostly accumulate in a few pixels between
+two live updates, the difference compresses much better.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from itertools import count
+
+import numpy as np
+
+from nicos.pycompat import memory_buffer
+
+# encodings that can be selected by the client
+LIVE_ENCODINGS = ['zlib', 'delta']
+
+# frame header: flags, numpy dtype string, frame id, id of the base frame
+FRAME_HEADER = struct.Struct('<B3sQQ')
+
+FLAG_DELTA = 0x01
+
+# zlib compression level: higher levels are much slower for little gain
+COMPRESSION_LEVEL = 1
+
+
+class LiveFrame(object):
+    """A frame of live data, with its encodings created on demand.
+
+    The encoded data is kept, so that every encoding is only created once,
+    regardless of the number of clients.
+    """
+
+    _ids = count(1)
+
+    def __init__(self, stream, dtype, data, previous=None):
+        self.stream = stream
+        self.raw = data
+        self.ident = next(self._ids)
+        try:
+            self.dtype = np.dtype(dtype)
+            # the caller may reuse the buffer, but the data is needed as the
+            # base of the next frame
+            self.array = np.frombuffer(data, self.dtype).copy()
+            self.raw = memory_buffer(self.array)
+        except (TypeError, ValueError):
+            # no array data: can only be sent as bytes
+            self.dtype = np.dtype('u1')
+            self.array = None
+        self.base = None
+        if previous is not None and self.array is not None and \
+           self.dtype.kind in 'ui' and previous.dtype == self.dtype and \
+           previous.array is not None and \
+           previous.array.size == self.array.size:
+            # keep only the data of the previous frame, not its own base
+            self.base = (previous.ident, previous.array)
+        self._lock = threading.Lock()
+        self._encoded = {}
+
+    def __len__(self):
+        # for the size limit of the event queues
+        return len(self.raw)
+
+    def encode(self, delta=False):
+        """Return the frame encoded, as a delta to the base frame if
+        *delta* is true.
+        """
+        with self._lock:
+            if delta not in self._encoded:
+                if delta:
+                    flags, base_id = FLAG_DELTA, self.base[0]
+                    data = self.array - self.base[1]
+                else:
+                    flags, base_id, data = 0, 0, self.raw
+                self._encoded[delta] = FRAME_HEADER.pack(
+                    flags, self.dtype.str.encode(), self.ident, base_id) + \
+                    zlib.compress(memory_buffer(data), COMPRESSION_LEVEL)
+            return self._encoded[delta]
+
+
+class LiveFrameEncoder(object):
+    """Selects the encoding of frames for a single client."""
+
+    def __init__(self, encodings):
+        self.encodings = set(encodings)
+        # map stream -> id of the last frame sent to the client
+        self._sent = {}
+
+    def encode(self, frame):
+        if not len(frame.raw):
+            return frame.raw
+        delta = 'delta' in self.encodings and frame.base is not None and \
+            self._sent.get(frame.stream) == frame.base[0]
+        self._sent[frame.stream] = frame.ident
+        return frame.encode(delta)
+
+
+class LiveFrameDecoder(object):
+    """Decodes the frames received by a client."""
+
+    # number of decoded frames kept as base for following frames
+    keep = 64
+
+    def __init__(self):
+        self._frames = OrderedDict()
+
+    def decode(self, data):
+        if not len(data):
+            return data
+        flags, dtype, ident, base_id = FRAME_HEADER.unpack_from(data)
+        array = np.frombuffer(
+            zlib.decompress(memory_buffer(data)[FRAME_HEADER.size:]),
+            dtype.decode())
+        if flags & FLAG_DELTA:
+            base = self._frames.pop(base_id, None)
+            if base is None:
+                raise ValueError('base frame of live data is missing')
+            array = base + array
+        self._frames[ident] = array
+        while len(self._frames) > self.keep:
+            self._frames.popitem(last=False)
+        return memory_buffer(array)
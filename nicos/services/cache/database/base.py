@@ -53,6 +53,54 @@ class CacheDatabase(Device):
         """Clear the database also from persistent store, if present."""
         self.log.info('clearing database')
 
+    def ask_hist_downsampled(self, key, fromtime, totime, maxpoints):
+        """History query returning at most *maxpoints* values.
+
+        The time range is divided into ``maxpoints // 4`` intervals, and of each
+        interval only the first and last point and the points with minimum and
+        maximum value are returned.  This keeps the shape of a plot of the
+        values, including spikes, with far fewer points.  Non-numeric values
+        only take part in the first/last selection.
+        """
+        nbuckets = max(maxpoints // 4, 1)
+        width = (totime - fromtime) / nbuckets
+        # current bucket number, and its selected points as (time, line)
+        bucket = None
+        first = last = minimum = maximum = None
+        minvalue = maxvalue = None
+        temp = []
+        for chunk in self.ask_hist(key, fromtime, totime):
+            for line in chunk.splitlines(True):
+                time, _, rest = line.partition('@')
+                time = float(time)
+                if width > 0:
+                    nbucket = min(int((time - fromtime) // width),
+                                  nbuckets - 1)
+                else:
+                    nbucket = 0
+                if nbucket != bucket:
+                    if bucket is not None:
+                        temp.extend(_bucket_lines(first, last, minimum,
+                                                  maximum))
+                    bucket = nbucket
+                    first = (time, line)
+                    minimum = maximum = minvalue = maxvalue = None
+                last = (time, line)
+                try:
+                    value = float(rest.partition('=')[2])
+                except ValueError:
+                    continue
+                if minvalue is None or value < minvalue:
+                    minimum, minvalue = (time, line), value
+                if maxvalue is None or value > maxvalue:
+                    maximum, maxvalue = (time, line), value
+            if len(temp) > 100:
+                yield ''.join(temp)
+                temp = []
+        if bucket is not None:
+            temp.extend(_bucket_lines(first, last, minimum, maximum))
+        yield ''.join(temp)
+
     def rewrite(self, key, value):
         """Rewrite handling."""
         if value:
@@ -103,3 +151,10 @@ class CacheDatabase(Device):
                                    key, client_id)
                     self._locks.pop(key, None)
                     return [key + OP_LOCK + '\n']
+
+
+def _bucket_lines(*points):
+    """Return the lines of the given (time, line) points, in time order and
+    without duplicates.
+    """
+    return [line for (_, line) in sorted(set(p for p in points if p))]
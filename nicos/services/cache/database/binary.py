@@ -0,0 +1,436 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2020 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+
+"""Cache database storing the history of every key in a binary file."""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import struct
+import threading
+from collections import OrderedDict
+from os import path
+from time import sleep, time as currenttime
+
+from nicos import config
+from nicos.core import Param
+from nicos.protocols.cache import FLAG_NO_STORE, OP_TELL, OP_TELLOLD
+from nicos.pycompat import from_utf8, iteritems, to_utf8
+from nicos.services.cache.database.memory import MemoryCacheDatabase
+from nicos.services.cache.entry import CacheEntry
+from nicos.utils import createThread, ensureDirectory
+
+MAGIC = b'# NICOS binary cache history v1\n'
+
+# time, TTL and length of the value following the record header
+RECORD = struct.Struct('<ddI')
+# time and file offset of the first record of a block
+INDEX = struct.Struct('<dQ')
+
+
+class HistoryStore(object):
+    """Storage of the history of cache keys in binary files.
+
+    For each key there is a data file (``category/subkey.dat``, with slashes
+    in the category replaced by dashes) and an index file (same name with
+    ``.idx`` extension).  Both files are only ever appended to.
+
+    The data file starts with a two-line header (format identification and the
+    full key), followed by records consisting of the timestamp and TTL as
+    64-bit floats, the length of the value as a 32-bit integer, and the UTF-8
+    encoded value.  A TTL of zero means "no TTL", a negative TTL means "expired
+    at this time, or at an unknown time after it".  Records without value
+    denote deletion (TTL zero) or expiry (negative TTL) of the last value.
+
+    Timestamps in a data file never decrease: an update with an older
+    timestamp than the last stored one is stored with the last timestamp.
+
+    The index file is a sparse index of the data file: whenever
+    `block_size` bytes were written after the last index entry, a new entry
+    with the timestamp and offset of the next record is added.  Since the
+    index entries have a fixed size, a history query can find the block
+    containing its start time by a binary search in the index file, and only
+    has to read the data file from there.
+    """
+
+    # amount of data between two entries of the sparse index
+    block_size = 16384
+    # maximum number of keys whose files are kept open for writing
+    max_open = 256
+
+    def __init__(self, basepath):
+        self.basepath = basepath
+        self._lock = threading.Lock()
+        # map key -> _Writer, least recently used first
+        self._writers = OrderedDict()
+
+    def filename(self, key):
+        """Return the data filename, without extension, for the key."""
+        try:
+            category, subkey = key.rsplit('/', 1)
+        except ValueError:
+            category = 'nocat'
+            subkey = key
+        return path.join(self.basepath, category.replace('/', '-'), subkey)
+
+    def close(self):
+        with self._lock:
+            for writer in self._writers.values():
+                writer.close()
+            self._writers.clear()
+
+    def append(self, key, time, ttl, value):
+        """Append a record for *key*.  *value* None means the value was
+        deleted, or expired if *ttl* is negative.
+        """
+        data = to_utf8(value) if value is not None else b''
+        with self._lock:
+            writer = self._writers.pop(key, None)
+            if writer is None:
+                writer = _Writer(self, key)
+                if len(self._writers) >= self.max_open:
+                    self._writers.popitem(last=False)[1].close()
+            self._writers[key] = writer
+            writer.write(time, ttl or 0., data)
+
+    def history(self, key, fromtime, totime):
+        """Yield ``(time, value)`` for all records of *key* between *fromtime*
+        and *totime*, preceded by the last value before *fromtime*.
+
+        Values of deletion and expiry records are empty strings.
+        """
+        fn = self.filename(key)
+        if not path.isfile(fn + '.dat'):
+            return
+        start = _find_block(fn + '.idx', fromtime)
+        with open(fn + '.dat', 'rb') as fp:
+            if start is None:
+                start = _skip_header(fp)
+            last = None
+            for time, _ttl, value in _read_records(fp, start):
+                if time > totime:
+                    break
+                if time < fromtime:
+                    if value:
+                        last = (time, value)
+                    continue
+                if last is not None:
+                    yield last
+                    last = None
+                yield time, value
+            if last is not None:
+                yield last
+
+    def latest(self):
+        """Yield ``(key, time, ttl, value)`` with the last stored value of all
+        keys.
+
+        If the last record is an expiry record, the value before it is
+        returned with a negative TTL.  For deleted keys, *value* is None.
+        """
+        if not path.isdir(self.basepath):
+            return
+        for dirname in sorted(os.listdir(self.basepath)):
+            dirname = path.join(self.basepath, dirname)
+            if not path.isdir(dirname):
+                continue
+            for fn in sorted(os.listdir(dirname)):
+                if not fn.endswith('.dat'):
+                    continue
+                fn = path.join(dirname, fn[:-4])
+                with open(fn + '.dat', 'rb') as fp:
+                    key = _read_key(fp)
+                    if key is None:
+                        continue
+                    # start one block early, to find the last value before
+                    # an expiry record at the start of the last block
+                    start = _find_block(fn + '.idx', None, 2)
+                    if start is None:
+                        start = fp.tell()
+                    prev = last = None
+                    for record in _read_records(fp, start):
+                        prev, last = last, record
+                if last is None:
+                    continue
+                time, ttl, value = last
+                if not value:
+                    if ttl < 0 and prev is not None and prev[2]:
+                        time, value, ttl = prev[0], prev[2], -1.
+                    else:
+                        value = None
+                yield key, time, ttl, value
+
+
+class _Writer(object):
+    """The open files of one key in a `HistoryStore`."""
+
+    def __init__(self, store, key):
+        self.store = store
+        fn = store.filename(key)
+        ensureDirectory(path.dirname(fn))
+        self.datfp = open(fn + '.dat', 'ab')
+        self.idxfp = open(fn + '.idx', 'ab')
+        self.datfp.seek(0, os.SEEK_END)
+        self.size = self.datfp.tell()
+        self.lasttime = 0
+        self.blockstart = _find_block(fn + '.idx', None)
+        if self.size == 0:
+            self.datfp.write(MAGIC + to_utf8(key) + b'\n')
+            self.datfp.flush()
+            self.size = self.datfp.tell()
+            return
+        # find the last timestamp, to keep the file sorted
+        with open(fn + '.dat', 'rb') as fp:
+            start = self.blockstart
+            if start is None:
+                start = _skip_header(fp)
+            for time, _, _ in _read_records(fp, start):
+                if self.blockstart is None:
+                    # the index got lost: at least index the first record
+                    self.idxfp.write(INDEX.pack(time, start))
+                    self.idxfp.flush()
+                    self.blockstart = start
+                self.lasttime = time
+
+    def close(self):
+        self.datfp.close()
+        self.idxfp.close()
+
+    def write(self, time, ttl, data):
+        time = max(time, self.lasttime)
+        if self.blockstart is None or \
+           self.size - self.blockstart >= self.store.block_size:
+            self.idxfp.write(INDEX.pack(time, self.size))
+            self.idxfp.flush()
+            self.blockstart = self.size
+        record = RECORD.pack(time, ttl, len(data)) + data
+        self.datfp.write(record)
+        self.datfp.flush()
+        self.size += len(record)
+        self.lasttime = time
+
+
+def _skip_header(fp):
+    fp.seek(0)
+    fp.readline()
+    fp.readline()
+    return fp.tell()
+
+
+def _read_key(fp):
+    if fp.readline() != MAGIC:
+        return None
+    return from_utf8(fp.readline().rstrip(b'\n'))
+
+
+def _find_block(idxname, fromtime, back=1):
+    """Return the offset of the last block starting before *fromtime* (or the
+    *back*-th block from the end, if *fromtime* is None), or None if the
+    index is empty.
+    """
+    try:
+        fp = open(idxname, 'rb')
+    except IOError:
+        return None
+    with fp:
+        fp.seek(0, os.SEEK_END)
+        nentries = fp.tell() // INDEX.size
+        if nentries == 0:
+            return None
+        if fromtime is None:
+            pos = max(nentries - back, 0)
+        else:
+            # find the first entry with time >= fromtime
+            low, high = 0, nentries
+            while low < high:
+                mid = (low + high) // 2
+                fp.seek(mid * INDEX.size)
+                if INDEX.unpack(fp.read(INDEX.size))[0] < fromtime:
+                    low = mid + 1
+                else:
+                    high = mid
+            pos = max(low - 1, 0)
+        fp.seek(pos * INDEX.size)
+        return INDEX.unpack(fp.read(INDEX.size))[1]
+
+
+def _read_records(fp, offset):
+    """Yield ``(time, ttl, value)`` for all complete records from *offset*."""
+    fp.seek(offset)
+    buf = b''
+    pos = 0
+    while True:
+        chunk = fp.read(65536)
+        if not chunk:
+            return
+        buf = buf[pos:] + chunk
+        pos = 0
+        while len(buf) - pos >= RECORD.size:
+            time, ttl, length = RECORD.unpack_from(buf, pos)
+            end = pos + RECORD.size + length
+            if end > len(buf):
+                break
+            yield time, ttl, from_utf8(buf[pos + RECORD.size:end])
+            pos = end
+
+
+class BinaryCacheDatabase(MemoryCacheDatabase):
+    """Cache database which keeps the current values in memory and stores the
+    history of each key in binary files of its own.
+
+    Compared to the `FlatfileCacheDatabase`, which has to read and parse the
+    whole day files of a key's category for every day of a history query,
+    a query here only reads the records of the requested key, starting at the
+    block of the queried time range found via a sparse time index.  See
+    `HistoryStore` for a description of the file format.
+
+    Existing flatfile stores can be converted with the
+    ``tools/cache-import-flatfile`` script.
+    """
+
+    parameters = {
+        'storepath': Param('Directory where history stores should be saved',
+                           type=str, mandatory=True),
+    }
+
+    def doInit(self, mode):
+        MemoryCacheDatabase.doInit(self, mode)
+        self._store = HistoryStore(path.join(config.nicos_root,
+                                             self.storepath))
+        self._stoprequest = False
+        self._cleaner = createThread('cleaner', self._clean, start=False)
+
+    def doShutdown(self):
+        self._stoprequest = True
+        if self._cleaner.is_alive():
+            self._cleaner.join()
+        self._store.close()
+
+    def initDatabase(self):
+        now = currenttime()
+        nkeys = 0
+        for key, time, ttl, value in self._store.latest():
+            if value is None:
+                continue
+            if ttl < 0:
+                entry = CacheEntry(time, None, value)
+                entry.expired = True
+            else:
+                entry = CacheEntry(time, ttl or None, value)
+                entry.expired = bool(ttl) and time + ttl < now
+            self._db[key] = [entry]
+            nkeys += 1
+        self._keyindex.update(self._db)
+        self._cleaner.start()
+        self.log.info('loaded %d keys from %s', nkeys, self._store.basepath)
+
+    def clearDatabase(self):
+        self.log.info('clearing database from %s', self._store.basepath)
+        self._store.close()
+        if not path.isdir(self._store.basepath):
+            return
+        with self._db_lock:
+            self._db.clear()
+            self._keyindex.clear()
+            for fn in os.listdir(self._store.basepath):
+                fn = path.join(self._store.basepath, fn)
+                if path.isdir(fn):
+                    for datafile in os.listdir(fn):
+                        os.remove(path.join(fn, datafile))
+                    os.rmdir(fn)
+
+    def ask_hist(self, key, fromtime, totime):
+        if fromtime > totime:
+            return
+        temp = []
+        try:
+            for time, value in self._store.history(key, fromtime, totime):
+                temp.append('%r@%s=%s\n' % (time, key, value))
+                if len(temp) > 100:
+                    # bunch up 100 entries at a time
+                    yield ''.join(temp)
+                    temp = []
+        except Exception:
+            self.log.exception('error reading store file for history query')
+        yield ''.join(temp)
+
+    def _clean(self):
+        def cleanonce():
+            with self._db_lock:
+                for key, entries in iteritems(self._db):
+                    entry = entries[-1]
+                    if not entry.value or entry.expired:
+                        continue
+                    time = currenttime()
+                    if entry.ttl and (entry.time + entry.ttl < time):
+                        entry.expired = True
+                        self._store.append(key, time, -1, None)
+                        self._server.sendUpdate(key, OP_TELLOLD,
+                                                entry.value, time, None)
+
+        while not self._stoprequest:
+            sleep(self._long_loop_delay)
+            cleanonce()
+
+    def tell(self, key, value, time, ttl, from_client):
+        if value is None:
+            # deletes cannot have a TTL
+            ttl = None
+        now = currenttime()
+        if time is None:
+            time = now
+        store_on_disk = True
+        if key.endswith(FLAG_NO_STORE):
+            key = key[:-len(FLAG_NO_STORE)]
+            store_on_disk = False
+        try:
+            category, subkey = key.rsplit('/', 1)
+        except ValueError:
+            category = 'nocat'
+            subkey = key
+        newcats = [category]
+        if category in self._rewrites:
+            newcats.extend(self._rewrites[category])
+        for newcat in newcats:
+            key = newcat + '/' + subkey
+            update = True
+            with self._db_lock:
+                entries = self._db.setdefault(key, [])
+                if not entries:
+                    self._keyindex.add(key)
+                else:
+                    lastent = entries[-1]
+                    if lastent.value == value and not lastent.expired:
+                        # existing entry with the same value: update the TTL
+                        # but don't write an update to the history file
+                        lastent.time = time
+                        lastent.ttl = ttl
+                        update = not store_on_disk
+                    elif value is None and lastent.expired:
+                        # do not delete old value, it is already expired
+                        update = not store_on_disk
+                if update:
+                    entries[:] = [CacheEntry(time, ttl, value)]
+                    if store_on_disk:
+                        self._store.append(key, time, ttl, value)
+            if update and (not ttl or time + ttl > now):
+                self._server.sendUpdate(key, OP_TELL, value or '', time, ttl,
+                                        from_client)
@@ -28,16 +28,96 @@ from __future__ import absolute_import, division, print_function
 import os
 import shutil
 import threading
+from itertools import groupby
 from os import path
 from time import localtime, mktime, sleep, time as currenttime
 
 from nicos import config
 from nicos.core import Param, oneof
 from nicos.protocols.cache import FLAG_NO_STORE, OP_TELL, OP_TELLOLD
-from nicos.pycompat import iteritems, listitems
+from nicos.pycompat import from_utf8, iteritems
 from nicos.services.cache.database.base import CacheDatabase
 from nicos.services.cache.entry import CacheEntry
-from nicos.utils import allDays, createThread, ensureDirectory
+from nicos.services.cache.keyindex import KeyIndex
+from nicos.utils import allDays, createThread, ensureDirectory, safeWriteFile
+
+INDEX_SUFFIX = '.idx'
+INDEX_HEADER = '# NICOS cache index v1'
+
+
+def writeStoreIndex(filename):
+    """Write the sidecar index for the store file *filename*.
+
+    The index file has the name of the store file plus ``.idx``.  After a
+    header line with the size of the indexed store file, it contains one line
+    per subkey with four tab-separated columns: the subkey, the minimum and
+    maximum timestamp, and the offsets of the subkey's lines in the store file
+    (the first one absolute, the others relative to the previous one).
+    """
+    entries = {}
+    offset = 0
+    with open(filename, 'rb') as fd:
+        for line in fd:
+            fields = line.split(None, 2)
+            if len(fields) == 3 and not line.startswith(b'#') and \
+               b'\x00' not in line:
+                try:
+                    time = float(fields[1])
+                except ValueError:
+                    pass
+                else:
+                    entry = entries.get(fields[0])
+                    if entry is None:
+                        entries[fields[0]] = [time, time, offset, [offset]]
+                    else:
+                        entry[0] = min(entry[0], time)
+                        entry[1] = max(entry[1], time)
+                        entry[3].append(offset - entry[2])
+                        entry[2] = offset
+            offset += len(line)
+    lines = ['%s %d\n' % (INDEX_HEADER, offset)]
+    for subkey, (mintime, maxtime, _, offsets) in sorted(iteritems(entries)):
+        lines.append('%s\t%r\t%r\t%s\n' % (from_utf8(subkey), mintime, maxtime,
+                                           ','.join(map(str, offsets))))
+    safeWriteFile(filename + INDEX_SUFFIX, lines, maxbackups=0)
+
+
+def readStoreIndex(filename, subkeys=None):
+    """Read the sidecar index for the store file *filename*.
+
+    Return a dictionary mapping subkeys (only those in *subkeys*, if given) to
+    ``(mintime, maxtime, offsets)``, or None if there is no up-to-date index.
+    """
+    try:
+        fd = open(filename + INDEX_SUFFIX)
+    except IOError:
+        return None
+    with fd:
+        header = fd.readline().split()
+        if header[:-1] != INDEX_HEADER.split() or \
+           header[-1] != str(os.path.getsize(filename)):
+            return None
+        index = {}
+        for line in fd:
+            subkey, rest = line.split('\t', 1)
+            if subkeys is not None and subkey not in subkeys:
+                continue
+            mintime, maxtime, offsets = rest.split('\t')
+            offsets = [int(offset) for offset in offsets.split(',')]
+            for i in range(1, len(offsets)):
+                offsets[i] += offsets[i-1]
+            index[subkey] = (float(mintime), float(maxtime), offsets)
+        return index
+
+
+def _dbkey(category, subkey):
+    """Return the full key of a subkey in a category."""
+    return subkey if category == 'nocat' else category + '/' + subkey
+
+
+def _category(dbkey):
+    """Return the category of a full key."""
+    return dbkey.rpartition('/')[0] or 'nocat'
 
 
 class FlatfileCacheDatabase(CacheDatabase):
@@ -73,6 +153,12 @@ class FlatfileCacheDatabase(CacheDatabase):
     cache server, rather by the NICOS clients.  The value can also a single
     dash, this indicates that at the given timestamp the latest value for this
     key expired.
+
+    When a day is over, a sidecar index (see `writeStoreIndex`) is written for
+    each of its files, so that history queries only need to read the lines of
+    the requested key.  Indexes for older stores can be created with the
+    ``tools/cache-index-flatfile`` script; files without index are read
+    completely.
     """
 
     parameters = {
@@ -87,6 +173,7 @@ class FlatfileCacheDatabase(CacheDatabase):
     def doInit(self, mode):
         self._cat = {}
         self._cat_lock = threading.Lock()
+        self._keyindex = KeyIndex()
         CacheDatabase.doInit(self, mode)
 
         if self.makelinks == 'auto':
@@ -171,6 +258,8 @@ class FlatfileCacheDatabase(CacheDatabase):
             return
         with self._cat_lock:
             for fn in os.listdir(curdir):
+                if fn.endswith(INDEX_SUFFIX):
+                    continue
                 cat = fn.replace('-', '/')
                 try:
                     db = self._read_one_storefile(path.join(curdir, fn))
@@ -179,8 +268,13 @@ class FlatfileCacheDatabase(CacheDatabase):
                     nkeys += len(db)
                 except Exception:
                     self.log.warning('could not read cache file %s', fn, exc=1)
+            self._keyindex.update(_dbkey(cat, subkey)
+                                  for (cat, (_, _, db)) in iteritems(self._cat)
+                                  for subkey in db)
             if do_rollover:
                 self._rollover()
+                createThread('indexer', self._write_indexes,
+                             args=(path.realpath(curdir),))
         self.log.info('loaded %d keys from files in %s', nkeys, curdir)
 
     def clearDatabase(self):
@@ -200,6 +294,7 @@ class FlatfileCacheDatabase(CacheDatabase):
     def _rollover(self):
         """Must be called with self._cat_lock held."""
         self.log.info('midnight passed, data file rollover started')
+        lastdir = path.join(self._basepath, self._year, self._currday)
         ltime = localtime()
         # set the days and midnight time correctly
         self._year = str(ltime[0])
@@ -223,8 +318,23 @@ class FlatfileCacheDatabase(CacheDatabase):
             fd.close()
         # set the 'lastday' symlink to the current day directory
         self._set_lastday()
+        # the files of the last day are complete now, index them
+        if lastdir != path.join(self._basepath, self._year, self._currday):
+            createThread('indexer', self._write_indexes, args=(lastdir,))
         # old files could be compressed here, but it is probably not worth it
 
+    def _write_indexes(self, dirname):
+        if not path.isdir(dirname):
+            return
+        for fn in os.listdir(dirname):
+            fn = path.join(dirname, fn)
+            if fn.endswith(INDEX_SUFFIX) or readStoreIndex(fn, ()) is not None:
+                continue
+            try:
+                writeStoreIndex(fn)
+            except Exception:
+                self.log.warning('could not write index for %s', fn, exc=1)
+
     def _set_lastday(self):
         if not hasattr(os, 'symlink'):
             return
@@ -291,44 +401,61 @@ class FlatfileCacheDatabase(CacheDatabase):
 
     def ask_wc(self, key, ts, time, ttl):
         ret = set()
-        # look for matching keys
-        for cat, (_, lock, db) in listitems(self._cat):
-            prefix = cat + '/' if cat != 'nocat' else ''
+        # look for matching keys, grouped by category
+        for cat, dbkeys in groupby(self._keyindex.match(key), _category):
+            catinfo = self._cat.get(cat)
+            if catinfo is None:
+                continue
+            _, lock, db = catinfo
             with lock:
-                for subkey, entry in iteritems(db):
-                    if key not in prefix+subkey:
-                        continue
+                for dbkey in dbkeys:
+                    entry = db.get(dbkey.rpartition('/')[2])
                     # check for removed keys
-                    if entry.value is None:
+                    if entry is None or entry.value is None:
                         continue
                     # check for expired keys
                     op = entry.expired and OP_TELLOLD or OP_TELL
                     if entry.ttl:
                         if ts:
                             ret.add('%r+%s@%s%s%s\n' %
-                                    (entry.time, entry.ttl, prefix+subkey,
+                                    (entry.time, entry.ttl, dbkey,
                                      op, entry.value))
                         else:
-                            ret.add(prefix+subkey + op + entry.value + '\n')
+                            ret.add(dbkey + op + entry.value + '\n')
                     elif ts:
-                        ret.add('%r@%s%s%s\n' % (entry.time, prefix+subkey,
+                        ret.add('%r@%s%s%s\n' % (entry.time, dbkey,
                                                  op, entry.value))
                     else:
-                        ret.add(prefix+subkey + op + entry.value + '\n')
+                        ret.add(dbkey + op + entry.value + '\n')
         return [''.join(ret)]
 
-    def _read_one_histfile(self, year, monthday, category, subkey):
+    def _read_one_histfile(self, year, monthday, category, subkey, fromtime):
         fn = path.join(self._basepath, year, monthday, category)
         if not path.isfile(fn):
             return
-        with open(fn, 'U') as fd:
+        index = readStoreIndex(fn, (subkey,))
+        if index is not None and subkey not in index:
+            # no data for this key on that day
+            return
+        with open(fn, 'rb') as fd:
             firstline = fd.readline()
             nsplit = 2
-            if firstline.startswith('# NICOS cache store file v2'):
+            if firstline.startswith(b'# NICOS cache store file v2'):
                 nsplit = 3
             else:
                 fd.seek(0, os.SEEK_SET)
-            for line in fd:
+            reverse = False
+            if index is None:
+                lines = fd
+            else:
+                _, maxtime, offsets = index[subkey]
+                if maxtime < fromtime:
+                    # only the last value before the queried range is needed
+                    reverse = True
+                    offsets = offsets[::-1]
+                lines = self._read_lines(fd, offsets)
+            for line in lines:
+                line = from_utf8(line)
                 if '\x00' in line:
                     self.log.warning('found nullbyte in file %s', fn)
                     continue
@@ -337,8 +464,17 @@ class FlatfileCacheDatabase(CacheDatabase):
                     time = float(fields[1])
                     value = fields[-1]
                     if value == '-':
+                        if reverse:
+                            continue
                         value = ''
                     yield (time, value)
+                    if reverse:
+                        return
+
+    def _read_lines(self, fd, offsets):
+        for offset in offsets:
+            fd.seek(offset)
+            yield fd.readline()
 
     def ask_hist(self, key, fromtime, totime):
         try:
@@ -359,8 +495,8 @@ class FlatfileCacheDatabase(CacheDatabase):
         inrange = False
         for year, monthday in days:
             try:
-                for time, value in self._read_one_histfile(year, monthday,
-                                                           category, subkey):
+                for time, value in self._read_one_histfile(
+                        year, monthday, category, subkey, fromtime):
                     if fromtime <= time <= totime:
                         if not inrange and lastvalue:
                             temp.append(lastvalue)
@@ -390,10 +526,9 @@ class FlatfileCacheDatabase(CacheDatabase):
                             time = currenttime()
                             if entry.ttl and (entry.time + entry.ttl < time):
                                 entry.expired = True
-                                for client in self._server._connected.values():
-                                    client.update(cat + '/' + subkey,
-                                                  OP_TELLOLD, entry.value,
-                                                  time, None)
+                                self._server.sendUpdate(
+                                    cat + '/' + subkey, OP_TELLOLD,
+                                    entry.value, time, None)
                                 if fd is None:
                                     fd = self._create_fd(cat)
                                     self._cat[cat][0] = fd
@@ -446,6 +581,8 @@ class FlatfileCacheDatabase(CacheDatabase):
                         # do not delete old value, it is already expired
                         update = not store_on_disk
                 if update:
+                    if subkey not in db:
+                        self._keyindex.add(_dbkey(newcat, subkey))
                     db[subkey] = CacheEntry(time, ttl, value)
                     if store_on_disk:
                         if fd is None:
@@ -458,6 +595,5 @@ class FlatfileCacheDatabase(CacheDatabase):
                         fd.flush()
             if update and (not ttl or time + ttl > now):
                 key = newcat + '/' + subkey
-                for client in self._server._connected.values():
-                    if client is not from_client:
-                        client.update(key, OP_TELL, value or '', time, ttl)
+                self._server.sendUpdate(key, OP_TELL, value or '', time, ttl,
+                                        from_client)
@@ -143,6 +143,7 @@ class KafkaCacheDatabase(MemoryCacheDatabase):
 
                         self._db[msg.key] = [entry]
 
+        self._keyindex.update(self._db)
         self._cleaner.start()
         self.log.info('Processed %i messages.', message_count)
 
@@ -156,9 +157,8 @@ class KafkaCacheDatabase(MemoryCacheDatabase):
                     time = currenttime()
                     if entry.ttl and (entry.time + entry.ttl < time):
                         entry.expired = True
-                        for client in self._server._connected.values():
-                            client.update(key, OP_TELLOLD, entry.value, time,
-                                          None)
+                        self._server.sendUpdate(key, OP_TELLOLD,
+                                                entry.value, time, None)
 
         while not self._stoprequest:
             sleep(self._long_loop_delay)
@@ -208,7 +208,9 @@ class KafkaCacheDatabase(MemoryCacheDatabase):
             key = newcat + '/' + subkey
             with self._db_lock:
                 entries = self._db.setdefault(key, [])
-                if entries:
+                if not entries:
+                    self._keyindex.add(key)
+                else:
                     lastent = entries[-1]
                     if lastent.value == value and not lastent.expired:
                         # not a real update
@@ -218,9 +220,8 @@ class KafkaCacheDatabase(MemoryCacheDatabase):
                 if send_update:
                     self._update_topic(key, thisent)
             if send_update or always_send_update:
-                for client in self._server._connected.values():
-                    if client is not from_client and client.is_active():
-                        client.update(key, OP_TELL, value or '', time, ttl)
+                self._server.sendUpdate(key, OP_TELL, value or '', time, ttl,
+                                        from_client)
 
 
 class KafkaCacheDatabaseWithHistory(KafkaCacheDatabase):
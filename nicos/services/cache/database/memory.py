@@ -30,9 +30,9 @@ from time import time as currenttime
 
 from nicos.core import Param, intrange
 from nicos.protocols.cache import FLAG_NO_STORE, OP_TELL, OP_TELLOLD
-from nicos.pycompat import iteritems
 from nicos.services.cache.database.base import CacheDatabase
 from nicos.services.cache.entry import CacheEntry
+from nicos.services.cache.keyindex import KeyIndex
 
 
 class MemoryCacheDatabase(CacheDatabase):
@@ -41,14 +41,27 @@ class MemoryCacheDatabase(CacheDatabase):
     def doInit(self, mode):
         self._db = {}
         self._db_lock = threading.Lock()
+        # must be updated together with self._db by subclasses
+        self._keyindex = KeyIndex()
         CacheDatabase.doInit(self, mode)
 
+    def _shard(self, dbkey):
+        """Return the dictionary containing *dbkey*, its lock and its
+        key index.
+        """
+        return self._db, self._db_lock, self._keyindex
+
+    def _all_shards(self):
+        """Return all (dictionary, lock, key index) of the database."""
+        return [(self._db, self._db_lock, self._keyindex)]
+
     def ask(self, key, ts, time, ttl):
         dbkey = key if '/' in key else 'nocat/' + key
-        with self._db_lock:
-            if dbkey not in self._db:
+        db, lock, _ = self._shard(dbkey)
+        with lock:
+            if dbkey not in db:
                 return [key + OP_TELLOLD + '\n']
-            lastent = self._db[dbkey][-1]
+            lastent = db[dbkey][-1]
         # check for already removed keys
         if lastent.value is None:
             return [key + OP_TELLOLD + '\n']
@@ -61,20 +74,23 @@ class MemoryCacheDatabase(CacheDatabase):
                                             key, op, lastent.value)]
             else:
                 return [key + op + lastent.value + '\n']
+        op = lastent.expired and OP_TELLOLD or OP_TELL
         if ts:
-            return [
-                '%r@%s%s%s\n' % (lastent.time, key, OP_TELL, lastent.value)]
+            return ['%r@%s%s%s\n' % (lastent.time, key, op, lastent.value)]
         else:
-            return [key + OP_TELL + lastent.value + '\n']
+            return [key + op + lastent.value + '\n']
 
     def ask_wc(self, key, ts, time, ttl):
         ret = set()
-        with self._db_lock:
+        for db, lock, keyindex in self._all_shards():
             # look for matching keys
-            for dbkey, entries in iteritems(self._db):
-                if key not in dbkey:
-                    continue
-                lastent = entries[-1]
+            dbkeys = keyindex.match(key)
+            # only take a snapshot of the current entries under the lock, so
+            # that updates are not blocked while formatting
+            with lock:
+                snapshot = [(dbkey, db[dbkey][-1])
+                            for dbkey in dbkeys if dbkey in db]
+            for dbkey, lastent in snapshot:
                 # check for removed keys
                 if lastent.value is None:
                     continue
@@ -89,12 +105,15 @@ class MemoryCacheDatabase(CacheDatabase):
                                                     dbkey, op, lastent.value))
                     else:
                         ret.add(dbkey + op + lastent.value + '\n')
-                elif ts:
-                    ret.add('%r@%s%s%s\n' % (lastent.time, dbkey,
-                                             OP_TELL, lastent.value))
                 else:
-                    ret.add(dbkey + OP_TELL + lastent.value + '\n')
-        return ret
+                    op = lastent.expired and OP_TELLOLD or OP_TELL
+                    if ts:
+                        ret.add('%r@%s%s%s\n' % (lastent.time, dbkey,
+                                                 op, lastent.value))
+                    else:
+                        ret.add(dbkey + op + lastent.value + '\n')
+        # send the reply at once, not line by line
+        return [''.join(ret)]
 
     def ask_hist(self, key, fromtime, totime):
         return []
@@ -119,9 +138,13 @@ class MemoryCacheDatabase(CacheDatabase):
             newcats.extend(self._rewrites[category])
         for newcat in newcats:
             key = newcat + '/' + subkey
-            with self._db_lock:
-                entries = self._db.setdefault(key, [])
-                if entries:
+            db, lock, keyindex = self._shard(key)
+            with lock:
+                entries = db.get(key)
+                if entries is None:
+                    entries = db[key] = []
+                    keyindex.add(key)
+                else:
                     lastent = entries[-1]
                     if lastent.value == value and not lastent.ttl:
                         # not a real update
@@ -129,9 +152,8 @@ class MemoryCacheDatabase(CacheDatabase):
                 # never cache more than a single entry, memory fills up too fast
                 entries[:] = [CacheEntry(time, ttl, value)]
             if send_update or always_send_update:
-                for client in self._server._connected.values():
-                    if client is not from_client and client.is_active():
-                        client.update(key, OP_TELL, value or '', time, ttl)
+                self._server.sendUpdate(key, OP_TELL, value or '', time, ttl,
+                                        from_client)
 
 
 class MemoryCacheDatabaseWithHistory(MemoryCacheDatabase):
@@ -148,23 +170,31 @@ class MemoryCacheDatabaseWithHistory(MemoryCacheDatabase):
 
     def ask_hist(self, key, fromtime, totime):
         if fromtime > totime:
-            return []
-        ret = []
+            return
+        temp = []
         # return the first value before the range too
+        lastvalue = None
         inrange = False
         try:
-            entries = self._db[key]
+            db, lock, _ = self._shard(key)
+            with lock:
+                entries = list(db[key])
             for entry in entries:
                 if fromtime <= entry.time <= totime:
-                    ret.append('%r@%s=%s\n' % (entry.time, key, entry.value))
+                    if not inrange and lastvalue:
+                        temp.append(lastvalue)
+                    temp.append('%r@%s=%s\n' % (entry.time, key, entry.value))
                     inrange = True
+                    if len(temp) > 100:
+                        # bunch up 100 entries at a time
+                        yield ''.join(temp)
+                        temp = []
                 elif not inrange and entry.value:
-                    ret = ['%r@%s=%s\n' % (entry.time, key, entry.value)]
+                    lastvalue = '%r@%s=%s\n' % (entry.time, key, entry.value)
         except Exception:
             self.log.exception('error reading store for history query')
-        if not inrange:
-            return []
-        return [''.join(ret)]
+        if temp:
+            yield ''.join(temp)
 
     def tell(self, key, value, time, ttl, from_client):
         if value is None:
@@ -186,15 +216,53 @@ class MemoryCacheDatabaseWithHistory(MemoryCacheDatabase):
             newcats.extend(self._rewrites[category])
         for newcat in newcats:
             key = newcat + '/' + subkey
-            with self._db_lock:
-                queue = deque([CacheEntry(None, None, None)], self.maxentries)
-                entries = self._db.setdefault(key, queue)
+            db, lock, keyindex = self._shard(key)
+            with lock:
+                entries = db.get(key)
+                if entries is None:
+                    entries = db[key] = deque([CacheEntry(None, None, None)],
+                                              self.maxentries)
+                    keyindex.add(key)
                 lastent = entries[-1]
                 if lastent.value == value and not lastent.ttl:
                     # not a real update
                     send_update = False
                 entries.append(CacheEntry(time, ttl, value))
             if send_update or always_send_update:
-                for client in self._server._connected.values():
-                    if client is not from_client and client.is_active():
-                        client.update(key, OP_TELL, value or '', time, ttl)
+                self._server.sendUpdate(key, OP_TELL, value or '', time, ttl,
+                                        from_client)
+
+
+class ShardedMemoryCacheDatabase(MemoryCacheDatabase):
+    """Like `MemoryCacheDatabase`, but the keys are distributed over several
+    independently locked dictionaries ("shards") by their category.
+
+    Updates of different devices then do not wait for each other, and
+    wildcard queries only hold the lock of one shard at a time while taking a
+    snapshot of its entries.
+    """
+
+    parameters = {
+        'shards': Param('Number of independently locked parts of the '
+                        'database', type=intrange(1, 1024), default=16,
+                        settable=False),
+    }
+
+    def doInit(self, mode):
+        self._shards = [({}, threading.Lock(), KeyIndex())
+                        for _ in range(self.shards)]
+        CacheDatabase.doInit(self, mode)
+
+    def _shard(self, dbkey):
+        # all keys of a category (i.e. of a device) are in the same shard
+        return self._shards[hash(dbkey.rsplit('/', 1)[0]) % self.shards]
+
+    def _all_shards(self):
+        return self._shards
+
+
+class ShardedMemoryCacheDatabaseWithHistory(ShardedMemoryCacheDatabase,
+                                            MemoryCacheDatabaseWithHistory):
+    """Like `MemoryCacheDatabaseWithHistory`, but sharded like
+    `ShardedMemoryCacheDatabase`.
+    """
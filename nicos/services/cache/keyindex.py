@@ -0,0 +1,115 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2020 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+
+"""Index of the keys of a cache database for wildcard queries."""
+
+from __future__ import absolute_import, division, print_function
+
+import threading
+from bisect import bisect_left, insort
+
+from nicos.pycompat import iteritems
+
+
+class KeyIndex(object):
+    """Finds the keys matching a wildcard query.
+
+    Wildcard queries are substring matches, but nearly all of them are really
+    prefix queries like ``nicos/slit/``.  The keys are kept in a sorted list,
+    so that the keys starting with the query can be found by bisection.
+
+    This only gives the right result if the query cannot occur later in a
+    key.  Therefore, for each first component of the keys (the "root", e.g.
+    ``nicos``), the number of keys that contain ``root/`` somewhere else than
+    at the start is counted.  If that number is zero for the root of the
+    query, all matches start with the query.  For other queries, all keys are
+    scanned.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = []
+        self._keyset = set()
+        # map root -> number of keys with "root/" not at the start
+        self._roots = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key):
+        with self._lock:
+            if key not in self._keyset:
+                self._add(key)
+                insort(self._keys, key)
+
+    def update(self, keys):
+        """Add many keys at once, e.g. when loading the database."""
+        with self._lock:
+            keys = set(keys) - self._keyset
+            for key in keys:
+                self._add(key)
+            self._keys.extend(keys)
+            self._keys.sort()
+
+    def _add(self, key):
+        self._keyset.add(key)
+        if '/' in key:
+            root = key.split('/', 1)[0]
+            if root not in self._roots:
+                inner = root + '/'
+                self._roots[root] = sum(1 for k in self._keyset
+                                        if k.find(inner, 1) != -1)
+                # the new key is already counted now
+                self._count(key, 1, skip=root)
+                return
+        self._count(key, 1)
+
+    def _count(self, key, delta, skip=None):
+        for root, number in iteritems(self._roots):
+            if root != skip and key.find(root + '/', 1) != -1:
+                self._roots[root] = number + delta
+
+    def discard(self, key):
+        with self._lock:
+            if key in self._keyset:
+                self._keyset.discard(key)
+                del self._keys[bisect_left(self._keys, key)]
+                self._count(key, -1)
+
+    def clear(self):
+        with self._lock:
+            self._keys = []
+            self._keyset = set()
+            self._roots = {}
+
+    def match(self, query):
+        """Return a sorted list of all keys containing *query*."""
+        with self._lock:
+            keys = self._keys
+            if not query:
+                return list(keys)
+            if '/' not in query or \
+               self._roots.get(query.split('/', 1)[0]) != 0:
+                return [key for key in keys if query in key]
+            # all keys between the query and the query with its last
+            # character incremented start with the query
+            end = query[:-1] + chr(ord(query[-1]) + 1)
+            return keys[bisect_left(keys, query):bisect_left(keys, end)]
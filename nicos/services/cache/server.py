@@ -40,22 +40,33 @@ from __future__ import absolute_import, division, print_function
 import select
 import socket
 import threading
-from errno import EAGAIN
+from collections import deque
+from errno import EAGAIN, EWOULDBLOCK
 from time import sleep, time as currenttime
+from types import GeneratorType
 
 from nicos import config, session
-from nicos.core import Attach, Device, Param, host
-from nicos.protocols.cache import BUFSIZE, CYCLETIME, DEFAULT_CACHE_PORT, \
-    OP_ASK, OP_LOCK, OP_REWRITE, OP_SUBSCRIBE, OP_TELL, OP_TELLOLD, \
-    OP_UNSUBSCRIBE, OP_WILDCARD, line_pattern, msg_pattern
-from nicos.pycompat import from_utf8, listitems, listvalues, queue, to_utf8
+from nicos.core import Attach, ConfigurationError, Device, Param, host, \
+    intrange
+from nicos.protocols.cache import BUFSIZE, CODEC_BINARY, CODEC_MARKER, \
+    CYCLETIME, DEFAULT_CACHE_PORT, OP_ASK, OP_LOCK, OP_REWRITE, OP_SUBSCRIBE, \
+    OP_TELL, OP_TELLOLD, OP_UNSUBSCRIBE, OP_WILDCARD, cache_to_text, \
+    cache_value_to_text, line_pattern, msg_pattern
+from nicos.pycompat import from_utf8, get_thread_id, listitems, listvalues, \
+    queue, to_utf8
 # pylint: disable=W0611
 from nicos.services.cache.database import CacheDatabase, \
     FlatfileCacheDatabase, MemoryCacheDatabase, \
     MemoryCacheDatabaseWithHistory
+from nicos.services.cache.subscriptions import SubscriptionIndex
 from nicos.utils import closeSocket, createThread, getSysInfo, loggers, \
     parseHostPort
 
+try:
+    import selectors
+except ImportError:
+    selectors = None
+
 
 class CacheWorker(object):
     """Worker thread class for the cache server.
@@ -64,10 +75,12 @@ class CacheWorker(object):
     and one for sending.  Data to send must be posited in `self.send_queue`.
     """
 
-    def __init__(self, db, sock, name, loglevel):
+    def __init__(self, db, sock, name, loglevel, server=None):
         self.name = name
         # actual value handling is done by the database object
         self.db = db
+        # the server, which keeps the subscription index
+        self.server = server
         # the socket object
         self.sock = sock
         # timeout for send (recv is covered by select timeout)
@@ -76,6 +89,8 @@ class CacheWorker(object):
         self.updates_on = set()
         # list of subscriptions with timestamp requested
         self.ts_updates_on = set()
+        # whether the client understands values in the binary encoding
+        self.binary_values = False
         self.stoprequest = False
 
         self.log = session.getLogger(name)
@@ -85,12 +100,15 @@ class CacheWorker(object):
         self.start_sender(name)
 
         # start receiver thread
-        self.receiver = createThread('receiver %s' % name, self._receiver_thread)
+        self.start_receiver(name)
 
     def start_sender(self, name):
         self.send_queue = queue.Queue()
         self.sender = createThread('sender %s' % name, self._sender_thread)
 
+    def start_receiver(self, name):
+        self.receiver = createThread('receiver %s' % name, self._receiver_thread)
+
     def __str__(self):
         return 'worker(%s)' % self.name
 
@@ -194,6 +212,15 @@ class CacheWorker(object):
         return data
 
     def _handle_line(self, line):
+        ret = self._dispatch_line(line)
+        if ret and not self.binary_values:
+            # convert values for clients that only understand text
+            if isinstance(ret, GeneratorType):
+                return (cache_to_text(item) for item in ret)
+            return [cache_to_text(item) for item in ret]
+        return ret
+
+    def _dispatch_line(self, line):
         # self.log.debug('handling line: %s', line)
         match = msg_pattern.match(line)
         if not match:
@@ -206,6 +233,10 @@ class CacheWorker(object):
         time, ttlop, ttl, tsop, key, op, value = match.groups()
         key = key.lower()
         value = value or None  # no value -> value gets deleted
+        if value and self.binary_values and op in (OP_TELL, OP_LOCK):
+            # the encoding is only used on the wire: always store values in
+            # the text encoding, which all readers of the database understand
+            value = cache_value_to_text(value)
         try:
             time = float(time)
         except (TypeError, ValueError):
@@ -224,7 +255,22 @@ class CacheWorker(object):
         if op == OP_TELL:
             self.db.tell(key, value, time, ttl, self)
         elif op == OP_ASK:
+            if key == CODEC_MARKER:
+                # the client asks for one of the given value encodings
+                if CODEC_BINARY in (value or '').split(','):
+                    self.binary_values = True
+                    return [CODEC_MARKER + OP_TELL + CODEC_BINARY + '\n']
+                self.binary_values = False
+                return [CODEC_MARKER + OP_TELLOLD + '\n']
             if ttl:
+                # the value can give the maximum number of returned points
+                try:
+                    maxpoints = int(value)
+                except (TypeError, ValueError):
+                    maxpoints = 0
+                if maxpoints > 0:
+                    return self.db.ask_hist_downsampled(key, time, time + ttl,
+                                                        maxpoints)
                 return self.db.ask_hist(key, time, time + ttl)
             else:
                 # although passed, time and ttl are ignored here
@@ -239,11 +285,15 @@ class CacheWorker(object):
                 self.ts_updates_on.add(key)
             else:
                 self.updates_on.add(key)
+            if self.server:
+                self.server._subscriptions.add(self, key, bool(tsop))
         elif op == OP_UNSUBSCRIBE:
             if tsop:
                 self.ts_updates_on.discard(key)  # note: discard does not raise
             else:
                 self.updates_on.discard(key)
+            if self.server:
+                self.server._subscriptions.discard(self, key, bool(tsop))
         elif op == OP_TELLOLD:
             # the server shouldn't get TELLOLD, ignore it
             pass
@@ -253,38 +303,40 @@ class CacheWorker(object):
             self.db.rewrite(key, value)
         return []
 
-    def update(self, key, op, value, time, ttl):
-        """Check if we need to send the update given."""
-        # make sure line has at least a default timestamp
-        for mykey in self.ts_updates_on:
-            # do a substring match on key
-            if mykey in key:
-                if not time:
-                    time = currenttime()
-                # self.log.debug('sending update of %s to %s', key, value)
-                if ttl is not None:
-                    msg = '%r+%s@%s%s%s\n' % (time, ttl, key, op, value)
-                else:
-                    msg = '%r@%s%s%s\n' % (time, key, op, value)
-                self.send_queue.put(msg)
-                return  # send at most one update
-        # same for requested updates without timestamp
-        for mykey in self.updates_on:
-            if mykey in key:
-                # self.log.debug('sending update of %s to %s', key, value)
-                self.send_queue.put(key + op + value + '\n')
-                return  # send at most one update
+    def send_update(self, key, op, value, time, ttl, withts, textvalue=None):
+        """Send the update given, with timestamp if *withts* is true.
+
+        *textvalue* can be the value already converted to the text encoding,
+        to avoid converting it again for every text client.
+        """
+        # self.log.debug('sending update of %s to %s', key, value)
+        if not self.binary_values:
+            if textvalue is None:
+                textvalue = cache_value_to_text(value)
+            value = textvalue
+        if withts:
+            # make sure line has at least a default timestamp
+            if not time:
+                time = currenttime()
+            if ttl is not None:
+                msg = '%r+%s@%s%s%s\n' % (time, ttl, key, op, value)
+            else:
+                msg = '%r@%s%s%s\n' % (time, key, op, value)
+            self.send_queue.put(msg)
+        else:
+            self.send_queue.put(key + op + value + '\n')
 
 
 class CacheUDPWorker(CacheWorker):
     """Special subclass for handling UDP requests."""
 
-    def __init__(self, db, sock, name, data, remoteaddr, loglevel):
+    def __init__(self, db, sock, name, data, remoteaddr, loglevel,
+                 server=None):
         # "data" is what we received over the UDP socket, "remoteaddr" is the
         # address for replies
         self.data = data
         self.remoteaddr = remoteaddr
-        CacheWorker.__init__(self, db, sock, name, loglevel)
+        CacheWorker.__init__(self, db, sock, name, loglevel, server)
 
     def start_sender(self, name):
         pass
@@ -352,6 +404,7 @@ class CacheServer(Device):
         self._connected = {}
         self._attached_db._server = self
         self._connectionLock = threading.Lock()
+        self._subscriptions = SubscriptionIndex()
 
     def start(self, *startargs):
         if config.instrument == 'demo' and 'clear' in startargs:
@@ -364,6 +417,19 @@ class CacheServer(Device):
         key, res = getSysInfo('cache')
         self._attached_db.tell(key, str(res), currenttime(), None, None)
 
+    def sendUpdate(self, key, op, value, time, ttl, from_client=None):
+        """Send an update of *key* to all clients subscribed to it, except
+        for *from_client* (which is the client that sent the update).
+        """
+        textvalue = None
+        for client, withts in self._subscriptions.lookup(key):
+            if client is not from_client and client.is_active():
+                # convert binary values only once for all text clients
+                if textvalue is None and not client.binary_values:
+                    textvalue = cache_value_to_text(value)
+                client.send_update(key, op, value, time, ttl, withts,
+                                   textvalue)
+
     def _bind_to(self, address, proto='tcp'):
         # bind to the address with the given protocol; return socket and address
         host, port = parseHostPort(address, DEFAULT_CACHE_PORT)
@@ -382,9 +448,10 @@ class CacheServer(Device):
             serversocket.close()
             return None, None     # failed, return None as indicator
 
-    def _server_thread(self):
-        self.log.info('server starting')
-
+    def _bind_sockets(self):
+        """Bind the UDP and TCP server sockets; return False if neither of
+        them could be bound.
+        """
         # bind UDP broadcast socket
         self.log.debug('trying to bind to UDP broadcast')
         self._serversocket_udp = self._bind_to('', 'udp')[0]
@@ -399,13 +466,19 @@ class CacheServer(Device):
         if not self._serversocket and not self._serversocket_udp:
             self._stoprequest = True
             self.log.error("couldn't bind any sockets, giving up!")
-            return
+            return False
 
         if not self._boundto:
             self.log.warning('starting main loop only bound to UDP broadcast')
         else:
             self.log.info('TCP bound to %s:%s',
                           self._boundto[0], self._boundto[1])
+        return True
+
+    def _server_thread(self):
+        self.log.info('server starting')
+        if not self._bind_sockets():
+            return
 
         # now enter main serving loop
         while not self._stoprequest:
@@ -417,6 +490,7 @@ class CacheServer(Device):
                     client.closedown()
                     client.join()  # wait for threads to end
                     del self._connected[addr]
+                    self._subscriptions.remove_client(client)
 
             # now check for additional incoming connections
             # build list of things to check
@@ -440,7 +514,8 @@ class CacheServer(Device):
                     addr = 'tcp://%s:%d' % addr
                     self.log.info('new connection from %s', addr)
                     self._connected[addr] = CacheWorker(
-                        self._attached_db, conn, name=addr, loglevel=self.loglevel)
+                        self._attached_db, conn, name=addr,
+                        loglevel=self.loglevel, server=self)
                 elif self._serversocket_udp in res[0]:
                     # UDP data came in
                     data, addr = self._serversocket_udp.recvfrom(3072)
@@ -448,7 +523,8 @@ class CacheServer(Device):
                     self.log.info('new connection from %s', nice_addr)
                     self._connected[nice_addr] = CacheUDPWorker(
                         self._attached_db, self._serversocket_udp, name=nice_addr,
-                        data=data, remoteaddr=addr, loglevel=self.loglevel)
+                        data=data, remoteaddr=addr, loglevel=self.loglevel,
+                        server=self)
         if self._serversocket:
             closeSocket(self._serversocket)
         self._serversocket = None
@@ -475,3 +551,362 @@ class CacheServer(Device):
         self.log.info('waiting for server')
         self._worker.join()
         self.log.info('server finished')
+
+
+class _LoopSendQueue(object):
+    """Replacement for the send queue of `EventLoopCacheWorker`.
+
+    Data put here is buffered and written out by the server's event loop;
+    `put()` may be called from any thread.
+    """
+
+    def __init__(self, worker):
+        self._worker = worker
+        self.chunks = deque()
+
+    def put(self, data):
+        self.chunks.append(data)
+        self._worker.server._mark_dirty(self._worker)
+
+
+class EventLoopCacheWorker(CacheWorker):
+    """Connection handler for the `EventLoopCacheServer`.
+
+    Unlike `CacheWorker`, this does not start any threads: the socket is
+    nonblocking and both reading and writing are driven by the event loop of
+    the server.
+    """
+
+    def __init__(self, db, sock, name, loglevel, server):
+        # received data that has not been processed yet
+        self.inbuf = b''
+        # encoded data that could not be written yet
+        self.outbuf = b''
+        # set while the worker is in the server's list of workers to flush
+        self.dirty = False
+        # set while a lazily computed reply (usually a history query) is
+        # being sent by a helper thread; no further lines are processed
+        # until it is finished, to keep the order of replies
+        self.busy = False
+        # time since when the socket did not accept all pending data
+        self.stalled_since = None
+        CacheWorker.__init__(self, db, sock, name, loglevel, server)
+        self.sock.setblocking(False)
+
+    def start_sender(self, name):
+        self.send_queue = _LoopSendQueue(self)
+
+    def start_receiver(self, name):
+        pass
+
+    def is_active(self):
+        return not self.stoprequest
+
+    def closedown(self):
+        # the socket is closed by the event loop, which also has to
+        # unregister it from the selector
+        if not self.stoprequest:
+            self.stoprequest = True
+            self.server._mark_dirty(self)
+
+    def join(self):
+        pass
+
+    def process_input(self):
+        """Handle all complete lines received so far."""
+        data = self.inbuf
+        i = 0
+        match = line_pattern.match(data)
+        while match and not self.busy and not self.stoprequest:
+            line = match.group(1)
+            i = match.end()
+            if not line:
+                self.log.info('got empty line, closing connection')
+                self.closedown()
+                break
+            try:
+                ret = self._handle_line(from_utf8(line))
+            except Exception as err:
+                self.log.warning('error handling line %r', line, exc=err)
+            else:
+                if isinstance(ret, GeneratorType):
+                    # lazily computed reply, e.g. history read from disk:
+                    # do not block the event loop with it
+                    self.busy = True
+                    self.server._defer(self, ret)
+                else:
+                    for item in ret or ():
+                        self.send_queue.put(item)
+            match = line_pattern.match(data, i)
+        self.inbuf = data[i:]
+
+
+class EventLoopCacheUDPWorker(CacheUDPWorker):
+    """UDP request handler that processes its data synchronously, in the
+    event loop of the `EventLoopCacheServer`.
+    """
+
+    def start_receiver(self, name):
+        self._receiver_thread()
+
+    def is_active(self):
+        return not self.stoprequest
+
+    def join(self):
+        pass
+
+
+class EventLoopCacheServer(CacheServer):
+    """Cache server that multiplexes all connections in a single thread.
+
+    While `CacheServer` starts two threads for every TCP connection and one
+    for every UDP request, this server handles all sockets in one event loop
+    (using the `selectors` module).  The line protocol is the same.
+
+    Lazily computed replies, which are history queries for most database
+    types, are sent from a small pool of helper threads so that reading
+    history from disk does not delay updates to other clients.
+
+    This server needs Python 3.
+    """
+
+    parameters = {
+        'helperthreads': Param('Number of threads that send history replies',
+                               type=intrange(1, 32), default=4),
+    }
+
+    def doInit(self, mode):
+        if selectors is None:
+            raise ConfigurationError(self, 'the event loop cache server '
+                                     'needs the selectors module (Python 3)')
+        CacheServer.doInit(self, mode)
+        self._selector = None
+        self._loop_thread = None
+        # workers with new data to send, or to close
+        self._dirty = []
+        self._dirty_lock = threading.Lock()
+        # workers that are waiting for the socket to become writable
+        self._blocked = set()
+        self._deferred = queue.Queue()
+        self._helpers = []
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self._wakeup_sent = False
+
+    def _wakeup(self):
+        if not self._wakeup_sent:
+            self._wakeup_sent = True
+            try:
+                self._wakeup_w.send(b'x')
+            except socket.error:
+                pass
+
+    def _mark_dirty(self, worker):
+        with self._dirty_lock:
+            if worker.dirty:
+                return
+            worker.dirty = True
+            self._dirty.append(worker)
+        if get_thread_id() != self._loop_thread:
+            self._wakeup()
+
+    def _defer(self, worker, results):
+        self._deferred.put((worker, results))
+
+    def _helper_thread(self):
+        while True:
+            item = self._deferred.get()
+            if item is None:
+                return
+            worker, results = item
+            try:
+                for reply in results:
+                    if worker.stoprequest:
+                        break
+                    worker.send_queue.put(reply)
+            except Exception:
+                worker.log.exception('error sending lazy reply')
+            worker.busy = False
+            # lines received in the meantime are processed by the loop
+            self._mark_dirty(worker)
+
+    def _add_worker(self, addr, worker):
+        # never change the dict in place: the databases iterate over it
+        # from other threads
+        connected = self._connected.copy()
+        connected[addr] = worker
+        self._connected = connected
+
+    def _close_worker(self, worker):
+        # stop helper threads still producing replies for this worker
+        worker.stoprequest = True
+        sock, worker.sock = worker.sock, None
+        if sock is None:
+            return
+        self._blocked.discard(worker)
+        try:
+            self._selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+        closeSocket(sock)
+        connected = self._connected.copy()
+        connected.pop(worker.name, None)
+        self._connected = connected
+        self._subscriptions.remove_client(worker)
+        self.log.info('client connection %s closed', worker.name)
+
+    def _accept(self):
+        try:
+            conn, addr = self._serversocket.accept()
+        except socket.error as err:
+            self.log.warning('error accepting connection', exc=err)
+            return
+        addr = 'tcp://%s:%d' % addr
+        self.log.info('new connection from %s', addr)
+        worker = EventLoopCacheWorker(self._attached_db, conn, name=addr,
+                                      loglevel=self.loglevel, server=self)
+        self._add_worker(addr, worker)
+        self._selector.register(conn, selectors.EVENT_READ, worker)
+
+    def _receive_udp(self):
+        try:
+            data, addr = self._serversocket_udp.recvfrom(3072)
+        except socket.error as err:
+            if err.args[0] not in (EAGAIN, EWOULDBLOCK):
+                self.log.warning('error receiving UDP data', exc=err)
+            return
+        nice_addr = 'udp://%s:%d' % addr
+        self.log.info('new connection from %s', nice_addr)
+        # the request is handled completely in the constructor
+        worker = EventLoopCacheUDPWorker(
+            self._attached_db, self._serversocket_udp, name=nice_addr,
+            data=data, remoteaddr=addr, loglevel=self.loglevel, server=self)
+        # the worker is never registered as connected, so remove its
+        # subscriptions here (the threaded server does it on cleanup)
+        if worker.updates_on or worker.ts_updates_on:
+            self._subscriptions.remove_client(worker)
+
+    def _read(self, worker):
+        try:
+            newdata = worker.sock.recv(BUFSIZE)
+        except socket.error as err:
+            if err.args[0] in (EAGAIN, EWOULDBLOCK):
+                return
+            newdata = b''
+        if not newdata:
+            self._close_worker(worker)
+            return
+        worker.inbuf += newdata
+        worker.process_input()
+
+    def _write(self, worker):
+        if worker.sock is None:
+            return
+        chunks = worker.send_queue.chunks
+        if chunks:
+            data = []
+            while chunks:
+                data.append(chunks.popleft())
+            worker.outbuf += to_utf8(''.join(data))
+        if not worker.outbuf:
+            return
+        try:
+            nsent = worker.sock.send(worker.outbuf)
+        except socket.error as err:
+            if err.args[0] not in (EAGAIN, EWOULDBLOCK):
+                worker.log.warning('other end closed, shutting down', exc=err)
+                self._close_worker(worker)
+                return
+            nsent = 0
+        worker.outbuf = worker.outbuf[nsent:]
+        if worker.outbuf:
+            if worker not in self._blocked:
+                worker.stalled_since = currenttime()
+                self._blocked.add(worker)
+                self._selector.modify(worker.sock, selectors.EVENT_READ |
+                                      selectors.EVENT_WRITE, worker)
+        elif worker in self._blocked:
+            worker.stalled_since = None
+            self._blocked.discard(worker)
+            self._selector.modify(worker.sock, selectors.EVENT_READ, worker)
+
+    def _flush(self):
+        while self._dirty:
+            with self._dirty_lock:
+                dirty, self._dirty = self._dirty, []
+                for worker in dirty:
+                    worker.dirty = False
+            for worker in dirty:
+                if worker.stoprequest:
+                    self._close_worker(worker)
+                    continue
+                if not worker.busy and worker.inbuf:
+                    # resume processing after a lazy reply is finished
+                    worker.process_input()
+                self._write(worker)
+        # the same timeout as for sending in the threaded server
+        if self._blocked:
+            timeout = currenttime() - 5
+            for worker in list(self._blocked):
+                if worker.stalled_since < timeout:
+                    worker.log.warning('send timed out, shutting down')
+                    self._close_worker(worker)
+
+    def _server_thread(self):
+        self.log.info('server starting')
+        if not self._bind_sockets():
+            return
+        self._loop_thread = get_thread_id()
+        self._helpers = [createThread('helper %d' % i, self._helper_thread)
+                         for i in range(self.helperthreads)]
+
+        self._selector = selector = selectors.DefaultSelector()
+        selector.register(self._wakeup_r, selectors.EVENT_READ)
+        if self._serversocket:
+            selector.register(self._serversocket, selectors.EVENT_READ)
+        if self._serversocket_udp:
+            selector.register(self._serversocket_udp, selectors.EVENT_READ)
+
+        while not self._stoprequest:
+            for key, mask in selector.select(CYCLETIME * 3):
+                worker = key.data
+                if worker is not None:
+                    if worker.sock is None:
+                        continue  # closed during this iteration
+                    if mask & selectors.EVENT_READ:
+                        self._read(worker)
+                    if mask & selectors.EVENT_WRITE and worker.sock:
+                        self._write(worker)
+                elif key.fileobj is self._serversocket:
+                    self._accept()
+                elif key.fileobj is self._serversocket_udp:
+                    self._receive_udp()
+                else:
+                    try:
+                        self._wakeup_r.recv(4096)
+                    except socket.error:
+                        pass
+                    self._wakeup_sent = False
+            self._flush()
+
+        for worker in listvalues(self._connected):
+            self.log.info('closing client %s', worker)
+            worker.stoprequest = True
+            self._close_worker(worker)
+        for _ in self._helpers:
+            self._deferred.put(None)
+        for helper in self._helpers:
+            helper.join()
+        selector.close()
+        if self._serversocket:
+            closeSocket(self._serversocket)
+        self._serversocket = None
+
+    def quit(self, signum=None):
+        self.log.info('quitting on signal %s...', signum)
+        self._stoprequest = True
+        self._wakeup()
+        self.log.info('waiting for server')
+        self._worker.join()
+        self.log.info('server finished')
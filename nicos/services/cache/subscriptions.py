@@ -0,0 +1,150 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2020 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+
+"""Index of the update subscriptions of all clients of the cache server."""
+
+from __future__ import absolute_import, division, print_function
+
+import threading
+from collections import deque
+
+from nicos.pycompat import iteritems
+
+
+class SubscriptionIndex(object):
+    """Finds the clients interested in an updated key.
+
+    Subscriptions are substring matches: a client subscribed to ``slit/``
+    gets updates for ``nicos/slit/width``.  Instead of testing every
+    subscription of every client, all subscribed strings are compiled into an
+    Aho-Corasick automaton, which finds all of them in a single pass over the
+    key.  Since the same keys are updated over and over, the result for each
+    key is also remembered until the subscriptions change.
+
+    Like `CacheWorker.update`, a client gets at most one update per key, with
+    timestamp if any of its matching subscriptions requested timestamps.
+    """
+
+    # maximum number of remembered lookup results
+    max_memo = 100000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # map subscribed string -> (clients with timestamp, clients without)
+        self._subs = {}
+        # the automaton, created on demand
+        self._automaton = None
+        # map key -> tuple of (client, with timestamp)
+        self._memo = {}
+
+    def add(self, client, key, ts):
+        with self._lock:
+            if key not in self._subs:
+                self._subs[key] = (set(), set())
+                self._automaton = None
+            self._subs[key][not ts].add(client)
+            self._memo = {}
+
+    def discard(self, client, key, ts):
+        with self._lock:
+            if key not in self._subs:
+                return
+            clients = self._subs[key]
+            clients[not ts].discard(client)
+            if not clients[0] and not clients[1]:
+                del self._subs[key]
+                self._automaton = None
+            self._memo = {}
+
+    def remove_client(self, client):
+        with self._lock:
+            for key, clients in list(iteritems(self._subs)):
+                clients[0].discard(client)
+                clients[1].discard(client)
+                if not clients[0] and not clients[1]:
+                    del self._subs[key]
+                    self._automaton = None
+            self._memo = {}
+
+    def lookup(self, key):
+        """Return a sequence of ``(client, with_timestamp)`` for all clients
+        subscribed to *key*.
+        """
+        result = self._memo.get(key)
+        if result is None:
+            with self._lock:
+                result = self._lookup(key)
+                if len(self._memo) >= self.max_memo:
+                    self._memo = {}
+                self._memo[key] = result
+        return result
+
+    def _lookup(self, key):
+        if self._automaton is None:
+            self._automaton = self._build()
+        goto, fail, output = self._automaton
+        found = set(output[0])
+        node = 0
+        for char in key:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                found.update(output[node])
+        with_ts = set()
+        without_ts = set()
+        for sub in found:
+            clients = self._subs[sub]
+            with_ts.update(clients[0])
+            without_ts.update(clients[1])
+        without_ts -= with_ts
+        return tuple([(client, True) for client in with_ts] +
+                     [(client, False) for client in without_ts])
+
+    def _build(self):
+        # trie of all subscribed strings: one dict of transitions per node
+        goto = [{}]
+        output = [[]]
+        for sub in self._subs:
+            node = 0
+            for char in sub:
+                nextnode = goto[node].get(char)
+                if nextnode is None:
+                    nextnode = goto[node][char] = len(goto)
+                    goto.append({})
+                    output.append([])
+                node = nextnode
+            output[node].append(sub)
+        # failure links, computed breadth-first; each node also outputs the
+        # strings of the node its failure link points to
+        fail = [0] * len(goto)
+        todo = deque(goto[0].values())
+        while todo:
+            node = todo.popleft()
+            for char, child in iteritems(goto[node]):
+                todo.append(child)
+                target = fail[node]
+                while target and char not in goto[target]:
+                    target = fail[target]
+                target = goto[target].get(char, 0)
+                fail[child] = target if target != child else 0
+                output[child] = output[child] + output[fail[child]]
+        return goto, fail, output
@@ -33,6 +33,9 @@ import base64
 import os
 import socket
 import tempfile
+import threading
+from collections import OrderedDict
+from time import time as currenttime
 
 import rsa
 
@@ -42,7 +45,10 @@ from nicos.core.data import ScanData
 from nicos.protocols.daemon import BREAK_NOW, DAEMON_COMMANDS, SIM_STATES, \
     STATUS_IDLE, STATUS_IDLEEXC, STATUS_INBREAK, STATUS_RUNNING, \
     STATUS_STOPPING, CloseConnection
-from nicos.pycompat import queue, string_types
+from nicos.protocols.daemon.livedata import LIVE_ENCODINGS, LiveFrame, \
+    LiveFrameEncoder
+from nicos.pycompat import itervalues, queue, string_types
+from nicos.services.cache.subscriptions import SubscriptionIndex
 from nicos.services.daemon.auth import AuthenticationError
 from nicos.services.daemon.script import RequestError, ScriptError, \
     ScriptRequest
@@ -95,6 +101,15 @@ def command(needcontrol=False, needscript=None, name=None):
 # unique objects
 stop_queue = (object(), '')
 no_msg = object()
+# put into the event queue when conflated events are pending
+conflated_marker = object()
+
+# events whose data can be conflated, mapped to the name used to select them
+CONFLATABLE_EVENTS = {
+    'liveparams': 'livedata',
+    'livedata': 'livedata',
+    'cache': 'cache',
+}
 
 
 class ConnectionHandler(object):
@@ -117,6 +132,23 @@ class ConnectionHandler(object):
         # limit memory usage to 100 Megs
         self.event_queue = SizedQueue(100*1024*1024)
         self.event_mask = set()
+        # encoder for live data frames, if the client selected encodings
+        self.live_encoder = None
+        # events of which only the latest data is sent, see eventconflate
+        self.conflated = set()
+        self.conflate_lock = threading.Lock()
+        self.pending_live = []
+        self.pending_cache = OrderedDict()
+        self.live_interval = 0
+        self.live_last = 0
+        # window for collecting cache events into batches, see eventbatch
+        self.cache_window = 0
+        # map kind of conflated events -> time when they are due
+        self.due = {}
+        self.dropped = {'livedata': 0, 'cache': 0}
+        # cache keys the client subscribed to (None: all keys)
+        self.cache_keys = None
+        self.cache_subscriptions = SubscriptionIndex()
         self.log = LoggerWrapper(self.daemon.log, '[new handler] ')
 
     def setIdent(self, ident):
@@ -235,6 +267,99 @@ class ConnectionHandler(object):
             command, data = self.recv_command()
             command_wrappers[command](self, data)
 
+    # -- Event queueing -------------------------------------------------------
+
+    def queue_event(self, event, data, rawdata):
+        """Queue an event for sending to the client.
+
+        *data* is the event data to send, *rawdata* the data before
+        serialization.  Raises `queue.Full` if the client does not keep up.
+
+        Cache events are only queued if the client subscribed to the key
+        with `cachesubscribe`, or did not subscribe to any keys.
+
+        For events selected with `eventconflate`, only the latest data is
+        kept until the event sender gets to send it: a new set of live data
+        replaces the one not sent yet, and a new cache value replaces the
+        value of the same key.  The same is done for cache events if the
+        client selected batches with `eventbatch`.
+        """
+        if event == 'cache' and self.cache_keys is not None and \
+           not self.cache_subscriptions.lookup(rawdata[1]):
+            # the client is not interested in this key
+            return
+        kind = CONFLATABLE_EVENTS.get(event)
+        if kind not in self.conflated and \
+           not (kind == 'cache' and self.cache_window):
+            self.event_queue.put((event, data), True, 0.1)
+            return
+        with self.conflate_lock:
+            if kind == 'cache':
+                wakeup = not self.pending_cache
+                key = rawdata[1]
+                if key in self.pending_cache:
+                    del self.pending_cache[key]
+                    self.dropped['cache'] += 1
+                self.pending_cache[key] = (data, rawdata)
+            else:
+                wakeup = not self.pending_live
+                if event == 'liveparams':
+                    # the frames not sent yet are superseded
+                    self.dropped['livedata'] += sum(
+                        1 for (evt, _) in self.pending_live
+                        if evt == 'livedata')
+                    del self.pending_live[:]
+                self.pending_live.append((event, data))
+            # if the data is due later, the event sender wakes up by itself
+            wakeup = wakeup and kind not in self.due
+        if wakeup:
+            self.event_queue.put((conflated_marker, kind), True, 0.1)
+
+    def _take_conflated(self, kind, now):
+        """Return the pending events of the given kind, if they are due."""
+        with self.conflate_lock:
+            due = self.due.pop(kind, None)
+            if kind == 'cache':
+                if not self.pending_cache:
+                    return []
+                if not self.cache_window:
+                    items = [('cache', data) for (data, _) in
+                             itervalues(self.pending_cache)]
+                elif due is None or now < due:
+                    # collect cache events until the batch is due
+                    self.due[kind] = due or now + self.cache_window
+                    return []
+                else:
+                    items = [('cachebatch', self.serializer.serialize_event(
+                        'cachebatch', [rawdata for (_, rawdata) in
+                                       itervalues(self.pending_cache)]))]
+                self.pending_cache.clear()
+                return items
+            if not self.pending_live:
+                return []
+            if self.live_interval:
+                if now < self.live_last + self.live_interval:
+                    # rate limit: wait until the next live data can be sent
+                    self.due[kind] = self.live_last + self.live_interval
+                    return []
+                self.live_last = now
+            items = self.pending_live
+            self.pending_live = []
+            return items
+
+    def event_stats(self):
+        """Return statistics about the events queued for this client."""
+        return dict(
+            ident = self.ident,
+            user = getattr(self, 'user', None) and self.user.name,
+            host = self.clientnames[0],
+            queued = self.event_queue.nbytes,
+            conflated = sorted(self.conflated),
+            batchwindow = self.cache_window,
+            dropped = dict(self.dropped),
+            cachekeys = self.cache_keys and sorted(self.cache_keys),
+        )
+
     # -- Event thread entry point ---------------------------------------------
 
     def event_sender(self):
@@ -245,26 +370,52 @@ class ConnectionHandler(object):
         queue_get = self.event_queue.get
         event_mask = self.event_mask
         while 1:
-            item = queue_get()
+            # wake up when conflated events are due
+            with self.conflate_lock:
+                due = min(itervalues(self.due)) if self.due else None
+            try:
+                item = queue_get(True, due and max(due - currenttime(), 0))
+            except queue.Empty:
+                item = None
             if item is stop_queue:
                 break
-            event, data = item
-            if event in event_mask:
+            now = currenttime()
+            if item is None:
+                items = []
+                for kind in list(self.due):
+                    items.extend(self._take_conflated(kind, now))
+            elif item[0] is conflated_marker:
+                items = self._take_conflated(item[1], now)
+            else:
+                items = [item]
+            if not self._send_events(items, event_mask):
+                break
+        if any(self.dropped.values()):
+            self.log.info('dropped events not sent in time: %s', self.dropped)
+        self.log.info('closing connections from event sender')
+        self.close()
+
+    def _send_events(self, items, event_mask):
+        for event, data in items:
+            if event in event_mask or \
+               event == 'cachebatch' and 'cache' in event_mask:
                 continue
+            if isinstance(data, LiveFrame):
+                data = self.live_encoder.encode(data) \
+                    if self.live_encoder else data.raw
             try:
                 self.send_event(event, data)
             except socket.timeout:
                 # XXX move socket specific error handling to transport
                 self.log.error('send timeout in event sender')
-                break
+                return False
             except socket.error as err:
                 self.log.warning('connection broken in event sender: %s', err)
-                break
+                return False
             except Exception as err:
                 self.log.exception('exception in event sender; event: %s, '
                                    'data: %s', event, repr(data)[:1000])
-        self.log.info('closing connections from event sender')
-        self.close()
+        return True
 
     # -- Script control commands ----------------------------------------------
 
@@ -588,19 +739,79 @@ class ConnectionHandler(object):
         self.send_ok_reply(current_script and current_script.text or '')
 
     @command()
-    def gethistory(self, key, fromtime, totime):
+    def gethistory(self, key, fromtime, totime, maxpoints=None,
+                   chunksize=None):
         """Return history of a cache key, if available.
 
         :param key: cache key (without prefix) to query history
         :param fromtime: start time as Unix timestamp
         :param totime: end time as Unix timestamp
+        :param maxpoints: optional maximum number of returned values, the
+           history is then reduced by the cache
+        :param chunksize: if given, the history is sent as several replies
+           with at most this many values, while it is received from the
+           cache; an empty list marks the end
         :returns: list of (time, value) tuples
         """
+        chunksize = chunksize and int(chunksize)
         if not session.cache:
             self.send_ok_reply([])
-        history = session.cache.history('', key, float(fromtime),
-                                        float(totime))
-        self.send_ok_reply(history)
+            return
+        history = session.cache.history_iter('', key, float(fromtime),
+                                             float(totime),
+                                             maxpoints and int(maxpoints))
+        if not chunksize:
+            self.send_ok_reply(list(history))
+            return
+        chunk = []
+        for item in history:
+            chunk.append(item)
+            if len(chunk) >= chunksize:
+                self.send_ok_reply(chunk)
+                chunk = []
+        if chunk:
+            self.send_ok_reply(chunk)
+        self.send_ok_reply([])
+
+    @command()
+    def cachesubscribe(self, keys):
+        """Send "cache" events only for certain keys to the client.
+
+        Like subscriptions to the cache, keys match if they contain one of
+        the subscribed strings, e.g. ``slit/`` matches all keys of the
+        device "slit".  Before the first subscription, events for all keys
+        are sent.
+
+        :param keys: a serialized list of strings to subscribe to
+        :returns: ack
+        """
+        if self.cache_keys is None:
+            self.cache_keys = set()
+        for key in keys:
+            key = key.lower()
+            if key not in self.cache_keys:
+                self.cache_keys.add(key)
+                self.cache_subscriptions.add(self, key, False)
+        self.send_ok_reply(None)
+
+    @command()
+    def cacheunsubscribe(self, keys):
+        """Remove subscriptions made with `cachesubscribe`.
+
+        :param keys: a serialized list of strings to unsubscribe, or an
+           empty list to get events for all keys again
+        :returns: ack
+        """
+        if not keys:
+            self.cache_keys = None
+            self.cache_subscriptions.remove_client(self)
+        elif self.cache_keys is not None:
+            for key in keys:
+                key = key.lower()
+                if key in self.cache_keys:
+                    self.cache_keys.discard(key)
+                    self.cache_subscriptions.discard(self, key, False)
+        self.send_ok_reply(None)
 
     @command()
     def getcachekeys(self, query):
@@ -701,6 +912,39 @@ class ConnectionHandler(object):
             except (IndexError, AttributeError, ConfigurationError):
                 self.send_ok_reply(None)
 
+    @command()
+    def syncdatasets(self, known):
+        """Get the datasets that are new or have new points, compared to the
+        datasets the client already has.
+
+        :param known: dictionary mapping the uids of the datasets the client
+           has to their number of points
+        :returns: a list with one entry for every dataset, in the order
+           returned by ``getdataset('*')``: a ScanData for datasets unknown to
+           the client, or a tuple ``(uid, npoints, xresults, yresults)`` with
+           the points after the first *npoints* for the others
+        """
+        try:
+            datasets = session.experiment.data.getLastScans()
+        # session.experiment may be None or a stub
+        except (AttributeError, ConfigurationError):
+            self.send_ok_reply([])
+            return
+        result = []
+        for dataset in datasets:
+            uid = str(dataset.uid)
+            points = [subset for subset in dataset.subsets if subset.finished]
+            npoints = known.get(uid)
+            if npoints is None or npoints > len(points):
+                result.append(ScanData(dataset))
+                continue
+            points = points[npoints:]
+            result.append((uid, npoints,
+                           [subset.devvaluelist + subset.envvaluelist
+                            for subset in points],
+                           [subset.detvaluelist for subset in points]))
+        self.send_ok_reply(result)
+
     # -- Miscellaneous commands -----------------------------------------------
 
     @command(needcontrol=True)
@@ -758,6 +1002,75 @@ class ConnectionHandler(object):
         self.event_mask.difference_update(events)
         self.send_ok_reply(None)
 
+    @command()
+    def eventconflate(self, events, maxrate=None):
+        """Send only the latest data of certain events to the client.
+
+        Clients that cannot keep up then skip outdated data, instead of
+        building up a backlog (and finally being disconnected).
+
+        :param events: a serialized list of the events to conflate: "livedata"
+           (for the "liveparams" and "livedata" events) and/or "cache"
+        :param maxrate: if given, the maximum number of sets of live data to
+           send per second
+        :returns: list of the events that are conflated
+        """
+        events = [evt for evt in events if evt in ('livedata', 'cache')]
+        with self.conflate_lock:
+            self.conflated = set(events)
+            self.live_interval = 1.0 / maxrate if maxrate else 0
+        self.send_ok_reply(events)
+
+    @command()
+    def eventbatch(self, window):
+        """Send cache events in batches, with the "cachebatch" event.
+
+        Cache events are collected for the given time, and then sent as
+        a single event.  Like with `eventconflate`, only the latest value of
+        each key is sent.
+
+        :param window: time in seconds to collect cache events, or 0 to send
+           single events again
+        :returns: ack
+        """
+        with self.conflate_lock:
+            self.cache_window = float(window)
+            if not self.cache_window:
+                self.due.pop('cache', None)
+        # flush the events collected so far
+        self.event_queue.put((conflated_marker, 'cache'), True, 0.1)
+        self.send_ok_reply(None)
+
+    @command()
+    def geteventstats(self):
+        """Return statistics about the event delivery to the clients.
+
+        Only admins get the statistics of all clients, other users only get
+        those of their own connection.
+
+        :returns: list of dicts with the handler ident, user and host of
+           the client, the number of bytes in the event queue, the conflated
+           events and the number of dropped events per conflated event
+        """
+        if self.user.level == ADMIN:
+            handlers = sorted(self.daemon._server.handlers.values(),
+                              key=lambda handler: handler.ident)
+        else:
+            handlers = [self]
+        self.send_ok_reply([handler.event_stats() for handler in handlers])
+
+    @command()
+    def liveencoding(self, encodings):
+        """Select the encodings used for frames of the "livedata" event.
+
+        :param encodings: a serialized list of encoding names, see
+           `nicos.protocols.daemon.livedata`
+        :returns: list of the selected encodings that are supported
+        """
+        encodings = [enc for enc in encodings if enc in LIVE_ENCODINGS]
+        self.live_encoder = LiveFrameEncoder(encodings) if encodings else None
+        self.send_ok_reply(encodings)
+
     @command()
     def transfer(self, content):
         """Transfer a file to the server, encoded in base64.
@@ -35,7 +35,7 @@ from nicos.protocols.daemon import DAEMON_EVENTS, CloseConnection, \
     ProtocolError, Server as BaseServer, \
     ServerTransport as BaseServerTransport
 from nicos.protocols.daemon.classic import ACK, ENQ, LENGTH, NAK, \
-    PROTO_VERSION, READ_BUFSIZE, STX, code2command, event2code
+    PROTO_VERSION, READ_BUFSIZE, STX, BufferList, code2command, event2code
 from nicos.pycompat import get_thread_id, queue, socketserver
 from nicos.services.daemon.handler import ConnectionHandler
 from nicos.utils import closeSocket, createThread
@@ -65,11 +65,12 @@ class Server(BaseServer, socketserver.TCPServer):
         self.server_close()
 
     def emit(self, event, data, handler=None):
+        rawdata = data
         if DAEMON_EVENTS[event][0]:
             data = self.serializer.serialize_event(event, data)
         for hdlr in (handler,) if handler else self.handlers.values():
             try:
-                hdlr.event_queue.put((event, data), True, 0.1)
+                hdlr.queue_event(event, data, rawdata)
             except queue.Full:
                 # close event socket to let the connection get
                 # closed by the handler
@@ -256,7 +257,12 @@ class ServerTransport(ConnectionHandler, BaseServerTransport,
                     data = self.serializer.serialize_ok_reply(payload)
                 except Exception as err:
                     raise ProtocolError('send_ok_reply: could not serialize')
-                self.sock.sendall(STX + LENGTH.pack(len(data)) + data)
+                if isinstance(data, BufferList):
+                    self.sock.sendall(STX + LENGTH.pack(len(data)))
+                    for chunk in data.chunks:
+                        self.sock.sendall(chunk)
+                else:
+                    self.sock.sendall(STX + LENGTH.pack(len(data)) + data)
         except socket.error as err:
             raise ProtocolError('send_ok_reply: connection broken (%s)' % err)
 
@@ -275,4 +281,8 @@ class ServerTransport(ConnectionHandler, BaseServerTransport,
         self.event_sock.sendall(STX + event2code[evtname] +
                                 LENGTH.pack(len(payload)))
         # send data separately to avoid copying lots of data
-        self.event_sock.sendall(payload)
+        if isinstance(payload, BufferList):
+            for chunk in payload.chunks:
+                self.event_sock.sendall(chunk)
+        else:
+            self.event_sock.sendall(payload)
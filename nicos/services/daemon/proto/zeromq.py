@@ -34,6 +34,8 @@ import zmq
 from nicos.protocols.daemon import DAEMON_EVENTS, CloseConnection, \
     ProtocolError, Server as BaseServer, \
     ServerTransport as BaseServerTransport
+from nicos.protocols.daemon.classic import BufferList
+from nicos.protocols.daemon.livedata import LiveFrame
 from nicos.pycompat import from_utf8, queue, to_utf8
 from nicos.services.daemon.handler import ConnectionHandler
 from nicos.utils import createThread
@@ -120,6 +122,11 @@ class Server(BaseServer):
     def emit(self, event, data, handler=None):
         if DAEMON_EVENTS[event][0]:
             data = self.serializer.serialize_event(event, data)
+            if isinstance(data, BufferList):
+                data = data.tobytes()
+        elif isinstance(data, LiveFrame):
+            # no encodings are negotiated with this protocol
+            data = data.raw
         self.event_queue.put([handler.client_id if handler else b'ALL',
                               to_utf8(event), data])
 
@@ -180,9 +187,11 @@ class ServerTransport(ConnectionHandler, BaseServerTransport):
         return self.serializer.deserialize_cmd(item[4], from_utf8(item[2]))
 
     def send_ok_reply(self, payload):
+        data = self.serializer.serialize_ok_reply(payload)
+        if isinstance(data, BufferList):
+            data = data.tobytes()
         self.reply_sender.send_multipart(
-            [self.client_id, b'', b'ok', b'',
-             self.serializer.serialize_ok_reply(payload)])
+            [self.client_id, b'', b'ok', b'', data])
 
     def send_error_reply(self, reason):
         self.reply_sender.send_multipart(
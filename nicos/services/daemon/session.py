@@ -34,6 +34,7 @@ from nicos.core.sessions.simple import NoninteractiveSession
 from nicos.core.sessions.utils import LoggingStdout
 from nicos.devices.cacheclient import DaemonCacheClient
 from nicos.protocols.daemon import BREAK_AFTER_STEP
+from nicos.protocols.daemon.livedata import LiveFrame
 from nicos.pycompat import builtins, exec_, string_types
 from nicos.services.daemon.htmlhelp import HelpGenerator
 from nicos.services.daemon.pyctl import ControlStop
@@ -84,6 +85,8 @@ class DaemonSession(NoninteractiveSession):
         # add an object to be used by DaemonSink objects
         self.emitfunc = daemondev.emit_event
         self.emitfunc_private = daemondev.emit_event_private
+        # last live data frame per detector and array index
+        self._last_live_frames = {}
 
         # call stop() upon emergency stop
         from nicos.commands.device import stop
@@ -116,8 +119,13 @@ class DaemonSession(NoninteractiveSession):
                        time, data):
         self.emitfunc('liveparams', (tag, uid, detector, filename, dtype,
                                      nx, ny, nt, time))
-        for buf in data:  # data is a list of ``memory_buffer``
-            self.emitfunc('livedata', buf)
+        for i, buf in enumerate(data):  # data is a list of ``memory_buffer``
+            stream = (detector, i)
+            frame = LiveFrame(stream, dtype, buf,
+                              self._last_live_frames.get(stream))
+            # the previous frame is the base for delta encoding
+            self._last_live_frames[stream] = frame
+            self.emitfunc('livedata', frame)
 
     def notifyDataFile(self, tag, uid, detector, filename_or_filenames):
         if isinstance(filename_or_filenames, string_types):
@@ -37,9 +37,14 @@ from time import sleep, time as currenttime
 
 from nicos import config, session
 from nicos.core import ConfigurationError, Device, DeviceAlias, Param, \
-    Readable, listof, status
+    Readable, intrange, listof, status
 from nicos.devices.generic.cache import CacheReader
-from nicos.pycompat import iteritems, itervalues, listitems, queue as Queue
+from nicos.protocols.cache import FLAG_NO_STORE
+from nicos.pycompat import iteritems, itervalues, listitems, queue as Queue, \
+    reraise
+from nicos.services.poller.scheduler import PollScheduler
+from nicos.services.poller.stats import STATS_INTERVAL, STATS_PREFIX, \
+    PollStats, format_stats
 from nicos.utils import createSubprocess, createThread, loggers, \
     watchFileContent, whyExited
 from nicos.utils.files import findSetup
@@ -49,6 +54,74 @@ POLL_BUSY_INTERVAL = 0.5    # if dev is busy, poll this often
 POLL_MIN_WAIT = 0.1         # minimum amount of time between two calls to poll()
 
 
+class PollGroup(object):
+    """The devices of a poll group, which are polled together by one poll
+    loop of the poller.
+
+    The poll loop uses the shortest poll interval and maximum age of the
+    devices.  When polled, the data of all devices is read with one request
+    to the hardware if the device class supports it (see
+    `Readable.prefetchGroup`).
+    """
+
+    def __init__(self, name, devices, log):
+        self.name = name
+        self.devices = devices
+        self.log = log
+        self._failed = set()
+
+    def __str__(self):
+        return 'group %s' % self.name
+
+    @property
+    def pollinterval(self):
+        intervals = [dev.pollinterval for dev in self.devices
+                     if dev.pollinterval is not None]
+        return min(intervals) if intervals else None
+
+    @property
+    def maxage(self):
+        maxages = [dev.maxage for dev in self.devices if dev.maxage]
+        return min(maxages) if maxages else 0
+
+    def poll(self, n=0, maxage=0):
+        """Poll all devices; return BUSY status if one of them is busy,
+        and the list of values.
+        """
+        devices = [dev for dev in self.devices if dev.pollinterval is not None]
+        stcode = status.OK
+        values = []
+        errors = []
+        with devices[0].prefetchGroup(devices):
+            for dev in devices:
+                try:
+                    stval, rdval = dev.poll(n, maxage=maxage)
+                except Exception:
+                    errors.append(sys.exc_info())
+                    values.append(None)
+                    # warn only once until the device can be polled again
+                    if dev not in self._failed:
+                        self._failed.add(dev)
+                        self.log.warning('%-10s: error polling', dev, exc=True)
+                    continue
+                if dev in self._failed:
+                    self._failed.discard(dev)
+                    self.log.info('%-10s: polled successfully', dev)
+                if stval is not None and stval[0] == status.BUSY:
+                    stcode = status.BUSY
+                values.append(rdval)
+        if len(errors) == len(devices):
+            # all devices failed, let the poller retry later
+            reraise(*errors[-1])
+        return (stcode, ''), values
+
+    def _pollParam(self, name):
+        devname, param = name.split('/', 1)
+        for dev in self.devices:
+            if dev.name.lower() == devname:
+                dev._pollParam(param)
+
+
 class Poller(Device):
 
     parameters = {
@@ -63,170 +136,285 @@ class Poller(Device):
                             'master setup', type=listof(str)),
         'blacklist':  Param('Devices that should never be polled',
                             type=listof(str)),
+        'scheduler':  Param('Poll the devices of each setup with a scheduler '
+                            'and a pool of worker threads, instead of one '
+                            'thread per device', type=bool, default=False),
+        'workers':    Param('Number of worker threads per setup if the '
+                            'scheduler is used', type=intrange(1, 100),
+                            default=4),
     }
 
     def doInit(self, mode):
         self._stoprequest = False
         self._workers = {}
+        self._scheduler = None
         self._creation_lock = threading.Lock()
+        # poll groups by the name of their first device, and the first device
+        # of the group for all devices in groups
+        self._pollgroups = {}
+        self._leaders = {}
+        # poll statistics by device name
+        self._stats = {}
+        self._stats_stop = threading.Event()
 
     def doUpdateLoglevel(self, value):
         # override this since the base Device does not set a new loglevel in
         # a poller session
         self.log.setLevel(loggers.loglevels[value])
 
-    def _worker_thread(self, devname, queue):
+    def _register_callbacks(self, dev, notify):
+        """Register cache callbacks that *notify* the poll loop of *dev* with
+        events.
+        """
 
         def reconfigure_dev_target(key, value, time, oldvalues={}):  # pylint: disable=W0102
             if value is not None:
-                queue.put('dev_target', False)
+                notify('dev_target')
                 oldvalues[key] = value
 
         def reconfigure_dev_status(key, value, time, oldvalues={}):  # pylint: disable=W0102
             if value[0] != oldvalues.get(key):
                 if value[0] == status.BUSY:  # just went busy, wasn't before!
-                    queue.put('dev_busy', False)
+                    notify('dev_busy')
                 else:
-                    queue.put('dev_normal', False)
+                    notify('dev_normal')
                 oldvalues[key] = value[0]  # only store status code!
 
         def reconfigure_adev_value(key, value, time, oldvalues={}):  # pylint: disable=W0102
             if value != oldvalues.get(key):
-                queue.put('adev_value', False)
+                notify('adev_value')
                 oldvalues[key] = value
 
         def reconfigure_adev_target(key, value, time, oldvalues={}):  # pylint: disable=W0102
             if value != oldvalues.get(key):
-                queue.put('adev_target', False)
+                notify('adev_target')
                 oldvalues[key] = value
 
         def reconfigure_adev_status(key, value, time, oldvalues={}):  # pylint: disable=W0102
             if value[0] != oldvalues.get(key):
                 if value[0] == status.BUSY:  # just went busy, wasn't before!
-                    queue.put('adev_busy', False)
+                    notify('adev_busy')
                 else:
-                    queue.put('adev_normal', False)
+                    notify('adev_normal')
                 oldvalues[key] = value[0]  # only store status code!
 
         def reconfigure_param(key, value, time):
-            queue.put('param', False)
-
-        def poll_loop(dev):
-            """
-            Polling a device and react to updates received via cache
-
-            The wait between pollings is controlled by an Queue, so that
-            events from other threads (e.g. quit or cache updates) can
-            trigger a wakeup.
-
-            Based on the events received, the polling interval is adjusted.
-
-            Read errors in the device raise and this gets restarted from the
-            outer loop. If the received event is 'quit' we just exit here.
-            """
-            # get the initial values
-            interval = dev.pollinterval
-            maxage = interval - POLL_MIN_VALID_TIME if interval else (
-                dev.maxage or 0)
-
-            i = 0
-            lastpoll = 0  # last timestamp of successful poll
-
-            while not self._stoprequest:
-                # determine maximum waiting time with a default of 1h
-                ct = currenttime()
-                nextpoll = lastpoll + (interval or 3600)
-                # note: dev.maxage is intended here!
-                timesout = lastpoll + (dev.maxage - POLL_MIN_VALID_TIME
-                                       if dev.maxage else POLL_MIN_VALID_TIME)
-                dnext = nextpoll - ct
-                dto = timesout - ct
-                maxwait = min(dnext, dto)
-                self.log.debug('%-10s: maxwait is %g (nextpoll=%g, timesout=%g)',
-                               dev, maxwait, dnext, dto)
-
-                # only wait for events if there is time, otherwise just poll
-                if maxwait > 0:
-                    # wait for event
-                    try:
-                        # if the timeout is reached, this raises Queue.Empty
-                        event = queue.get(True, maxwait)
-                        self.log.debug('%-10s: event %s', dev, event)
-
-                        # handle events....
-                        # use pass to trigger a poll or continue to just fetch the next event
-                        if event == 'adev_busy':  # one of our attached_devices went busy
-                            interval = POLL_BUSY_INTERVAL
-                            maxage = interval / 2.
-                            # also poll
-                        elif event == 'adev_normal':  # one of our attached_devices is no more busy
-                            pass  # also poll
-                        elif event == 'adev_target':  # one of our attached_devices got new target
-                            interval = POLL_BUSY_INTERVAL
-                            maxage = interval / 2.
-                            continue
-                        elif event == 'adev_value':  # one of our attached_devices changed value
-                            interval = POLL_BUSY_INTERVAL
-                            maxage = interval / 2.
-                            continue
-                        elif event == 'dev_busy':  # our device went busy
-                            interval = POLL_BUSY_INTERVAL
-                            maxage = interval / 2.
-                            continue
-                        elif event == 'dev_normal':  # our device is no more busy
-                            continue
-                        elif event == 'dev_target':  # our device got new target
-                            interval = POLL_BUSY_INTERVAL
-                            maxage = interval / 2.
-                            continue
-                        elif event == 'dev_value':  # our device changed value
-                            continue
-                        elif event == 'param':  # update local vars
-                            interval = dev.pollinterval
-                            maxage = interval - POLL_MIN_VALID_TIME \
-                                if interval else (dev.maxage or 0)
-                            continue
-                        elif event == 'quit':  # stop doing anything
-                            return
-                        elif event.startswith('pollparam:'):
-                            try:
-                                dev._pollParam(event[10:])
-                            except Exception:
-                                dev.log.warning('error polling parameter %s',
-                                                event[10:], exc=True)
+            notify('param')
 
-                    except Queue.Empty:
-                        pass  # just poll if timed out
-                else:
-                    self.log.debug('%-10s: ignoring events for one round', dev)
+        if isinstance(dev, PollGroup):
+            for member in dev.devices:
+                self._register_callbacks(member, notify)
+            return
 
-                # also do rate-limiting if too many events occur which would
-                # retrigger this device
-                if lastpoll + POLL_MIN_WAIT > currenttime():
-                    self.log.debug('%-10s: rate-limiting poll()', dev)
-                    continue
+        self.log.debug('%-10s: registering callbacks', dev)
+        # keep track of some parameters via cache callback
+        # session.cache.addCallback(dev, 'value', reconfigure_dev_value)  # spams events
+        session.cache.addCallback(dev, 'target', reconfigure_dev_target)
+        session.cache.addCallback(dev, 'status', reconfigure_dev_status)  # may spam events
+        session.cache.addCallback(dev, 'maxage', reconfigure_param)
+        session.cache.addCallback(dev, 'pollinterval', reconfigure_param)
+        # also subscribe to value and status updates of attached devices.
+        for adev in dev._adevs.values():
+            if not isinstance(adev, Readable):
+                continue
+            session.cache.addCallback(adev, 'value', reconfigure_adev_value)
+            session.cache.addCallback(adev, 'target', reconfigure_adev_target)
+            session.cache.addCallback(adev, 'status', reconfigure_adev_status)
+
+    def _create_device(self, devname, notify):
+        if devname.lower() in self._pollgroups:
+            return self._create_group(devname, notify)
+
+        # device creation should be serialized due to the many
+        # global state updates in the session object
+        with self._creation_lock:
+            dev = session.getDevice(devname)
+
+        for name, info in iteritems(dev.parameters):
+            if info.volatile:
+                notify('pollparam:%s' % name)
+        return dev
+
+    def _create_group(self, devname, notify):
+        name, members = self._pollgroups[devname.lower()]
+        devices = []
+        for member in members:
+            with self._creation_lock:
+                dev = session.getDevice(member)
+            if not self._is_pollable(dev):
+                continue
+            for param, info in iteritems(dev.parameters):
+                if info.volatile:
+                    notify(self._group_event(dev.name, 'pollparam:%s' % param))
+            devices.append(dev)
+        self.log.info('%-10s: polling %s together', devname,
+                      ', '.join(map(str, devices)))
+        return PollGroup(name, devices, self.log)
+
+    def _group_event(self, devname, event):
+        # the poll loop of a group needs to know which device's parameter
+        # should be polled
+        if event.startswith('pollparam:'):
+            return 'pollparam:%s/%s' % (devname.lower(), event[10:])
+        return event
+
+    def _is_pollable(self, dev):
+        if isinstance(dev, PollGroup):
+            return bool(dev.devices)
+        if not isinstance(dev, Readable):
+            self.log.info('%s is not a readable', dev)
+            return False
+        if isinstance(dev, (DeviceAlias, CacheReader)):
+            self.log.info('%s is a DeviceAlias or a CacheReader, '
+                          'not polling', dev)
+            return False
+        return True
+
+    def _poll_loop(self, dev, errstate, stats):
+        """
+        Polling a device and react to updates received via cache
+
+        This is a generator that yields the maximum time to wait for the next
+        event, so that events from other threads (e.g. quit or cache updates)
+        can trigger a wakeup.  The next event is sent into the generator, or
+        None if the waiting time has passed.
+
+        Based on the events received, the polling interval is adjusted.
+
+        Read errors in the device raise and this gets restarted from the
+        outer loop. If the received event is 'quit' we just exit here.
+
+        The polls and their duration are recorded in *stats*.
+        """
+        # get the initial values
+        interval = dev.pollinterval
+        maxage = interval - POLL_MIN_VALID_TIME if interval else (
+            dev.maxage or 0)
+
+        i = 0
+        lastpoll = 0  # last timestamp of successful poll
 
-                # only poll if enabled
-                if dev.pollinterval is not None:
-                    i += 1
-                    # if the polling fails, raise into outer loop which handles this...
-                    stval, rdval = dev.poll(i, maxage=maxage)
-                    self.log.debug('%-10s: status = %-25s, value = %s',
-                                   dev, stval, rdval)
-                    # adjust timing of we are no longer busy
-                    if stval is not None and stval[0] != status.BUSY:
+        while not self._stoprequest:
+            # determine maximum waiting time with a default of 1h
+            ct = currenttime()
+            nextpoll = lastpoll + (interval or 3600)
+            # note: dev.maxage is intended here!
+            timesout = lastpoll + (dev.maxage - POLL_MIN_VALID_TIME
+                                   if dev.maxage else POLL_MIN_VALID_TIME)
+            dnext = nextpoll - ct
+            dto = timesout - ct
+            maxwait = min(dnext, dto)
+            self.log.debug('%-10s: maxwait is %g (nextpoll=%g, timesout=%g)',
+                           dev, maxwait, dnext, dto)
+
+            # only wait for events if there is time, otherwise just poll
+            if maxwait > 0:
+                # wait for event, None if the waiting time has passed
+                event = yield maxwait
+                if event is not None:
+                    self.log.debug('%-10s: event %s', dev, event)
+
+                    # handle events....
+                    # use pass to trigger a poll or continue to just fetch the next event
+                    if event == 'adev_busy':  # one of our attached_devices went busy
+                        interval = POLL_BUSY_INTERVAL
+                        maxage = interval / 2.
+                        # also poll
+                    elif event == 'adev_normal':  # one of our attached_devices is no more busy
+                        pass  # also poll
+                    elif event == 'adev_target':  # one of our attached_devices got new target
+                        interval = POLL_BUSY_INTERVAL
+                        maxage = interval / 2.
+                        continue
+                    elif event == 'adev_value':  # one of our attached_devices changed value
+                        interval = POLL_BUSY_INTERVAL
+                        maxage = interval / 2.
+                        continue
+                    elif event == 'dev_busy':  # our device went busy
+                        interval = POLL_BUSY_INTERVAL
+                        maxage = interval / 2.
+                        continue
+                    elif event == 'dev_normal':  # our device is no more busy
+                        continue
+                    elif event == 'dev_target':  # our device got new target
+                        interval = POLL_BUSY_INTERVAL
+                        maxage = interval / 2.
+                        continue
+                    elif event == 'dev_value':  # our device changed value
+                        continue
+                    elif event == 'param':  # update local vars
                         interval = dev.pollinterval
-                        maxage = interval - POLL_MIN_VALID_TIME
-                # keep track of when we last (tried to) poll
-                lastpoll = currenttime()
-                # reset error count and waittime after first successful poll
-                if i == 1:
-                    errstate[:] = [0, 10]
-                    self.log.info('%-10s: polled successfully', dev)
-            # end of while not self._stoprequest
-        # end of poll_loop(dev)
+                        maxage = interval - POLL_MIN_VALID_TIME \
+                            if interval else (dev.maxage or 0)
+                        continue
+                    elif event == 'quit':  # stop doing anything
+                        return
+                    elif event.startswith('pollparam:'):
+                        try:
+                            dev._pollParam(event[10:])
+                        except Exception:
+                            dev.log.warning('error polling parameter %s',
+                                            event[10:], exc=True)
+                # else: just poll if timed out
+            else:
+                self.log.debug('%-10s: ignoring events for one round', dev)
+
+            # also do rate-limiting if too many events occur which would
+            # retrigger this device
+            if lastpoll + POLL_MIN_WAIT > currenttime():
+                self.log.debug('%-10s: rate-limiting poll()', dev)
+                stats.record_ratelimit()
+                continue
+
+            # only poll if enabled
+            if dev.pollinterval is not None:
+                i += 1
+                # if the polling fails, raise into outer loop which handles this...
+                started = currenttime()
+                stval, rdval = dev.poll(i, maxage=maxage)
+                stats.record_poll(started, currenttime() - started)
+                self.log.debug('%-10s: status = %-25s, value = %s',
+                               dev, stval, rdval)
+                # adjust timing of we are no longer busy
+                if stval is not None and stval[0] != status.BUSY:
+                    interval = dev.pollinterval
+                    maxage = interval - POLL_MIN_VALID_TIME
+            # keep track of when we last (tried to) poll
+            lastpoll = currenttime()
+            # reset error count and waittime after first successful poll
+            if i == 1:
+                errstate[:] = [0, 10]
+                self.log.info('%-10s: polled successfully', dev)
+        # end of while not self._stoprequest
+
+    def _poll_failed(self, devname, dev, errstate, stats):
+        """Log a failure to create or poll the device, and return the time to
+        wait before retrying.
+        """
+        errstate[0] += 1
+        stats.record_error()
+        # only warn 5 times in a row, and later occasionally
+        if dev is None:
+            self.log.warning('%-10s: error creating device, '
+                             'retrying in %d sec',
+                             devname, errstate[1], exc=True)
+        else:
+            self.log.warning('%-10s: error polling, retrying in '
+                             '%d sec', dev, errstate[1],
+                             exc=True)
+        if errstate[0] % 5 == 0:
+            # use exponential back-off for the wait time; in the worst
+            # case wait 10 minutes between attempts
+            errstate[1] = min(2 * errstate[1], 600)
+        return errstate[1]
+
+    def _worker_thread(self, devname, queue):
+
+        def notify(event):
+            queue.put(event, False)
 
         errstate = [0, 10]  # number of errors, current wait time
+        stats = self._stats[devname.lower()]
         dev = None
         registered = False
 
@@ -234,71 +422,53 @@ class Poller(Device):
         while not self._stoprequest:
             try:
                 if dev is None:
-                    # device creation should be serialized due to the many
-                    # global state updates in the session object
-                    with self._creation_lock:
-                        dev = session.getDevice(devname)
-
-                    for name, info in iteritems(dev.parameters):
-                        if info.volatile:
-                            queue.put('pollparam:%s' % name)
+                    dev = self._create_device(devname, notify)
 
                 if not registered:
-                    if not isinstance(dev, Readable):
-                        self.log.info('%s is not a readable', dev)
-                        return
-                    if isinstance(dev, (DeviceAlias, CacheReader)):
-                        self.log.info('%s is a DeviceAlias or a CacheReader, '
-                                      'not polling', dev)
+                    if not self._is_pollable(dev):
                         return
-
-                    self.log.debug('%-10s: registering callbacks', dev)
-                    # keep track of some parameters via cache callback
-                    # session.cache.addCallback(dev, 'value', reconfigure_dev_value)  # spams events
-                    session.cache.addCallback(dev, 'target', reconfigure_dev_target)
-                    session.cache.addCallback(dev, 'status', reconfigure_dev_status)  # may spam events
-                    session.cache.addCallback(dev, 'maxage', reconfigure_param)
-                    session.cache.addCallback(dev, 'pollinterval', reconfigure_param)
-                    # also subscribe to value and status updates of attached devices.
-                    for adev in dev._adevs.values():
-                        if not isinstance(adev, Readable):
-                            continue
-                        session.cache.addCallback(adev, 'value', reconfigure_adev_value)
-                        session.cache.addCallback(adev, 'target', reconfigure_adev_target)
-                        session.cache.addCallback(adev, 'status', reconfigure_adev_status)
+                    self._register_callbacks(dev, notify)
                 registered = True
 
-                poll_loop(dev)
+                loop = self._poll_loop(dev, errstate, stats)
+                maxwait = next(loop)
+                while True:
+                    try:
+                        # if the timeout is reached, this raises Queue.Empty
+                        event = queue.get(True, maxwait)
+                    except Queue.Empty:
+                        event = None
+                    maxwait = loop.send(event)
 
+            except StopIteration:
+                # the poll loop has finished
+                return
             except Exception:
-                errstate[0] += 1
-                # only warn 5 times in a row, and later occasionally
-                if dev is None:
-                    self.log.warning('%-10s: error creating device, '
-                                     'retrying in %d sec',
-                                     devname, errstate[1], exc=True)
-                else:
-                    self.log.warning('%-10s: error polling, retrying in '
-                                     '%d sec', dev, errstate[1],
-                                     exc=True)
-                if errstate[0] % 5 == 0:
-                    # use exponential back-off for the wait time; in the worst
-                    # case wait 10 minutes between attempts
-                    errstate[1] = min(2 * errstate[1], 600)
+                waittime = self._poll_failed(devname, dev, errstate, stats)
                 # sleep up to wait time
                 try:
-                    queue.get(True, errstate[1])  # may return earlier
+                    queue.get(True, waittime)  # may return earlier
                 except Queue.Empty:
                     pass
         # end of while not self._stoprequest
     # end of _worker_thread
 
     def enqueue_params_poll(self, key, value, time, tell):
-        dev, key = key[len('poller/'):].split('/', 2)
-        if dev in self._workers:
-            worker = self._workers[dev]
-            for param in value:
-                worker.queue.put('pollparam:%s' % param)
+        dev, key = key[len('poller/'):].split('/', 1)
+        if key != 'pollparams':
+            return
+        for param in value:
+            self._notify(dev, 'pollparam:%s' % param)
+
+    def _notify(self, devname, event):
+        devname = devname.lower()
+        if devname in self._leaders:
+            event = self._group_event(devname, event)
+            devname = self._leaders[devname]
+        if self._scheduler:
+            self._scheduler.notify(devname, event)
+        elif devname in self._workers:
+            self._workers[devname].queue.put(event)
 
     def start(self, setup=None):
         self._setup = setup
@@ -311,6 +481,10 @@ class Poller(Device):
 
         try:
             session.loadSetup(setup, allow_startupcode=False)
+            if self.scheduler:
+                self._scheduler = PollScheduler(self, self.workers)
+            devnames = []
+            groups = {}
             for devname in session.getSetupInfo()[setup]['devices']:
                 if devname in self.blacklist:
                     self.log.debug('not polling %s, it is blacklisted', devname)
@@ -319,11 +493,32 @@ class Poller(Device):
                 # for some external modules like Epics
                 self.log.debug('importing device class for %s', devname)
                 try:
-                    session.importDevice(devname)
+                    devcls, devconfig = session.importDevice(devname)
                 except Exception:
                     self.log.warning('%-10s: error importing device class, '
                                      'not retrying this device', devname, exc=True)
                     continue
+                group = devconfig.get('pollgroup')
+                if group and issubclass(devcls, Readable):
+                    if group in groups:
+                        # polled by the loop of the first device in the group
+                        groups[group].append(devname)
+                        continue
+                    groups[group] = [devname]
+                devnames.append(devname)
+            for group, members in iteritems(groups):
+                if len(members) > 1:
+                    self._pollgroups[members[0].lower()] = (group, members)
+                    for devname in members:
+                        self._leaders[devname.lower()] = members[0].lower()
+
+            for devname in devnames:
+                stats = self._stats[devname.lower()] = PollStats()
+                if self._scheduler:
+                    # start staggered to not poll all devs at once
+                    self._scheduler.add(devname, stats, 0.0719 * len(
+                        self._scheduler.tasks))
+                    continue
                 self.log.debug('starting thread for %s', devname)
                 queue = Queue.Queue()
                 worker = createThread('%s poller' % devname,
@@ -335,6 +530,7 @@ class Poller(Device):
                 # use just a small delay, exact value does not matter
                 sleep(0.0719)
             session.cache.addPrefixCallback('poller', self.enqueue_params_poll)
+            createThread('stats publisher', self._publish_stats)
 
         except ConfigurationError as err:
             self.log.warning('Setup %r has failed to load!', setup)
@@ -345,6 +541,15 @@ class Poller(Device):
         createThread('refresh checker', self._checker, args=(setup,))
         self.log.info('%s poller startup complete', setup)
 
+    def _publish_stats(self):
+        while not self._stats_stop.wait(STATS_INTERVAL):
+            for devname, stats in listitems(self._stats):
+                info = stats.summary()
+                info['setup'] = self._setup
+                session.cache.put_raw(STATS_PREFIX + devname, info,
+                                      ttl=3 * STATS_INTERVAL,
+                                      flag=FLAG_NO_STORE)
+
     def _checker(self, setupname):
         if setupname not in session._setup_info:
             # setup has errors or has disappeared, try the file directly
@@ -365,6 +570,8 @@ class Poller(Device):
             return self._wait_master()
         while not self._stoprequest:
             sleep(1)
+        if self._scheduler:
+            self._scheduler.join()
         for worker in itervalues(self._workers):
             worker.join()
 
@@ -375,6 +582,10 @@ class Poller(Device):
             return  # already quitting
         self.log.info('poller quitting on signal %s...', signum)
         self._stoprequest = True
+        self._stats_stop.set()
+        if self._scheduler:
+            self._scheduler.stop()
+            self._scheduler.join()
         for worker in itervalues(self._workers):
             worker.queue.put('quit', False)  # wake up to quit
         for worker in itervalues(self._workers):
@@ -396,6 +607,8 @@ class Poller(Device):
         self.log.info('got SIGUSR2')
         if self._setup is not None:
             info = []
+            if self._scheduler:
+                info.extend(self._scheduler.statusinfo())
             for worker in itervalues(self._workers):
                 wname = worker.getName()
                 if worker.is_alive():
@@ -403,6 +616,9 @@ class Poller(Device):
                 else:
                     info.append('%s: dead' % wname)
             self.log.info(', '.join(info))
+            self.log.info('slowest devices:\n%s', '\n'.join(format_stats(
+                {devname: stats.summary()
+                 for (devname, stats) in listitems(self._stats)}, 10)))
             self.log.info('current stacktraces for each thread:')
             active = threading._active
             for tid, frame in listitems(sys._current_frames()):
@@ -0,0 +1,217 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2020 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+
+"""Scheduler that polls many devices with a few worker threads."""
+
+from __future__ import absolute_import, division, print_function
+
+import heapq
+import threading
+from collections import deque
+from itertools import count
+from time import time as currenttime
+
+from nicos.pycompat import itervalues, queue
+from nicos.utils import createThread
+
+
+class PollTask(object):
+    """The polling of a single device by the scheduler.
+
+    This runs the same poll loop as the threads of the poller (see
+    `Poller._poll_loop`), but instead of waiting for events in a thread, the
+    loop is resumed by a worker of the scheduler when the next poll is due or
+    an event has arrived.
+    """
+
+    def __init__(self, scheduler, devname, stats):
+        self.scheduler = scheduler
+        self.devname = devname
+        self.stats = stats
+        self.dev = None
+        self.loop = None
+        self.registered = False
+        # number of errors, current wait time
+        self.errstate = [0, 10]
+        self.events = deque()
+        # when the poll loop wants to be resumed without an event
+        self.due = 0
+        # while waiting after errors, events only trigger a retry
+        self.failed = False
+        # when the task is scheduled to run (None: not scheduled)
+        self.when = None
+        self.running = False
+
+    def notify(self, event):
+        self.scheduler.notify(self.devname, event)
+
+    def run(self, poller):
+        """Run the poll loop until it waits; return False if the device is
+        not polled anymore.
+        """
+        try:
+            if self.dev is None:
+                self.dev = poller._create_device(self.devname, self.notify)
+
+            if not self.registered:
+                if not poller._is_pollable(self.dev):
+                    return False
+                poller._register_callbacks(self.dev, self.notify)
+            self.registered = True
+
+            if self.failed:
+                # retrying after an error: the event only served as a wakeup
+                self.events.clear()
+                self.failed = False
+            if self.loop is None:
+                self.loop = poller._poll_loop(self.dev, self.errstate,
+                                              self.stats)
+                self.due = currenttime() + next(self.loop)
+            while True:
+                if currenttime() >= self.due:
+                    maxwait = self.loop.send(None)
+                elif self.events:
+                    maxwait = self.loop.send(self.events.popleft())
+                else:
+                    return True
+                self.due = currenttime() + maxwait
+
+        except StopIteration:
+            # the poll loop has finished
+            return False
+        except Exception:
+            waittime = poller._poll_failed(self.devname, self.dev,
+                                           self.errstate, self.stats)
+            self.loop = None
+            self.failed = True
+            self.events.clear()
+            self.due = currenttime() + waittime
+            return True
+
+
+class PollScheduler(object):
+    """Runs the poll tasks of all devices of a poller process.
+
+    The tasks are kept in a priority queue, ordered by the time they have to
+    run, and are executed by a fixed number of worker threads.  A task is
+    never run by two workers at the same time.
+    """
+
+    def __init__(self, poller, nworkers):
+        self.poller = poller
+        self.log = poller.log
+        self.tasks = {}
+        self._heap = []
+        self._counter = count()
+        self._cond = threading.Condition()
+        self._ready = queue.Queue()
+        self._stoprequest = False
+        self._threads = [createThread('poll scheduler', self._scheduler)]
+        self._threads.extend(createThread('poll worker %d' % i, self._worker)
+                             for i in range(nworkers))
+
+    def add(self, devname, stats, delay=0):
+        task = PollTask(self, devname, stats)
+        with self._cond:
+            self.tasks[devname.lower()] = task
+            self._schedule(task, currenttime() + delay)
+
+    def notify(self, devname, event):
+        """Give an event to the poll loop of the device."""
+        task = self.tasks.get(devname.lower())
+        if task is None:
+            return
+        task.events.append(event)
+        now = currenttime()
+        with self._cond:
+            # a running task handles the event when it is finished
+            if not task.running and (task.when is None or task.when > now):
+                self._schedule(task, now)
+
+    def _schedule(self, task, when):
+        # must be called with the lock held; an older entry of the task in
+        # the heap becomes stale by setting task.when
+        task.when = when
+        heapq.heappush(self._heap, (when, next(self._counter), task))
+        self._cond.notify()
+
+    def _scheduler(self):
+        while True:
+            with self._cond:
+                if self._stoprequest:
+                    break
+                now = currenttime()
+                task = None
+                while self._heap:
+                    when, _, task = self._heap[0]
+                    if task.when == when:
+                        break
+                    # stale entry
+                    heapq.heappop(self._heap)
+                    task = None
+                if task is None:
+                    self._cond.wait()
+                    continue
+                if when > now:
+                    self._cond.wait(when - now)
+                    continue
+                heapq.heappop(self._heap)
+                task.when = None
+                task.running = True
+            self._ready.put((task, when))
+        for _ in self._threads[1:]:
+            self._ready.put(None)
+
+    def _worker(self):
+        while True:
+            item = self._ready.get()
+            if item is None:
+                return
+            task, when = item
+            task.stats.record_lag(currenttime() - when)
+            keep = task.run(self.poller)
+            with self._cond:
+                task.running = False
+                if not keep:
+                    self.tasks.pop(task.devname.lower(), None)
+                elif task.events and not task.failed:
+                    self._schedule(task, currenttime())
+                else:
+                    self._schedule(task, task.due)
+
+    def stop(self):
+        with self._cond:
+            self._stoprequest = True
+            self._cond.notify()
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def statusinfo(self):
+        info = ['%s: %s' % (thread.getName(),
+                            'alive' if thread.is_alive() else 'dead')
+                for thread in self._threads]
+        info.append('%d devices, %d due' % (
+            len(self.tasks), sum(1 for task in itervalues(self.tasks)
+                                 if task.when is not None and
+                                 task.when <= currenttime())))
+        return info
@@ -0,0 +1,161 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2020 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+
+"""Statistics about the polling of devices."""
+
+from __future__ import absolute_import, division, print_function
+
+import threading
+from collections import deque
+
+from nicos.protocols.cache import DEFAULT_CACHE_PORT, OP_ASK, OP_TELL, \
+    OP_WILDCARD, cache_load, line_pattern, msg_pattern
+from nicos.pycompat import from_utf8, iteritems, to_utf8
+from nicos.utils import closeSocket, tcpSocket
+
+# interval for publishing the statistics to the cache
+STATS_INTERVAL = 10.0
+# number of recent polls the duration percentiles are computed from
+STATS_SAMPLES = 1000
+# cache key prefix of the statistics
+STATS_PREFIX = 'poller/stats/'
+
+# columns of the statistics table: key, title, format
+STATS_COLUMNS = [
+    ('count', 'polls', '%8d'),
+    ('errors', 'errors', '%7d'),
+    ('ratelimited', 'limited', '%8d'),
+    ('last', 'last/ms', '%9.1f'),
+    ('p50', 'p50/ms', '%9.1f'),
+    ('p99', 'p99/ms', '%9.1f'),
+    ('interval', 'interval/s', '%11.2f'),
+]
+# keys whose values are durations in seconds, shown in milliseconds
+DURATION_KEYS = {'last', 'p50', 'p99'}
+
+
+def percentile(values, fraction):
+    """Return the given percentile of the sorted *values*."""
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class PollStats(object):
+    """Counters and timings of the polling of one device (or poll group)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.errors = 0
+        self.ratelimited = 0
+        self.lastpoll = None
+        self.durations = deque(maxlen=STATS_SAMPLES)
+        self.intervals = deque(maxlen=STATS_SAMPLES)
+        # time between a poll being due and a worker of the scheduler
+        # starting it
+        self.lags = deque(maxlen=STATS_SAMPLES)
+
+    def record_poll(self, started, duration):
+        with self._lock:
+            if self.lastpoll is not None:
+                self.intervals.append(started - self.lastpoll)
+            self.lastpoll = started
+            self.durations.append(duration)
+            self.count += 1
+
+    def record_error(self):
+        self.errors += 1
+
+    def record_ratelimit(self):
+        self.ratelimited += 1
+
+    def record_lag(self, lag):
+        with self._lock:
+            self.lags.append(lag)
+
+    def summary(self):
+        """Return the statistics as a dictionary."""
+        with self._lock:
+            durations = sorted(self.durations)
+            intervals = list(self.intervals)
+            lags = list(self.lags)
+            last = self.durations[-1] if self.durations else None
+        info = {'count': self.count, 'errors': self.errors,
+                'ratelimited': self.ratelimited, 'last': last,
+                'p50': None, 'p99': None, 'interval': None}
+        if durations:
+            info['p50'] = percentile(durations, 0.5)
+            info['p99'] = percentile(durations, 0.99)
+        if intervals:
+            info['interval'] = sum(intervals) / len(intervals)
+        if lags:
+            info['lag_mean'] = sum(lags) / len(lags)
+            info['lag_max'] = max(lags)
+        return info
+
+
+def format_stats(stats, number=None, sortkey='p99'):
+    """Return lines of a table of the statistics of the devices with the
+    highest *sortkey*, given a dictionary mapping device names to summaries.
+    """
+    entries = sorted(iteritems(stats), reverse=True,
+                     key=lambda item: (item[1].get(sortkey) or 0, item[0]))
+    lines = ['%-20s %-12s' % ('device', 'setup') +
+             ''.join(title.rjust(len(fmt % 0))
+                     for (_, title, fmt) in STATS_COLUMNS)]
+    for devname, info in entries[:number]:
+        line = '%-20s %-12s' % (devname, info.get('setup', ''))
+        for key, _, fmt in STATS_COLUMNS:
+            value = info.get(key)
+            if value is None:
+                line += '-'.rjust(len(fmt % 0))
+            else:
+                line += fmt % (1000 * value if key in DURATION_KEYS else value)
+        lines.append(line)
+    return lines
+
+
+def query_stats(cache):
+    """Query the statistics of all pollers from the cache at *cache*
+    (host[:port]), and return a dictionary mapping device names to them.
+    """
+    sock = tcpSocket(cache, DEFAULT_CACHE_PORT)
+    try:
+        sock.sendall(to_utf8('@%s%s\n###%s\n' % (STATS_PREFIX, OP_WILDCARD,
+                                                 OP_ASK)))
+        data = b''
+        while not data.endswith(b'###!\n'):
+            newdata = sock.recv(8192)
+            if not newdata:
+                break
+            data += newdata
+    finally:
+        closeSocket(sock)
+    stats = {}
+    for line in line_pattern.findall(data):
+        match = msg_pattern.match(from_utf8(line))
+        # expired values are from pollers that do not run anymore
+        if not match or match.group('op') != OP_TELL or \
+           not match.group('key').startswith(STATS_PREFIX) or \
+           not match.group('value'):
+            continue
+        stats[match.group('key')[len(STATS_PREFIX):]] = \
+            cache_load(match.group('value'))
+    return stats
@@ -33,11 +33,17 @@ from nicos.pycompat import add_metaclass
 from nicos.utils import FitterRegistry, getNumArgs
 from nicos.utils.analyze import estimateFWHM
 
-try:
-    from scipy.optimize.minpack import leastsq
-    from scipy.signal import argrelmax
-except ImportError:
-    leastsq = None
+
+# scipy is only imported when a fit is done, since importing it takes longer
+# than the rest of the NICOS startup
+
+def _leastsq():
+    """Return scipy's leastsq function, or None if it is not available."""
+    try:
+        from scipy.optimize import leastsq
+    except ImportError:
+        return None
+    return leastsq
 
 
 def _general_function(params, xdata, ydata, function):
@@ -48,10 +54,9 @@ def _weighted_general_function(params, xdata, ydata, function, weights):
     return weights * (function(xdata, *params) - ydata)
 
 
-def curve_fit(f, xdata, ydata, p0=None, sigma=None, **kw):
+def _curve_fit(f, xdata, ydata, p0=None, sigma=None, **kw):
     """This is scipy.optimize.curve_fit, which is only available in very recent
-    scipy.  It is overwritten below by the version from scipy if it exists
-    there.
+    scipy.  It is used by `curve_fit` if scipy does not have it.
     """
     if p0 is None or isscalar(p0):
         # determine number of parameters by inspecting the function
@@ -72,7 +77,7 @@ def curve_fit(f, xdata, ydata, p0=None, sigma=None, **kw):
 
     # Remove full_output from kw, otherwise we're passing it in twice.
     return_full = kw.pop('full_output', False)
-    res = leastsq(func, p0, args=args, full_output=1, **kw)
+    res = _leastsq()(func, p0, args=args, full_output=1, **kw)
     (popt, pcov, infodict, errmsg, ier) = res  # pylint: disable=unbalanced-tuple-unpacking
 
     if ier not in [1, 2, 3, 4]:
@@ -91,10 +96,13 @@ def curve_fit(f, xdata, ydata, p0=None, sigma=None, **kw):
         return popt, pcov
 
 
-try:
-    from scipy.optimize.minpack import curve_fit
-except ImportError:
-    pass
+def curve_fit(f, xdata, ydata, p0=None, sigma=None, **kw):
+    """Call scipy.optimize.curve_fit, or its replacement for older scipy."""
+    try:
+        from scipy.optimize import curve_fit as scipy_curve_fit
+    except ImportError:
+        return _curve_fit(f, xdata, ydata, p0, sigma, **kw)
+    return scipy_curve_fit(f, xdata, ydata, p0, sigma, **kw)
 
 
 class FitResult(object):
@@ -197,7 +205,7 @@ class Fit(object):
         return array(xn), array(yn), array(dyn)
 
     def run(self, x, y, dy):
-        if leastsq is None:
+        if _leastsq() is None:
             return self.result(x, y, dy, None, None,
                                msg='scipy leastsq function not available')
         if len(x) < 2:
@@ -385,6 +393,7 @@ class CosineFit(PredefinedFit):
         ymax = max(y)
         A = (ymax - ymin) / 2
         B = ymax - A
+        from scipy.signal import argrelmax
         maxes = argrelmax(y, order=2)[0]
         if len(maxes) > 1:
             dx = x[maxes[1]] - x[maxes[0]]
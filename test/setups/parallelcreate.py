@@ -0,0 +1,45 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2020 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+
+name = 'test_parallelcreate setup'
+
+devices = dict(
+    slow1 = device('test.utils.TestSlowDevice',
+        initdelay = 0.5,
+    ),
+    slow2 = device('test.utils.TestSlowDevice',
+        initdelay = 0.5,
+    ),
+    slow3 = device('test.utils.TestSlowDevice',
+        initdelay = 0.5,
+    ),
+    slow4 = device('test.utils.TestSlowDevice',
+        initdelay = 0.5,
+    ),
+    combined = device('test.utils.TestSlowDevice',
+        devs = ['slow1', 'slow2', 'slow3', 'slow4'],
+    ),
+    # attached to a device created later in sorted order
+    another = device('test.utils.TestSlowDevice',
+        devs = ['combined'],
+        lowlevel = True,
+    ),
+)
@@ -0,0 +1,297 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2020 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+
+"""Tests for the helpers of the cache server."""
+
+from __future__ import absolute_import, division, print_function
+
+import random
+
+import pytest
+
+from nicos.protocols.cache import cache_dump, cache_dump_binary, \
+    cache_load, cache_to_text
+from nicos.services.cache.database.base import CacheDatabase
+from nicos.services.cache.database.binary import HistoryStore
+from nicos.services.cache.database.flatfile import readStoreIndex, \
+    writeStoreIndex
+from nicos.services.cache.keyindex import KeyIndex
+from nicos.services.cache.subscriptions import SubscriptionIndex
+
+
+class Client(object):
+    """Minimal stand-in for a cache worker."""
+
+    def __init__(self):
+        self.ts_updates_on = set()
+        self.updates_on = set()
+
+    def expected(self, key):
+        # the matching rule of CacheWorker.update
+        for sub in self.ts_updates_on:
+            if sub in key:
+                return True
+        for sub in self.updates_on:
+            if sub in key:
+                return False
+        return None
+
+
+def check_index(index, clients, keys):
+    for key in keys:
+        expected = set()
+        for client in clients:
+            withts = client.expected(key)
+            if withts is not None:
+                expected.add((client, withts))
+        result = index.lookup(key)
+        assert len(result) == len(expected)
+        assert set(result) == expected
+
+
+def test_subscription_index():
+    index = SubscriptionIndex()
+    clients = [Client() for _ in range(4)]
+    subs = [('nicos/', False), ('nicos/', True), ('slit/', False),
+            ('slit/width', True), ('t/value', False), ('', False),
+            ('aaa', False)]
+    for client, (sub, ts) in zip(clients * 2, subs):
+        index.add(client, sub, ts)
+        (client.ts_updates_on if ts else client.updates_on).add(sub)
+    keys = ['nicos/slit/width', 'nicos/t/value', 'other/slit/value',
+            'nicos/aaaa/value', 'aa', 't/valu', 'x']
+    check_index(index, clients, keys)
+
+    # results are remembered, but must be updated on changes
+    index.discard(clients[1], 'nicos/', True)
+    clients[1].ts_updates_on.discard('nicos/')
+    check_index(index, clients, keys)
+    index.remove_client(clients[2])
+    clients.remove(clients[2])
+    check_index(index, clients, keys)
+
+
+def test_subscription_index_random():
+    rnd = random.Random(42)
+    index = SubscriptionIndex()
+    clients = [Client() for _ in range(20)]
+    alphabet = 'ab/'
+    for client in clients:
+        for _ in range(rnd.randint(0, 4)):
+            sub = ''.join(rnd.choice(alphabet)
+                          for _ in range(rnd.randint(1, 4)))
+            ts = rnd.random() < 0.5
+            index.add(client, sub, ts)
+            (client.ts_updates_on if ts else client.updates_on).add(sub)
+    keys = [''.join(rnd.choice(alphabet) for _ in range(rnd.randint(1, 12)))
+            for _ in range(500)]
+    check_index(index, clients, keys)
+
+
+def test_history_store(tmpdir):
+    store = HistoryStore(str(tmpdir))
+    # small blocks, to get many index entries
+    store.block_size = 100
+    for i in range(1000):
+        store.append('nicos/dev/value', 1000. + i, None, repr(i * 0.5))
+    # out of order timestamps are clamped
+    store.append('nicos/dev/value', 1500., None, "'late'")
+    store.append('nicos/dev/status', 1000., 5, '(200, %r)' % u'\xe4')
+    store.append('nicos/dev/status', 1010., None, None)
+    store.append('nocatkey', 1000., None, '1')
+    store.append('nocatkey', 1001., -1, None)
+    store.close()
+
+    hist = list(store.history('nicos/dev/value', 1100.5, 1103))
+    assert hist == [(1100., '50.0'), (1101., '50.5'), (1102., '51.0'),
+                    (1103., '51.5')]
+    # at least the last value before the range is returned
+    assert list(store.history('nicos/dev/value', 5000, 6000)) == \
+        [(1999., "'late'")]
+    assert list(store.history('nicos/dev/value', 0, 999)) == []
+    assert len(list(store.history('nicos/dev/value', 0, 3000))) == 1001
+    assert list(store.history('nicos/dev/status', 1005, 1020)) == \
+        [(1000., u"(200, '\xe4')"), (1010., '')]
+    assert list(store.history('nicos/other/value', 0, 3000)) == []
+
+    # writing continues at the end of existing files
+    store.append('nicos/dev/value', 1200., None, '-1')
+    assert list(store.history('nicos/dev/value', 1999, 3000)) == \
+        [(1998., '499.0'), (1999., '499.5'), (1999., "'late'"), (1999., '-1')]
+
+    latest = sorted(store.latest())
+    assert latest == [
+        ('nicos/dev/status', 1010., 0., None),
+        ('nicos/dev/value', 1999., 0., '-1'),
+        # the expiry record leaves the old value, marked as expired
+        ('nocatkey', 1000., -1., '1'),
+    ]
+
+
+def test_flatfile_index(tmpdir):
+    fn = str(tmpdir.join('nicos-dev'))
+    with open(fn, 'w') as fp:
+        fp.write('# NICOS cache store file v2\n')
+        for i in range(100):
+            fp.write('value\t%r\t+\t%d\n' % (1000. + i, i))
+            if i % 10 == 0:
+                fp.write('status\t%r\t-\t(200, %r)\n' % (1000. + i, u'\xe4'))
+    assert readStoreIndex(fn) is None
+
+    writeStoreIndex(fn)
+    index = readStoreIndex(fn)
+    assert sorted(index) == ['status', 'value']
+    assert index['value'][:2] == (1000., 1099.)
+    assert index['status'][:2] == (1000., 1090.)
+    assert list(readStoreIndex(fn, ['value'])) == ['value']
+    with open(fn, 'rb') as fp:
+        for i, offset in enumerate(index['status'][2]):
+            fp.seek(offset)
+            assert fp.readline().startswith(b'status\t%d.0\t' % (1000 + i*10))
+        assert len(index['value'][2]) == 100
+
+    # the index is not used for modified files
+    with open(fn, 'a') as fp:
+        fp.write('value\t2000.0\t+\t1\n')
+    assert readStoreIndex(fn) is None
+
+
+def test_key_index():
+    index = KeyIndex()
+    index.update(['nicos/slit/width', 'nicos/slit/height', 'nicos/t/value',
+                  'nicos/slitx/value', 'other/slit/value'])
+    index.add('value')
+    assert len(index) == 6
+    assert index.match('nicos/slit/') == ['nicos/slit/height',
+                                          'nicos/slit/width']
+    assert index.match('nicos/') == ['nicos/slit/height', 'nicos/slit/width',
+                                     'nicos/slitx/value', 'nicos/t/value']
+    assert index.match('') == sorted(index.match('/') + ['value'])
+    # substring matches
+    assert index.match('slit/') == ['nicos/slit/height', 'nicos/slit/width',
+                                    'other/slit/value']
+    assert index.match('value') == ['nicos/slitx/value', 'nicos/t/value',
+                                    'other/slit/value', 'value']
+    # a key with "nicos/" in the middle makes prefix matching impossible
+    index.add('other/nicos/slit/x')
+    assert index.match('nicos/slit/') == ['nicos/slit/height',
+                                          'nicos/slit/width',
+                                          'other/nicos/slit/x']
+    index.discard('other/nicos/slit/x')
+    assert index.match('nicos/slit/') == ['nicos/slit/height',
+                                          'nicos/slit/width']
+    index.clear()
+    assert index.match('') == []
+
+
+def test_key_index_random():
+    rnd = random.Random(42)
+    index = KeyIndex()
+    alphabet = 'ab/'
+    keys = set()
+    for _ in range(500):
+        key = ''.join(rnd.choice(alphabet) for _ in range(rnd.randint(1, 8)))
+        keys.add(key)
+        index.add(key)
+        if rnd.random() < 0.1:
+            key = rnd.choice(sorted(keys))
+            keys.discard(key)
+            index.discard(key)
+    for query in set(''.join(rnd.choice(alphabet)
+                             for _ in range(rnd.randint(0, 4)))
+                     for _ in range(200)):
+        assert index.match(query) == sorted(k for k in keys if query in k)
+
+
+class HistoryDB(object):
+    """Stand-in for a cache database with a fixed history."""
+
+    ask_hist_downsampled = CacheDatabase.__dict__['ask_hist_downsampled']
+
+    def __init__(self, values):
+        self.values = values
+
+    def ask_hist(self, key, fromtime, totime):
+        lines = ['%r@%s=%s\n' % (t, key, v) for (t, v) in self.values
+                 if fromtime <= t <= totime]
+        # return in several chunks, like the real databases
+        for i in range(0, len(lines), 7):
+            yield ''.join(lines[i:i+7])
+
+
+def test_downsampled_history():
+    values = [(1000. + i, str(i % 10)) for i in range(100)]
+    values[55] = (1055., '-30')
+    values[77] = (1077., "'string'")
+    db = HistoryDB(values)
+    result = ''.join(db.ask_hist_downsampled('k', 1000., 1099., 16))
+    points = [(float(line.split('@')[0]), line.split('=')[1])
+              for line in result.splitlines()]
+    assert len(points) <= 16
+    # sorted in time
+    assert points == sorted(points)
+    # first, last and spike are kept, non-numeric values don't disturb
+    assert points[0] == (1000., '0')
+    assert points[-1] == (1099., '9')
+    assert (1055., '-30') in points
+    # per interval of ~25 seconds: first, last, minimum and maximum
+    assert points[:4] == [(1000., '0'), (1009., '9'), (1024., '4'),
+                          (1025., '5')]
+
+    # nothing is lost if there are enough points allowed
+    result = ''.join(db.ask_hist_downsampled('k', 1000., 1099., 1000))
+    assert len(result.splitlines()) == 100
+
+
+@pytest.mark.parametrize('value', [
+    None, True, False, 0, -1, 2**31, -2**63, 2**100, 1.5, float('inf'),
+    '', u'\xe4\u20ac', b'\x00\xff', 'x' * 1000,
+    [], (), [1.5, 2.5], (1, 2), [1, 2**40], [1, 2**70], [1, 2.0], [True, 1],
+    list(range(300)), tuple(i * 0.5 for i in range(1000)), [[1, 'a'], (None,)],
+    {}, {'a': 1, (1, 2): [3.0]}, frozenset([1, 'b']),
+])
+def test_binary_encoding(value):
+    data = cache_dump_binary(value)
+    assert data.startswith('%')
+    assert '\n' not in data
+    result = cache_load(data)
+    assert result == value
+    # same types as with the text encoding
+    expected = cache_load(cache_dump(value))
+    assert type(result) is type(expected)
+    if isinstance(value, (list, tuple)):
+        assert [type(v) for v in result] == [type(v) for v in expected]
+    # conversion to the text encoding gives the same value
+    line = 'nicos/dev/value=%s\n' % data
+    assert cache_to_text(line) == 'nicos/dev/value=%s\n' % cache_dump(value)
+
+
+def test_binary_to_text():
+    lines = ['1.5@nicos/a/value=%s\n' % cache_dump_binary([1, 2]),
+             'nicos/b/value!%s\r\n' % cache_dump_binary(0.5),
+             'nicos/c/value=5\n',
+             "nicos/d/value='%AAAA'\n",
+             # invalid binary values are passed on unchanged
+             'nicos/e/value=%AAAA\n']
+    assert cache_to_text(''.join(lines)) == ''.join([
+        '1.5@nicos/a/value=[1,2,]\n', 'nicos/b/value!0.5\r\n',
+        'nicos/c/value=5\n', "nicos/d/value='%AAAA'\n",
+        'nicos/e/value=%AAAA\n'])
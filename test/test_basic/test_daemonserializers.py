@@ -0,0 +1,116 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2020 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+
+"""Tests for the serializers of the daemon protocol."""
+
+from __future__ import absolute_import, division, print_function
+
+import socket
+
+import numpy as np
+import pytest
+
+from nicos.clients.proto.classic import ClientTransport
+from nicos.core.data import ScanData
+from nicos.protocols.daemon.classic import LENGTH, SERIALIZERS, STX, \
+    BufferList
+from nicos.pycompat import cPickle as pickle
+from nicos.utils import createThread
+
+pytestmark = pytest.mark.skipif(pickle.HIGHEST_PROTOCOL < 5,
+                                reason='pickle protocol 5 not available')
+
+
+def payload():
+    dataset = ScanData()
+    dataset.xresults = [[i * 0.1, 'pos%d' % i] for i in range(1000)]
+    dataset.yresults = [[i, i // 2] for i in range(1000)]
+    return {'dataset': dataset, 'image': np.arange(10000, dtype='<u4'),
+            'curve': np.linspace(0, 1, 2000)[::2], 'small': np.arange(3),
+            'bytes': b'\x01' * 10000}
+
+
+def receive(data):
+    # send the frame through a socket, like the daemon does
+    transport = ClientTransport()
+    transport.sock, sender = socket.socketpair()
+
+    def send():
+        sender.sendall(STX + LENGTH.pack(len(data)))
+        for chunk in (data.chunks if isinstance(data, BufferList)
+                      else [data]):
+            sender.sendall(chunk)
+
+    thread = createThread('sender', send)
+    try:
+        reply = transport.recv_reply()
+        return transport.serializer, reply
+    finally:
+        thread.join()
+        sender.close()
+        transport.sock.close()
+
+
+def check(result):
+    expected = payload()
+    assert result['dataset'].xresults == expected['dataset'].xresults
+    assert result['dataset'].yresults == expected['dataset'].yresults
+    for key in ('image', 'curve', 'small'):
+        assert result[key].dtype == expected[key].dtype
+        assert (result[key] == expected[key]).all()
+    assert result['bytes'] == expected['bytes']
+
+
+def test_buffers():
+    serializer = SERIALIZERS['buffers']()
+    data = serializer.serialize_ok_reply(payload())
+    # the image is sent out-of-band, the other arrays are too small or not
+    # contiguous
+    assert isinstance(data, BufferList)
+    assert [memoryview(chunk).nbytes for chunk in data.chunks[-1:]] == [40000]
+    used, (success, result) = receive(data)
+    assert used.name == 'buffers'
+    assert success
+    check(result)
+    # the array uses the received data, and is aligned
+    assert not result['image'].flags.owndata
+    assert result['image'].flags.aligned
+    assert result['image'].flags.writeable
+
+
+def test_detection():
+    # every serializer is detected by the client from the first reply
+    for name, cls in SERIALIZERS.items():
+        used, (success, result) = receive(cls().serialize_ok_reply(payload()))
+        assert used.name == name
+        check(result)
+
+
+def test_small_payload():
+    serializer = SERIALIZERS['buffers']()
+    for obj in [None, 'error', {'key': [1, 2.5, (3, 'x')]}]:
+        data = serializer.serialize_event('event', obj)
+        # no out-of-band buffers: sent in one piece
+        assert isinstance(data, bytes)
+        assert serializer.deserialize_event(data, 'event') == ('event', obj)
+    assert serializer.deserialize_cmd(
+        serializer.serialize_cmd('start', ('name', 'code')), 'start') == \
+        ('start', ('name', 'code'))
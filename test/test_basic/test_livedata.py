@@ -0,0 +1,96 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2020 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+
+"""Tests for the encoding of live data frames."""
+
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+import pytest
+
+from nicos.protocols.daemon.livedata import FLAG_DELTA, FRAME_HEADER, \
+    LiveFrame, LiveFrameDecoder, LiveFrameEncoder
+from nicos.pycompat import memory_buffer
+
+
+def frames(dtype, n):
+    arr = np.zeros((64, 64), dtype)
+    previous = None
+    for i in range(n):
+        arr[i, i:] += 7
+        # the buffer is reused, like detectors do
+        frame = LiveFrame(('det', 0), dtype, memory_buffer(arr), previous)
+        previous = frame
+        yield frame, arr.tobytes()
+
+
+def flags(data):
+    return FRAME_HEADER.unpack_from(data)[0]
+
+
+@pytest.mark.parametrize('dtype', ['<u4', '<i2', '|u1', '<f8'])
+def test_roundtrip(dtype):
+    encoder = LiveFrameEncoder(['zlib', 'delta'])
+    decoder = LiveFrameDecoder()
+    for i, (frame, expected) in enumerate(frames(dtype, 10)):
+        data = encoder.encode(frame)
+        assert len(data) < len(expected)
+        # only integer frames are delta encoded, after the first one
+        assert bool(flags(data) & FLAG_DELTA) == \
+            (i > 0 and dtype != '<f8')
+        assert bytes(decoder.decode(data)) == expected
+
+
+def test_per_client():
+    delta = LiveFrameEncoder(['zlib', 'delta'])
+    plain = LiveFrameEncoder(['zlib'])
+    late = LiveFrameEncoder(['zlib', 'delta'])
+    decoders = {}
+    for i, (frame, expected) in enumerate(frames('<u4', 5)):
+        clients = [delta, plain]
+        if i >= 2:
+            clients.append(late)
+        for encoder in clients:
+            data = encoder.encode(frame)
+            # a client that missed the previous frame gets a full frame
+            assert bool(flags(data) & FLAG_DELTA) == \
+                (encoder is delta and i > 0 or encoder is late and i > 2)
+            decoder = decoders.setdefault(encoder, LiveFrameDecoder())
+            assert bytes(decoder.decode(data)) == expected
+        # encodings are only created once for all clients
+        assert frame.encode(False) is frame.encode(False)
+
+
+def test_missing_base():
+    encoder = LiveFrameEncoder(['zlib', 'delta'])
+    data = [encoder.encode(frame) for frame, _ in frames('<u4', 2)]
+    with pytest.raises(ValueError):
+        LiveFrameDecoder().decode(data[1])
+
+
+def test_no_array():
+    frame = LiveFrame(('det', 0), '', b'')
+    assert LiveFrameEncoder(['zlib']).encode(frame) == b''
+    assert LiveFrameDecoder().decode(b'') == b''
+    # data not matching the given type is sent as bytes
+    frame = LiveFrame(('det', 0), '<u4', b'abc')
+    data = LiveFrameEncoder(['zlib', 'delta']).encode(frame)
+    assert bytes(LiveFrameDecoder().decode(data)) == b'abc'
@@ -0,0 +1,41 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2020 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+
+"""Tests for the time series of the history plots."""
+
+from __future__ import absolute_import, division, print_function
+
+import numpy
+
+from nicos.guisupport.timeseries import TimeSeries
+
+
+def test_init_from_history_iterator():
+    # values with gaps, so that points are synthesized in between
+    history = [(1000 + 30 * i, float(i % 7)) for i in range(1000)]
+    endtime = history[-1][0] + 100
+    fromlist = TimeSeries('a', 1, 1, 0, 3600, None)
+    fromlist.init_from_history(history, 1000, endtime)
+    fromiter = TimeSeries('b', 1, 1, 0, 3600, None)
+    fromiter.init_from_history(iter(history), 1000, endtime)
+    assert fromiter.n == fromlist.n > 2 * len(history)
+    assert numpy.array_equal(fromiter.x, fromlist.x)
+    assert numpy.array_equal(fromiter.y, fromlist.y)
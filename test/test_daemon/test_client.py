@@ -24,10 +24,15 @@
 
 from __future__ import absolute_import, division, print_function
 
+import time
+
+import numpy
 import pytest
 
 from nicos import nicos_version
+from nicos.clients.base import NicosClient
 from nicos.core import MASTER
+from nicos.core.data import ScanData
 from nicos.protocols.daemon import STATUS_IDLE
 
 from test.utils import raises
@@ -95,6 +100,25 @@ scan(dax, 0, 0.1, 1, det, "Meßzeit 1000s, d = 5 Å", ctr1=1)
 ''', 'Meßzeit.py')
 
 
+def test_sync_datasets(client):
+    load_setup(client, 'daemontest')
+    client.run_and_wait('scan(dax, 0, 0.1, 3)')
+    try:
+        dataset = client.ask('syncdatasets', {})[-1]
+        assert isinstance(dataset, ScanData)
+        assert len(dataset.xresults) == len(dataset.yresults) == 3
+        # only the points the client doesn't have are sent (the test daemon
+        # uses JSON, which makes lists from tuples)
+        update = client.ask('syncdatasets', {dataset.uid: 1})[-1]
+        assert list(update) == [dataset.uid, 1, dataset.xresults[1:],
+                                dataset.yresults[1:]]
+        assert list(client.ask('syncdatasets', {dataset.uid: 3})[-1]) == \
+            [dataset.uid, 3, [], []]
+    finally:
+        # other tests expect the motor at 0
+        client.run_and_wait('maw(dax, 0)')
+
+
 def test_htmlhelp(client):
     load_setup(client, 'daemontest')
     # NOTE: everything run with 'queue' will not show up in the coverage
@@ -127,6 +151,30 @@ def test_simulation(client):
             return
 
 
+def test_simulation_pool(client):
+    load_setup(client, 'daemontest')
+    client.run_and_wait('from nicos import config\n'
+                        'config.simulation_pool_size = 1', 'pool.py')
+    for i in (1, 2):
+        idx = len(client._signals)
+        client.tell('simulate', '', 'maw(dm2, %d)' % i, 'pool%d' % i)
+        for name, data, _exc in client.iter_signals(idx, timeout=20.0):
+            if name == 'simresult' and data[2] == 'pool%d' % i:
+                assert data[1]['dm2'][0] == '%.3f' % i
+                break
+        if i == 1:
+            # the first dry run started the pool; let its process finish
+            # loading, so that the second dry run is run by it
+            start = time.time()
+            while not client.eval('session._simulation_pool.readyCount()'):
+                assert time.time() < start + 20
+                time.sleep(0.1)
+            pooled = client.eval('session._simulation_pool._workers[0][1].pid')
+    # the pooled process has run the dry run, and has been replaced
+    assert client.eval('[w[1].pid for w in session._simulation_pool._workers]'
+                       ) not in ([], [pooled])
+
+
 def test_dualaccess(client, adminclient):
     load_setup(client, 'daemontest')
     adminclient.run('fix(dm2, "test")', 'adminfix')
@@ -159,6 +207,51 @@ def test_get_device_list(client):
     assert 'testnotifier' not in l2
 
 
+def test_history(client):
+    # the test daemon has no cache, but the arguments must be accepted
+    assert client.ask('gethistory', 'dev/value', '0', '1') == []
+    assert client.ask('gethistory', 'dev/value', '0', '1', '10') == []
+    assert list(client.ask_chunks('gethistory', 'dev/value', '0', '1', None,
+                                  '100')) == []
+    assert client.ask('getversion') == nicos_version
+
+
+class ChunkTransport(object):
+    """Transport that replies to "gethistory" with three chunks."""
+
+    def __init__(self):
+        self.replies = []
+
+    def send_command(self, command, args):
+        if command == 'gethistory':
+            self.replies.extend([(True, [1]), (True, [2]), (True, [3]),
+                                 (True, [])])
+        else:
+            self.replies.append((True, command))
+
+    def recv_reply(self):
+        return self.replies.pop(0)
+
+
+def test_ask_chunks_streaming():
+    client = NicosClient(print)
+    client.transport = ChunkTransport()
+    client.isconnected = True
+    chunks = client.ask_chunks('gethistory')
+    assert next(chunks) == [1]
+    # the remaining chunks are only received when they are needed
+    assert len(client.transport.replies) == 3
+    # other commands can be sent while the chunks are consumed
+    assert client.ask('getversion') == 'getversion'
+    assert list(chunks) == [[2], [3]]
+    # stopping early skips the rest of the response
+    chunks = client.ask_chunks('gethistory')
+    assert next(chunks) == [1]
+    chunks.close()
+    assert client.ask('getversion') == 'getversion'
+    assert not client.transport.replies
+
+
 def test_live_events(client):
     idx = len(client._signals)
     client.run_and_wait('''\
@@ -170,14 +263,119 @@ session.updateLiveData(
     'Live', 'uid', 'detname',
     ['file.name'], '<u1', [2], [2], [1], 12345,
     [memory_buffer(arr)])
+arr[0, 0] = 5
+session.updateLiveData(
+    'Live', 'uid', 'detname',
+    ['file.name'], '<u1', [2], [2], [1], 12346,
+    [memory_buffer(arr)])
 ''', 'live.py')
+    # the client selects compressed and delta encoded frames
+    assert client.live_decoder
+    frames = []
     for name, data, _exc in client.iter_signals(idx, timeout=10.0):
         if name == 'liveparams':
-            assert data == ['Live', 'uid', 'detname', ['file.name'], '<u1',
-                            [2], [2], [1], 12345]
+            assert data[:4] == ['Live', 'uid', 'detname', ['file.name']]
+            assert data[4:8] == ['<u1', [2], [2], [1]]
         elif name == 'livedata':
-            assert bytes(data) == b'\x01\x02\x03\x04'
-            return
+            frames.append(bytes(data))
+            if len(frames) == 2:
+                break
+    assert frames == [b'\x01\x02\x03\x04', b'\x05\x02\x03\x04']
+
+
+def test_conflated_live_events(client):
+    assert client.ask('eventconflate', ['livedata', 'other'], 5) == \
+        ['livedata']
+    idx = len(client._signals)
+    client.run_and_wait('''\
+import numpy
+from nicos import session
+from nicos.pycompat import memory_buffer
+arr = numpy.zeros(4, dtype='<u2')
+for i in range(20):
+    arr[0] = i
+    session.updateLiveData(
+        'Live', 'uid', 'detname',
+        ['file.name'], '<u2', [4], [1], [1], i,
+        [memory_buffer(arr)])
+''', 'live.py')
+    frames = []
+    for name, data, _exc in client.iter_signals(idx, timeout=10.0):
+        if name == 'livedata':
+            frames.append(numpy.frombuffer(data, '<u2')[0])
+            if frames[-1] == 19:
+                break
+    # with at most 5 per second, outdated frames are dropped
+    assert len(frames) < 20
+    stats = [entry for entry in client.ask('geteventstats')
+             if entry['conflated'] == ['livedata']]
+    assert len(stats) == 1
+    assert stats[0]['dropped']['livedata'] == 20 - len(frames)
+
+
+def test_eventstats_own_client(client):
+    # non-admin users only see the statistics of their own connection
+    stats = client.ask('geteventstats')
+    assert len(stats) == 1
+    assert stats[0]['user'] == 'user'
+
+
+def test_cache_subscriptions(client):
+    client.subscribeCacheKeys(['Sub/', 'other/value'])
+    client.unsubscribeCacheKeys(['other/value'])
+    idx = len(client._signals)
+    client.run_and_wait('''\
+from nicos import session
+for key in ['sub/value', 'other/value', 'nosub/value', 'sub/status']:
+    session.emitfunc('cache', (0, key, '=', '1'))
+''', 'cache.py')
+    keys = []
+    for name, data, _exc in client.iter_signals(idx, timeout=10.0):
+        if name == 'cache':
+            keys.append(data[1])
+            if data[1] == 'sub/status':
+                break
+    # "nosub/value" contains "sub/", but not "other/value"
+    assert keys == ['sub/value', 'nosub/value', 'sub/status']
+    assert [entry['cachekeys'] for entry in client.ask('geteventstats')
+            if entry['cachekeys']] == [['sub/']]
+
+    client.unsubscribeCacheKeys()
+    idx = len(client._signals)
+    client.run_and_wait('''\
+from nicos import session
+session.emitfunc('cache', (0, 'other/value', '=', '1'))
+''', 'cache.py')
+    for name, data, _exc in client.iter_signals(idx, timeout=10.0):
+        if name == 'cache' and data[1] == 'other/value':
+            break
+
+
+def test_cache_batches(client):
+    client.ask('eventbatch', 0.2)
+    try:
+        idx = len(client._signals)
+        client.run_and_wait('''\
+from nicos import session
+for value in range(5):
+    for key in ['batch/value', 'batch/status']:
+        session.emitfunc('cache', (0, key, '=', str(value)))
+session.emitfunc('cache', (0, 'batch/done', '=', '1'))
+''', 'cache.py')
+        values = {}
+        for name, data, _exc in client.iter_signals(idx, timeout=10.0):
+            if name == 'cache' and data[1].startswith('batch/'):
+                values.setdefault(data[1], []).append(data[3])
+                if data[1] == 'batch/done':
+                    break
+        # the events of the script are sent in one batch, with only the last
+        # value of each key
+        assert values == {'batch/value': ['4'], 'batch/status': ['4'],
+                          'batch/done': ['1']}
+        assert [entry['batchwindow'] for entry in client.ask('geteventstats')
+                if entry['batchwindow']] == [0.2]
+    finally:
+        client.ask('eventbatch', 0)
 
 
 def test_abort(client):
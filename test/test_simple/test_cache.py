@@ -232,3 +232,62 @@ class TestCache(object):
             assert raises(LimitError, wrt1.move, 500)
         finally:
             cc2.shutdown()
+
+    def test_coalescing(self, session):
+        cc = session.cache
+        cc2 = CacheClient(name='cache2', prefix='nicos', cache=cache_addr,
+                          coalescewindow=0.05)
+        try:
+            cc2.waitForStartup(5)
+            for i in range(100):
+                cc2.put('testcache', 'coalesced', i)
+            cc2.put('testcache', 'other', 'x')
+            cc2.flush()
+            assert cc.get_explicit('testcache', 'coalesced')[2] == 99
+            assert cc.get_explicit('testcache', 'other')[2] == 'x'
+            counters = cc2.getCounters()
+            assert counters['lines_coalesced'] > 0
+            assert counters['syscalls_saved'] > 0
+            assert counters['lines_sent'] + counters['lines_coalesced'] >= 102
+        finally:
+            cc2.shutdown()
+
+    def test_device_values(self, session):
+        cc = session.cache
+        cc.setRewrite('testbulkrw', 'testbulk')
+        try:
+            cc.put_many('TestBulk', {'value': 1.5, 'speed': 2})
+            cc.flush()
+            assert cc.get_device_values('testbulk') == {'value': 1.5,
+                                                        'speed': 2}
+            assert cc.get_explicit('testbulk', 'speed')[2] == 2
+            # also written for the rewritten device
+            assert cc.get_device_values('testbulkrw') == {'value': 1.5,
+                                                          'speed': 2}
+            cc.invalidate('testbulk', 'speed')
+            assert cc.get_device_values('testbulk') == {'value': 1.5}
+        finally:
+            cc.unsetRewrite('testbulkrw')
+
+        called = []
+
+        def callback(key, value, time):
+            called.append((key, value))
+        callbacks = [('value', callback), ('Speed', callback)]
+        cc.addCallbacks('testbulk', callbacks)
+        cc2 = CacheClient(name='cache2', prefix='nicos', cache=cache_addr)
+        try:
+            cc2.waitForStartup(5)
+            cc2.put('testbulk', 'speed', 3)
+            cc2.flush()
+            sleep(0.2)
+            assert called == [('testbulk/speed', 3)]
+            cc.removeCallbacks('testbulk', callbacks)
+            cc2.put('testbulk', 'value', 4)
+            cc2.flush()
+            sleep(0.2)
+            assert called == [('testbulk/speed', 3)]
+            assert cc.get_device_values('testbulk') == {'value': 4,
+                                                        'speed': 3}
+        finally:
+            cc2.shutdown()
@@ -31,7 +31,7 @@ from __future__ import absolute_import, division, print_function
 import pytest
 
 from nicos.core.errors import ComputationError, MoveError, NicosTimeoutError
-from nicos.core.utils import multiWait
+from nicos.core.utils import StatusWaiter, multiWait, notifyStatusChange
 
 from test.utils import raises
 
@@ -87,3 +87,20 @@ class TestMultiWait(object):
 
         with log.assert_errors(regex=".*multi_dev1.*", count=1):
             assert raises(ComputationError, multiWait, [dev1, dev2, dev3, dev4])
+
+    def test_status_waiter(self, devices):
+        dev1, dev2, dev3, _ = devices
+        with StatusWaiter([dev1, dev2]) as waiter:
+            notifyStatusChange('dev3')
+            assert not waiter.event.is_set()
+            notifyStatusChange('DEV2')
+            assert waiter.event.is_set()
+            waiter.delay(10)
+            assert waiter.wakeups == 1
+            assert not waiter.event.is_set()
+            # devices that are done are not waited for anymore
+            waiter.update([dev1])
+            notifyStatusChange('dev2')
+            assert not waiter.event.is_set()
+        notifyStatusChange('dev1')
+        assert not waiter.event.is_set()
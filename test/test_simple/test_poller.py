@@ -0,0 +1,135 @@
+#  -*- coding: utf-8 -*-
+# *****************************************************************************
+# NICOS, the Networked Instrument Control System of the MLZ
+# Copyright (c) 2009-2020 by the NICOS contributors (see AUTHORS)
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+# *****************************************************************************
+
+"""NICOS poller test suite."""
+
+from __future__ import absolute_import, division, print_function
+
+from time import sleep
+
+import pytest
+
+from nicos.protocols.cache import FLAG_NO_STORE
+from nicos.services.poller import Poller
+from nicos.services.poller.stats import STATS_PREFIX, format_stats, \
+    query_stats
+
+from test.utils import cache_addr, group_requests
+
+session_setup = 'axis'
+
+
+def start_poller(session, setup, scheduler):
+    poller = Poller('Poller', alwayspoll=[], scheduler=scheduler, workers=2)
+    poller.start(setup)
+    yield poller
+    poller.quit()
+    session.destroyDevice('Poller')
+
+
+@pytest.fixture(params=[False, True], ids=['threads', 'scheduler'])
+def poller(session, request):
+    for poller in start_poller(session, 'axis', request.param):
+        yield poller
+
+
+@pytest.fixture(params=[False, True], ids=['threads', 'scheduler'])
+def group_poller(session, request):
+    del group_requests[:]
+    for poller in start_poller(session, 'pollgroup', request.param):
+        yield poller
+
+
+def test_poll_devices(poller):
+    # the devices are started staggered
+    sleep(1.5)
+    if poller.scheduler:
+        tasks = poller._scheduler.tasks
+        # the alias is not polled
+        assert 'aliasaxis' not in tasks
+        assert 'axis' in tasks
+        for task in tasks.values():
+            assert task.errstate[0] == 0
+            assert task.stats.count > 0
+    else:
+        assert poller._workers['axis'].is_alive()
+        assert not poller._workers['aliasaxis'].is_alive()
+
+
+def test_events(poller):
+    if not poller.scheduler:
+        pytest.skip('only for the scheduler')
+    sleep(1.5)
+    task = poller._scheduler.tasks['axis']
+    runs = task.stats.count
+    # an attached device going busy triggers a poll
+    poller._notify('axis', 'adev_busy')
+    sleep(0.5)
+    assert task.stats.count > runs
+    assert not task.events
+
+
+def test_stats(session, poller):
+    sleep(1.5)
+    info = poller._stats['axis'].summary()
+    assert info['count'] > 0
+    assert info['errors'] == 0
+    assert 0 <= info['p50'] <= info['p99']
+    if poller.scheduler:
+        assert info['lag_max'] >= 0
+    assert 'aliasaxis' not in poller._stats or \
+        poller._stats['aliasaxis'].count == 0
+
+    # the dump of the nicos-poller script
+    info['setup'] = 'axis'
+    session.cache.put_raw(STATS_PREFIX + 'axis', info, ttl=10,
+                          flag=FLAG_NO_STORE)
+    session.cache.flush()
+    stats = query_stats(cache_addr)
+    assert stats['axis'] == info
+    lines = format_stats(stats, 1)
+    assert len(lines) == 2
+    assert lines[1].split()[:3] == ['axis', 'axis', str(info['count'])]
+
+
+def test_poll_group(session, group_poller):
+    sleep(0.5)
+    # the devices of the group are polled with one request, except for the
+    # one with polling disabled
+    assert sorted(group_requests, key=str) == \
+        [('sensor1', 'sensor2'), 'single']
+    assert group_poller._leaders == {'sensor1': 'sensor1',
+                                     'sensor2': 'sensor1',
+                                     'sensor3': 'sensor1'}
+    if group_poller.scheduler:
+        assert sorted(group_poller._scheduler.tasks) == ['sensor1', 'single']
+    else:
+        assert sorted(group_poller._workers) == ['sensor1', 'single']
+
+    sensor2 = session.getDevice('sensor2')
+    sensor2._value = 5
+    session.cache.invalidate(sensor2, 'value')
+    # triggers a poll of the group
+    group_poller._notify('sensor2', 'adev_normal')
+    sleep(0.5)
+    # the new value is read by the group request
+    assert group_requests[-1] == ('sensor1', 'sensor2')
+    assert session.cache.get(sensor2, 'value') == 5
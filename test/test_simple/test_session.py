@@ -27,11 +27,14 @@
 from __future__ import absolute_import, division, print_function
 
 from os import path
+from time import time as currenttime
 
+from nicos import config
 from nicos.core import ConfigurationError
-from nicos.core.sessions.setups import readSetups
+from nicos.core.sessions import setups
+from nicos.core.sessions.setups import SetupCache, readSetups
 
-from test.utils import ErrorLogged, module_root, raises
+from test.utils import ErrorLogged, created_devices, module_root, raises
 
 session_setup = 'empty'
 
@@ -62,7 +65,68 @@ def test_sysconfig(session):
     assert 'datasinks' not in session.current_sysconfig
 
 
+def test_parallel_creation(session, monkeypatch):
+    monkeypatch.setattr(config, 'device_creation_threads', 4)
+    del created_devices[:]
+    started = currenttime()
+    session.loadSetup('parallelcreate', autocreate_devices=True)
+    try:
+        # the independent devices are created at the same time, the others
+        # after their attached devices
+        assert currenttime() - started < 1.5
+        assert sorted(created_devices[:4]) == ['slow1', 'slow2', 'slow3',
+                                               'slow4']
+        assert created_devices[4:] == ['combined', 'another']
+        combined = session.getDevice('combined')
+        assert combined._attached_devs == [session.getDevice('slow%d' % i)
+                                           for i in range(1, 5)]
+        assert combined._sdevs == {'another'}
+        assert 'combined' in session.namespace
+        assert 'another' not in session.namespace
+        assert not session._creating
+    finally:
+        session.unloadSetup()
+
+
 def test_device_names(session):
     assert raises(ErrorLogged, readSetups,
                   [path.join(module_root, 'test', 'faulty_setups')],
                   session.log)
+
+
+def test_setup_cache(session, tmpdir, monkeypatch):
+    # the persistent cache must be enabled in nicos.conf
+    assert session._setup_cache is None
+
+    setupdir = tmpdir.mkdir('setups')
+    setupdir.join('cached.py').write(
+        "description = 'cached setup'\n"
+        "devices = dict(dev = device('nicos.devices.generic.VirtualMotor',"
+        " unit = configdata('cachedconfig.UNIT')))\n")
+    config = setupdir.join('cachedconfig.py')
+    config.write("UNIT = 'mm'\n")
+
+    executed = []
+    orig_exec = setups.exec_
+
+    def counting_exec(code, ns):
+        executed.append(ns.get('setupname'))
+        return orig_exec(code, ns)
+    monkeypatch.setattr(setups, 'exec_', counting_exec)
+
+    cachefile = str(tmpdir.join('setupcache', 'setupinfo.pickle'))
+    info = readSetups([str(setupdir)], session.log, SetupCache(cachefile))
+    assert info['cached']['devices']['dev'][1]['unit'] == 'mm'
+    assert path.isfile(cachefile)
+    assert executed.count('cached') == 1
+
+    # a new cache instance reads the entries from the file
+    cache = SetupCache(cachefile)
+    assert readSetups([str(setupdir)], session.log, cache) == info
+    assert executed.count('cached') == 1
+
+    # changing a file read with configdata() invalidates the entry
+    config.write("UNIT = 'deg'\n")
+    info = readSetups([str(setupdir)], session.log, cache)
+    assert info['cached']['devices']['dev'][1]['unit'] == 'deg'
+    assert executed.count('cached') == 2
@@ -27,11 +27,14 @@
 from __future__ import absolute_import, division, print_function
 
 import os
-from time import sleep
+import threading
+from time import sleep, time as currenttime
 
 import pytest
 
 from nicos.devices.cacheclient import CacheError
+from nicos.protocols.cache import cache_dump_binary
+from nicos.utils import closeSocket, tcpSocket
 
 from test.utils import TestCacheClient as CacheClient, alt_cache_addr, \
     killSubprocess, raises, startCache
@@ -40,7 +43,8 @@ session_setup = 'cachestress'
 
 
 def all_setups():
-    for setup in ['cache_db', 'cache_mem', 'cache_mem_hist']:
+    for setup in ['cache_db', 'cache_mem', 'cache_mem_hist',
+                  'cache_mem_sharded', 'cache_eventloop', 'cache_binary']:
         yield setup
 
     if os.environ.get('KAFKA_URI', None):
@@ -99,3 +103,141 @@ def test_restart(session, setup):
         assert cachedval2[2] == testval
     finally:
         killSubprocess(cache)
+
+
+@pytest.mark.parametrize('setup', ['cache_db', 'cache_eventloop',
+                                   'cache_binary'])
+def test_history(session, setup):
+    cache = startCache(alt_cache_addr, setup)
+    try:
+        sleep(1)
+        cc = session.cache
+        start = currenttime() - 100
+        for i in range(50):
+            cc.put(setup, 'hist', i, time=start + i)
+        cc.flush()
+        hist = cc.history(setup, 'hist', start + 10.5, start + 20)
+        assert [value for (_, value) in hist] == list(range(10, 21))
+        # two intervals, with first/last/min/max each
+        hist = cc.history(setup, 'hist', start, start + 49, maxpoints=8)
+        assert [value for (_, value) in hist] == [0, 24, 25, 49]
+        # the values can be consumed while they are received, without
+        # blocking other requests; stopping early must not disturb the next
+        # requests
+        hist = cc.history_iter(setup, 'hist', start, start + 49)
+        assert next(hist) == (start, 0)
+        assert cc.get_explicit(setup, 'hist')[2] == 49
+        hist.close()
+        hist = cc.history_iter(setup, 'hist', start + 10.5, start + 20)
+        assert [value for (_, value) in hist] == list(range(10, 21))
+        assert cc.get_explicit(setup, 'hist')[2] == 49
+    finally:
+        killSubprocess(cache)
+    # the history is still there after a restart
+    cache = startCache(alt_cache_addr, setup)
+    try:
+        sleep(1)
+        hist = session.cache.history(setup, 'hist', start + 45.5,
+                                     start + 60)
+        assert [value for (_, value) in hist] == [45, 46, 47, 48, 49]
+    finally:
+        killSubprocess(cache)
+
+
+def request(sock, lines):
+    """Send lines to the cache and wait until they are processed."""
+    sock.sendall(lines + b'###?\n')
+    data = b''
+    while not data.endswith(b'###!\n'):
+        newdata = sock.recv(65536)
+        assert newdata, 'cache closed connection'
+        data += newdata
+    return data
+
+
+@pytest.mark.parametrize('setup', ['cache_mem', 'cache_mem_sharded'])
+def test_tell_throughput(setup):
+    cache = startCache(alt_cache_addr, setup)
+    try:
+        sleep(1)
+        writer = tcpSocket(alt_cache_addr, 0)
+        reader = tcpSocket(alt_cache_addr, 0)
+        # fill the database, so that wildcard queries take some time
+        request(writer, b''.join(b'nicos/dev%d/param%d=%d\n' % (i, j, j)
+                                 for i in range(200) for j in range(50)))
+        nqueries = [0]
+        # failures in the thread are checked in the main thread
+        failures = []
+        done = threading.Event()
+
+        def query():
+            while not done.is_set():
+                try:
+                    reply = request(reader, b'nicos/*\n')
+                except Exception as err:
+                    failures.append(repr(err))
+                    return
+                if reply.count(b'\n') <= 10000:
+                    failures.append('short reply: %d lines' %
+                                    reply.count(b'\n'))
+                nqueries[0] += 1
+
+        thread = threading.Thread(target=query)
+        thread.start()
+        try:
+            ntells = 20000
+            start = currenttime()
+            for n in range(0, ntells, 1000):
+                request(writer, b''.join(b'nicos/dev%d/value=%d\n' % (i, i)
+                                         for i in range(n, n + 1000)))
+            elapsed = currenttime() - start
+        finally:
+            done.set()
+            thread.join()
+        print('%s: %d tells/s with %d concurrent wildcard queries' %
+              (setup, ntells / elapsed, nqueries[0]))
+        assert not failures
+        assert nqueries[0] > 0
+        reply = request(writer, b'nicos/dev%d/value?\n' % (ntells - 1))
+        assert reply.startswith(b'nicos/dev%d/value=%d\n' % (ntells - 1,
+                                                            ntells - 1))
+        closeSocket(reader)
+        closeSocket(writer)
+    finally:
+        killSubprocess(cache)
+
+
+@pytest.mark.parametrize('setup', ['cache_mem', 'cache_db', 'cache_binary'])
+def test_binary_values(setup):
+    cache = startCache(alt_cache_addr, setup)
+    try:
+        sleep(1)
+        binclient = tcpSocket(alt_cache_addr, 0)
+        textclient = tcpSocket(alt_cache_addr, 0)
+        assert request(binclient, b'#codec#?binary\n') == \
+            b'#codec#=binary\n###!\n'
+        # unknown encodings are refused
+        assert request(textclient, b'#codec#?msgpack\n') == \
+            b'#codec#!\n###!\n'
+        request(textclient, b'nicos/bintest:\n')
+        value = cache_dump_binary([1.5, 2.5]).encode()
+        request(binclient, b'nicos/bintest/value=' + value + b'\n')
+        # the text client gets updates and replies in the text encoding
+        reply = request(textclient, b'nicos/bintest/value?\n')
+        assert reply == b'nicos/bintest/value=[1.5,2.5,]\n' \
+            b'nicos/bintest/value=[1.5,2.5,]\n###!\n'
+        reply = request(textclient, b'nicos/bintest/*\n')
+        assert reply == b'nicos/bintest/value=[1.5,2.5,]\n###!\n'
+        # values are stored in the text encoding, also for the binary client
+        reply = request(binclient, b'nicos/bintest/value?\n')
+        assert reply == b'nicos/bintest/value=[1.5,2.5,]\n###!\n'
+        # and a text client writing the same value is not a new entry
+        request(textclient, b'nicos/bintest/value=[1.5,2.5,]\n')
+        reply = request(binclient, b'0-%r@nicos/bintest/value?\n' %
+                        (currenttime() + 10))
+        assert reply.count(b'[1.5,2.5,]') == (0 if setup == 'cache_mem'
+                                              else 1)
+        closeSocket(binclient)
+        closeSocket(textclient)
+    finally:
+        killSubprocess(cache)
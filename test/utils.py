@@ -44,7 +44,8 @@ import pytest
 
 from nicos import config
 from nicos.core import ACCESS_LEVELS, AccessError, Attach, DataSink, \
-    DataSinkHandler, HasLimits, Moveable, status, system_user
+    DataSinkHandler, Device, HasLimits, Moveable, Param, Readable, status, \
+    system_user
 from nicos.core.mixins import IsController
 from nicos.core.sessions import Session
 from nicos.devices.abstract import CanReference
@@ -354,7 +355,7 @@ class TestSession(Session):
             return
         exec_(code, self.namespace)
 
-    def delay(self, _secs):
+    def delay(self, _secs, _event=None):
         # TODO: this sleep shouldn't be necessary
         sleep(0.0001)
 
@@ -455,6 +456,53 @@ class TestController(IsController, Moveable):
         self._attached_dev2.start(target[1])
 
 
+# requests of the TestGroupSensors to their controller
+group_requests = []
+
+
+class TestGroupSensor(Readable):
+
+    def doInit(self, mode):
+        self._value = 0
+
+    def doRead(self, maxage=0):
+        if self._prefetched is not None:
+            return self._prefetched['value']
+        group_requests.append(self.name)
+        return self._value
+
+    def doStatus(self, maxage=0):
+        return status.OK, ''
+
+    def doPrefetchGroup(self, devices):
+        group_requests.append(tuple(dev.name for dev in devices))
+        return {dev: {'value': dev._value} for dev in devices}
+
+
+# names of the TestSlowDevices, in the order their creation finished
+created_devices = []
+
+
+class TestSlowDevice(Device):
+    """Device that takes some time to connect to its hardware."""
+
+    parameters = {
+        'initdelay': Param('Time to connect', type=float, default=0,
+                           preinit=True),
+    }
+
+    attached_devices = {
+        'devs': Attach('Devices used by this one', Device, multiple=True,
+                       optional=True),
+    }
+
+    def doPreinit(self, mode):
+        sleep(self.initdelay)
+
+    def doInit(self, mode):
+        created_devices.append(self.name)
+
+
 class TestSinkHandler(DataSinkHandler):
 
     def __init__(self, sink, dataset, detector):